@@ -1,23 +1,22 @@
 """
-This is the basic runner for structuring graphs and performing ML over graphs
+This is the basic runner for structuring graphs and performing ML over graphs. Run it from the command line with
+`python runner_bayes_net.py data/heartDisease.csv`, see `python runner_bayes_net.py --help`. It runs headless: nothing
+is plotted unless `--plot` is given, and the wall time of every stage, imports included, is reported on stderr. The
+heavy libraries are only imported by the stages that need them.
 """
-import matplotlib.pyplot as plt
-import networkx as nx
-from networkx.algorithms import tree
+import time
+
+_START = time.perf_counter()
+
+import argparse
+from contextlib import contextmanager
+import sys
+from typing import Dict, Optional
+
 import pandas as pd
-from sklearn.metrics import mutual_info_score
-
-from utils.evaluation import query_bayesian_network
-from utils.graphs.probability import get_pomegranate_states_from_directed_edges
-from utils.graphs.structuring import get_directed_edges
-from utils.load.data_importing import import_csv_data
-from utils.modelling.bayes_model import get_bayesian_network
-from utils.preprocessing.generic_preprocessing import (
-    reduce_data_frame_to_numeric_columns,
-    bin_numeric_data,
-    reduce_data_frame_to_categorical_columns,
-)
-from utils.preprocessing.bespoke_preprocessing import convert_columns_to_correct_types
+
+from utils.load.data_importing import HEART_DISEASE_SCHEMA, import_data
+from utils.profiling import cprofile_run, disable_profiling, enable_profiling, profile_stage, write_profile_report
 
 sample_dict = {
     'Age_5bin': '3',
@@ -33,26 +32,450 @@ sample_dict = {
 }
 
 
-def runner(data_frame: pd.DataFrame, target: str):
-    heart_disease_df = convert_columns_to_correct_types(data_frame)
-    numeric_df = reduce_data_frame_to_numeric_columns(heart_disease_df)
-    numeric_df = bin_numeric_data(numeric_df, 5)
-    categorical_df = reduce_data_frame_to_categorical_columns(heart_disease_df, list(numeric_df.columns))
-    training_df = numeric_df.join(categorical_df)
-    correlation_matrix = training_df.corr(method=mutual_info_score)
-    del categorical_df
-    del numeric_df
-    graph = tree.maximum_spanning_tree(nx.from_pandas_adjacency(correlation_matrix))
+@contextmanager
+def timed_stage(timings: Optional[Dict[str, float]], stage: str):
+    """Adds the wall time spent inside the `with` block to `timings[stage]`, does nothing if `timings` is None. The
+    block is also recorded as a stage by `utils.profiling` when profiling is enabled."""
+    start = time.perf_counter()
+    try:
+        with profile_stage(stage):
+            yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+
+
+def plot_graph(graph, plot: str):
+    """Draws the graph, showing it in a window if `plot` is "show" and otherwise saving it to the file `plot`."""
+    import matplotlib
+
+    if plot != "show":
+        matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
     nx.draw(graph, with_labels=True)
-    plt.show()
-    directed_edge_list = get_directed_edges(graph, target)
-    state_dict = get_pomegranate_states_from_directed_edges(training_df, directed_edge_list)
-    model, state_name_order = get_bayesian_network(state_dict, directed_edge_list)
-    query = query_bayesian_network(model, sample_dict)
+    if plot == "show":
+        plt.show()
+    else:
+        plt.savefig(plot)
+    plt.close()
+
+
+def cached_stage(stage_cache, key_parts: tuple, compute):
+    """Runs a stage, or loads its output from the `stage_cache` when the stage has already run on the same inputs, see
+    `utils.modelling.stage_cache`. Returns the output and the fingerprint of the inputs, for the stages after it to
+    fingerprint their own inputs with."""
+    if stage_cache is None:
+        return compute(), None
+    from utils.modelling.stage_cache import get_fingerprint
+
+    key = get_fingerprint(*key_parts)
+    return stage_cache.get_or_compute(key, compute), key
+
+
+def runner(
+    data_frame: pd.DataFrame,
+    target: str,
+    engine: str = "pomegranate",
+    plot: Optional[str] = None,
+    timings: Optional[Dict[str, float]] = None,
+    n_jobs: int = 1,
+    structure: str = "networkx",
+    top_k: int = 10,
+    binning: str = "uniform",
+    stage_cache=None,
+):
+    with timed_stage(timings, "import"):
+        import networkx as nx
+        from networkx.algorithms import tree
+
+        from utils.evaluation import query_bayesian_network
+        from utils.graphs.mutual_information import get_mutual_information_matrix, get_top_k_mutual_information
+        from utils.graphs.probability import get_family_counts_from_directed_edges, get_pomegranate_states_from_counts
+        from utils.graphs.structuring import (
+            get_approximate_maximum_spanning_tree,
+            get_directed_edges,
+            get_maximum_spanning_tree,
+        )
+        from utils.modelling.bayes_model import get_bayesian_network
+        from utils.modelling.inference import compile_bayesian_network
+        from utils.preprocessing.generic_preprocessing import (
+            reduce_data_frame_to_numeric_columns,
+            bin_numeric_data,
+            reduce_data_frame_to_categorical_columns,
+        )
+        from utils.preprocessing.bespoke_preprocessing import convert_columns_to_correct_types
+        from utils.preprocessing.binning import fit_bin_edges
+
+    def preprocess():
+        heart_disease_df = convert_columns_to_correct_types(data_frame)
+        numeric_df = reduce_data_frame_to_numeric_columns(heart_disease_df)
+        numeric_df = bin_numeric_data(numeric_df, 5, fit_bin_edges(numeric_df, 5, binning, heart_disease_df[target]))
+        categorical_df = reduce_data_frame_to_categorical_columns(
+            heart_disease_df, list(numeric_df.columns), unique_value_limit=15
+        )
+        return numeric_df.join(categorical_df)
+
+    def get_mutual_information():
+        if structure == "top-k":
+            return get_top_k_mutual_information(training_df, top_k)
+        return get_mutual_information_matrix(training_df, n_jobs=n_jobs)
+
+    def get_tree_edges():
+        if structure == "top-k":
+            graph = get_approximate_maximum_spanning_tree(*mutual_information, list(training_df.columns))
+        elif structure == "prim":
+            graph = get_maximum_spanning_tree(mutual_information.to_numpy(), list(mutual_information.columns))
+        else:
+            graph = tree.maximum_spanning_tree(nx.from_pandas_adjacency(mutual_information))
+        return [list(edge) for edge in graph.edges()]
+
+    # Only supervised binning looks at the target, so the other stages are reused when just the target changes
+    with timed_stage(timings, "preprocessing"):
+        preprocessing_parameters = {
+            "bins": 5,
+            "unique_value_limit": 15,
+            "binning": binning,
+            "target": target if binning == "supervised" else None,
+        }
+        training_df, preprocessing_key = cached_stage(
+            stage_cache, ("preprocessing", data_frame, preprocessing_parameters), preprocess
+        )
+    with timed_stage(timings, "mutual information"):
+        mutual_information, mutual_information_key = cached_stage(
+            stage_cache,
+            (
+                "mutual information",
+                preprocessing_key,
+                structure,
+                top_k if structure == "top-k" else None,
+            ),
+            get_mutual_information,
+        )
+    with timed_stage(timings, "structure"):
+        tree_edges, _ = cached_stage(stage_cache, ("structure", mutual_information_key, structure), get_tree_edges)
+        graph = nx.Graph()
+        graph.add_nodes_from(training_df.columns)
+        graph.add_edges_from(tree_edges)
+        directed_edge_list = get_directed_edges(graph, target)
+    if plot is not None:
+        with timed_stage(timings, "plot"):
+            plot_graph(graph, plot)
+    with timed_stage(timings, "probabilities"):
+        (family_counts, node_states), _ = cached_stage(
+            stage_cache,
+            ("probabilities", preprocessing_key, directed_edge_list),
+            lambda: get_family_counts_from_directed_edges(training_df, directed_edge_list, n_jobs=n_jobs),
+        )
+        state_dict = get_pomegranate_states_from_counts(family_counts, node_states, directed_edge_list)
+    with timed_stage(timings, "bake"):
+        model, state_name_order = get_bayesian_network(state_dict, directed_edge_list)
+    with timed_stage(timings, "query"):
+        if engine == "exact":
+            query = compile_bayesian_network(model).query(sample_dict)
+        else:
+            query = query_bayesian_network(model, sample_dict)
+    return print(query)
+
+
+def streaming_runner(
+    file_location: str,
+    target: str,
+    chunksize: int = 100_000,
+    timings: Optional[Dict[str, float]] = None,
+    binning: str = "uniform",
+):
+    with timed_stage(timings, "import"):
+        from utils.evaluation import query_bayesian_network
+        from utils.modelling.bayes_model import get_bayesian_network
+        from utils.modelling.streaming import fit_streaming_states
+
+    with timed_stage(timings, "streaming fit"):
+        state_dict, directed_edge_list = fit_streaming_states(
+            file_location, target, 5, chunksize=chunksize, binning=binning
+        )
+    with timed_stage(timings, "bake"):
+        model, state_name_order = get_bayesian_network(state_dict, directed_edge_list)
+    with timed_stage(timings, "query"):
+        query = query_bayesian_network(model, sample_dict)
+    return print(query)
+
+
+def pipeline_runner(pipeline_location: str, timings: Optional[Dict[str, float]] = None, explain: bool = False):
+    with timed_stage(timings, "import"):
+        from utils.modelling.persistence import load_pipeline
+        from utils.modelling.pipeline import get_pipeline_inference_engine
+
+    with timed_stage(timings, "load"):
+        engine = get_pipeline_inference_engine(load_pipeline(pipeline_location, mmap=True))
+    with timed_stage(timings, "query"):
+        query = engine.query_explanation(sample_dict) if explain else engine.query(sample_dict)
     return print(query)
 
 
+def load_data(arguments: argparse.Namespace) -> pd.DataFrame:
+    """Reads the .csv, Parquet or Arrow file, with `HEART_DISEASE_SCHEMA` if --schema is given."""
+    return import_data(arguments.file_location, HEART_DISEASE_SCHEMA if arguments.schema else None, arguments.cache_dir)
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Learns a Bayes net from a .csv file and queries it.")
+    parser.add_argument(
+        "file_location",
+        nargs="?",
+        default="data/heartDisease.csv",
+        help="The .csv, Parquet or Arrow file to learn from.",
+    )
+    parser.add_argument(
+        "--schema",
+        action="store_true",
+        help="Read only the heart disease columns, straight in to their compact dtypes.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Cache the parsed .csv file as an Arrow file in this directory, so later runs on the same file skip "
+        "parsing it.",
+    )
+    parser.add_argument(
+        "--target",
+        default="AHD",
+        help="Node in the network which we point edges to.",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["pomegranate", "exact"],
+        default="pomegranate",
+        help="How to query the network.",
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        help="The number of threads and processes to fit the network with.",
+    )
+    parser.add_argument(
+        "--structure",
+        choices=["networkx", "prim", "top-k"],
+        default="networkx",
+        help="How to find the maximum spanning tree: networkx on the full graph, Prim's algorithm on the mutual "
+        "information array, or only over the --top-k neighbours of each node for very wide data.",
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=10,
+        help="The number of candidate neighbours of each node for --structure top-k.",
+    )
+    parser.add_argument(
+        "--binning",
+        choices=["uniform", "quantile", "supervised"],
+        default="uniform",
+        help="How to bin numeric columns: equal width, equal frequency, or the bins with the most mutual information "
+        "with the target. Streaming supports the first two.",
+    )
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Read the .csv file a chunk at a time.",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=100_000,
+        help="The number of rows to read at once when streaming.",
+    )
+    parser.add_argument(
+        "--pipeline",
+        help="Query a pipeline saved by `utils.modelling.persistence.save_pipeline` instead of learning one.",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="With --pipeline, also give the posterior of every node and the likeliest states of the unobserved nodes.",
+    )
+    parser.add_argument(
+        "--save-pipeline",
+        help="Fit a pipeline and save it to this file instead of querying.",
+    )
+    parser.add_argument(
+        "--sparse",
+        action="store_true",
+        help="Keep the probabilities of --save-pipeline and --evaluate pipelines only for the combinations of parent "
+        "states seen in the data.",
+    )
+    parser.add_argument(
+        "--smoothing",
+        type=float,
+        default=0.0,
+        help="The Dirichlet pseudo-count to smooth the probabilities of --save-pipeline and --evaluate pipelines with.",
+    )
+    parser.add_argument(
+        "--evaluate",
+        action="store_true",
+        help="Cross validate the pipeline and bootstrap its edges over --n-jobs processes, and print the report, "
+        "instead of querying. Supervised --binning can't be cross validated, see --sweep-bins. The probabilities are "
+        "smoothed with --smoothing, or a pseudo-count of 1 when it is 0, as with --sweep-bins.",
+    )
+    parser.add_argument(
+        "--folds",
+        type=int,
+        default=5,
+        help="The number of cross validation folds for --evaluate and --sweep-bins.",
+    )
+    parser.add_argument(
+        "--resamples",
+        type=int,
+        default=100,
+        help="The number of bootstrap resamples for --evaluate.",
+    )
+    parser.add_argument(
+        "--sweep-bins",
+        type=int,
+        nargs="+",
+        metavar="BINS",
+        help="Cross validate the pipeline with each of these numbers of bins and every --sweep-binning strategy, "
+        "coarsening one fine binning of the data, and print the held out log-likelihood and scores of each "
+        "instead of querying. The probabilities are smoothed with --smoothing, or a pseudo-count of 1 when it is "
+        "0, so empty bins do not make held out rows impossible.",
+    )
+    parser.add_argument(
+        "--sweep-binning",
+        choices=["uniform", "quantile", "supervised"],
+        nargs="+",
+        default=["uniform", "quantile", "supervised"],
+        help="The binning strategies to try with --sweep-bins.",
+    )
+    parser.add_argument(
+        "--stage-cache",
+        metavar="DIR",
+        help="Cache the binned data, mutual information, tree and counts in this directory, so reruns only redo the "
+        "stages whose inputs changed.",
+    )
+    parser.add_argument(
+        "--stage-cache-mb",
+        type=int,
+        default=1024,
+        help="The most megabytes of --stage-cache outputs to keep, the least recently used are evicted first.",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Write a JSON report of the time spent in every stage to this file.",
+    )
+    parser.add_argument(
+        "--trace-memory",
+        action="store_true",
+        help="Add the peak memory of every stage to the --profile report.",
+    )
+    parser.add_argument(
+        "--cprofile",
+        help="Run under cProfile and save the statistics to this file.",
+    )
+    parser.add_argument(
+        "--plot",
+        help='Plot the learned graph to this file, or "show" to open a window.',
+    )
+    return parser
+
+
+def main(argv=None):
+    start = time.perf_counter()
+    arguments = get_argument_parser().parse_args(argv)
+    timings = {"import": start - _START}
+    if arguments.profile is not None:
+        enable_profiling(arguments.trace_memory)
+    with cprofile_run(arguments.cprofile):
+        if arguments.pipeline is not None:
+            pipeline_runner(arguments.pipeline, timings=timings, explain=arguments.explain)
+        elif arguments.save_pipeline is not None:
+            with timed_stage(timings, "import"):
+                from utils.modelling.persistence import save_pipeline
+                from utils.modelling.pipeline import fit_pipeline
+            with timed_stage(timings, "load"):
+                heart_disease_df = load_data(arguments)
+            with timed_stage(timings, "fit"):
+                pipeline = fit_pipeline(
+                    heart_disease_df,
+                    arguments.target,
+                    n_jobs=arguments.n_jobs,
+                    binning=arguments.binning,
+                    sparse=arguments.sparse,
+                    smoothing=arguments.smoothing,
+                )
+            with timed_stage(timings, "save"):
+                save_pipeline(pipeline, arguments.save_pipeline)
+        elif arguments.evaluate:
+            with timed_stage(timings, "import"):
+                import json
+
+                from utils.modelling.validation import evaluate_pipeline
+            with timed_stage(timings, "load"):
+                heart_disease_df = load_data(arguments)
+            with timed_stage(timings, "evaluate"):
+                report = evaluate_pipeline(
+                    heart_disease_df,
+                    arguments.target,
+                    arguments.folds,
+                    arguments.resamples,
+                    n_jobs=arguments.n_jobs,
+                    binning=arguments.binning,
+                    sparse=arguments.sparse,
+                    smoothing=arguments.smoothing or 1.0,
+                )
+            print(json.dumps(report, indent=2))
+        elif arguments.sweep_bins is not None:
+            with timed_stage(timings, "import"):
+                from utils.modelling.tuning import sweep_bin_counts
+            with timed_stage(timings, "load"):
+                heart_disease_df = load_data(arguments)
+            with timed_stage(timings, "sweep bins"):
+                report = sweep_bin_counts(
+                    heart_disease_df,
+                    arguments.target,
+                    arguments.sweep_bins,
+                    arguments.sweep_binning,
+                    arguments.folds,
+                    smoothing=arguments.smoothing or 1.0,
+                    n_jobs=arguments.n_jobs,
+                )
+            print(report.to_string(index=False))
+        elif arguments.streaming:
+            streaming_runner(
+                arguments.file_location,
+                arguments.target,
+                arguments.chunksize,
+                timings=timings,
+                binning=arguments.binning,
+            )
+        else:
+            with timed_stage(timings, "load"):
+                heart_disease_df = load_data(arguments)
+            stage_cache = None
+            if arguments.stage_cache is not None:
+                from utils.modelling.stage_cache import StageCache
+
+                stage_cache = StageCache(arguments.stage_cache, arguments.stage_cache_mb << 20)
+            runner(
+                data_frame=heart_disease_df,
+                target=arguments.target,
+                engine=arguments.engine,
+                plot=arguments.plot,
+                timings=timings,
+                n_jobs=arguments.n_jobs,
+                structure=arguments.structure,
+                top_k=arguments.top_k,
+                binning=arguments.binning,
+                stage_cache=stage_cache,
+            )
+            if stage_cache is not None:
+                print(f"stage cache: {stage_cache.get_stats()}", file=sys.stderr)
+    if arguments.profile is not None:
+        write_profile_report(disable_profiling(), arguments.profile)
+    timings["total"] = time.perf_counter() - _START
+    for stage, seconds in timings.items():
+        print(f"{stage:>20}: {seconds:8.3f}s", file=sys.stderr)
+    return timings
+
+
 if __name__ == "__main__":
-    heart_disease_df = import_csv_data("data/heartDisease.csv")
-    output = runner(data_frame=heart_disease_df, target="AHD")
-    print(output)
+    main()
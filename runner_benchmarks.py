@@ -0,0 +1,263 @@
+"""
+This is the benchmark runner, timing every stage of the Bayes net pipeline on synthetic data, see
+`utils.load.synthetic_data`. Run it with `python runner_benchmarks.py --rows 1000 100000 --numeric 10 --output
+results.json` and compare two runs, say from two commits, with `python runner_benchmarks.py --compare old.json
+new.json`. Stages that aren't asked for with `--stages` still run once if a later stage needs their output, but aren't
+timed.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from utils.load.synthetic_data import get_synthetic_heart_disease_data
+
+
+def _binning(state: dict):
+    from utils.preprocessing.bespoke_preprocessing import convert_columns_to_correct_types
+    from utils.preprocessing.generic_preprocessing import bin_numeric_data, reduce_data_frame_to_numeric_columns
+
+    heart_disease_df = convert_columns_to_correct_types(state["data"].copy())
+    state["heart_disease_df"] = heart_disease_df
+    state["numeric_df"] = bin_numeric_data(reduce_data_frame_to_numeric_columns(heart_disease_df), 5)
+
+
+def _categorical_reduction(state: dict):
+    from utils.preprocessing.generic_preprocessing import reduce_data_frame_to_categorical_columns
+
+    categorical_df = reduce_data_frame_to_categorical_columns(
+        state["heart_disease_df"], list(state["numeric_df"].columns)
+    )
+    state["training_df"] = state["numeric_df"].join(categorical_df)
+
+
+def _mutual_information(state: dict):
+    from utils.graphs.mutual_information import get_mutual_information_matrix
+
+    state["correlation_matrix"] = get_mutual_information_matrix(state["training_df"])
+
+
+def _structure_learning(state: dict):
+    import networkx as nx
+    from networkx.algorithms import tree
+
+    from utils.graphs.structuring import get_directed_edges
+
+    graph = tree.maximum_spanning_tree(nx.from_pandas_adjacency(state["correlation_matrix"]))
+    state["directed_edge_list"] = get_directed_edges(graph, state["target"])
+
+
+def _cpt_fitting(state: dict):
+    from utils.graphs.probability import get_pomegranate_states_from_directed_edges
+
+    state["state_dict"] = get_pomegranate_states_from_directed_edges(state["training_df"], state["directed_edge_list"])
+
+
+def _baking(state: dict):
+    from utils.modelling.bayes_model import get_bayesian_network
+
+    state["model"], _ = get_bayesian_network(state["state_dict"], state["directed_edge_list"])
+
+
+def _evidence(state: dict) -> pd.DataFrame:
+    """The training data as string states, without the target, for querying."""
+    evidence = state["training_df"].drop(columns=state["target"]).iloc[: state["batch_size"]]
+    return evidence.astype(object).astype(str)
+
+
+def _single_query(state: dict):
+    from utils.evaluation import query_bayesian_network
+
+    query = _evidence(state).iloc[0].to_dict()
+    query[state["target"]] = None
+    query_bayesian_network(state["model"], query)
+
+
+def _batch_query(state: dict):
+    from utils.evaluation import score_bayesian_network
+
+    score_bayesian_network(state["model"], _evidence(state), state["target"])
+
+
+def _what_if_sweep(state: dict):
+    from utils.evaluation import sweep_bayesian_network
+
+    sweep_bayesian_network(state["model"], _evidence(state), state["target"])
+
+
+STAGES: Dict[str, Callable[[dict], None]] = {
+    "binning": _binning,
+    "categorical reduction": _categorical_reduction,
+    "mutual information": _mutual_information,
+    "structure learning": _structure_learning,
+    "cpt fitting": _cpt_fitting,
+    "baking": _baking,
+    "single query": _single_query,
+    "batch query": _batch_query,
+    "what-if sweep": _what_if_sweep,
+}
+
+
+def run_benchmark(
+    data: pd.DataFrame,
+    target: str = "AHD",
+    stages: Optional[List[str]] = None,
+    repeat: int = 3,
+    batch_size: int = 10_000,
+) -> Dict[str, dict]:
+    """Times the stages of the pipeline on `data`, running each stage `repeat` times.
+
+    Args:
+        data (pd.DataFrame): The raw data.
+        target (str): Node in the network which we point edges to.
+        stages (List[str], optional): The stages to time, from `STAGES`. Defaults to all of them.
+        repeat (int): The number of times to run each timed stage.
+        batch_size (int): The number of rows to score in the batch query and what-if sweep stages.
+
+    Returns: A dictionary linking each timed stage's name to its "best" and "median" time in seconds and its "times".
+
+    """
+    stages = list(STAGES) if stages is None else stages
+    last_stage = max(list(STAGES).index(stage) for stage in stages)
+    state = {"data": data, "target": target, "batch_size": batch_size}
+    results = dict()
+    for stage in list(STAGES)[: last_stage + 1]:
+        times = []
+        for _ in range(repeat if stage in stages else 1):
+            start = time.perf_counter()
+            STAGES[stage](state)
+            times.append(time.perf_counter() - start)
+        if stage in stages:
+            results[stage] = {"best": min(times), "median": float(np.median(times)), "times": times}
+    return results
+
+
+def get_commit() -> Optional[str]:
+    """Returns: The git commit the benchmark ran on, if there is one."""
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    rows: List[int],
+    n_numeric: int,
+    n_categorical: int,
+    stages: Optional[List[str]] = None,
+    repeat: int = 3,
+    seed: int = 0,
+) -> dict:
+    """Runs run_benchmark() on synthetic data of every size in `rows`.
+
+    Returns: The results, with the commit, library versions and arguments of the run so runs can be compared.
+
+    """
+    report = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "parameters": {"numeric": n_numeric, "categorical": n_categorical, "repeat": repeat, "seed": seed},
+        "results": dict(),
+    }
+    for n_rows in rows:
+        data, _ = get_synthetic_heart_disease_data(n_rows, n_numeric, n_categorical, seed=seed)
+        report["results"][str(n_rows)] = run_benchmark(data, stages=stages, repeat=repeat)
+        for stage, result in report["results"][str(n_rows)].items():
+            print(f"{n_rows:>10} rows {stage:>22}: {result['best']:10.4f}s")
+    return report
+
+
+def compare_reports(old_report: dict, new_report: dict) -> None:
+    """Prints the best time of every stage in both reports, with how many times faster the new one is."""
+    for n_rows, new_results in new_report["results"].items():
+        for stage, new_result in new_results.items():
+            old_result = old_report["results"].get(n_rows, dict()).get(stage)
+            if old_result is None:
+                continue
+            speedup = old_result["best"] / new_result["best"] if new_result["best"] > 0 else float("inf")
+            print(
+                f"{n_rows:>10} rows {stage:>22}: {old_result['best']:10.4f}s -> {new_result['best']:10.4f}s "
+                f"({speedup:.2f}x)"
+            )
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Times every stage of the Bayes net pipeline on synthetic data.")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="The row counts to benchmark.",
+    )
+    parser.add_argument(
+        "--numeric",
+        type=int,
+        default=5,
+        help="The number of numeric columns.",
+    )
+    parser.add_argument(
+        "--categorical",
+        type=int,
+        default=2,
+        help="The number of categorical columns.",
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=list(STAGES),
+        help="The stages to time, defaults to all of them.",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="The number of times to run each stage.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The seed of the synthetic data.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument(
+        "--compare",
+        nargs=2,
+        metavar=("OLD", "NEW"),
+        help="Compare two JSON result files instead of running.",
+    )
+    return parser
+
+
+def main(argv=None):
+    arguments = get_argument_parser().parse_args(argv)
+    if arguments.compare is not None:
+        reports = []
+        for file_location in arguments.compare:
+            with open(file_location) as file:
+                reports.append(json.load(file))
+        return compare_reports(*reports)
+    report = run_benchmarks(
+        arguments.rows,
+        arguments.numeric,
+        arguments.categorical,
+        arguments.stages,
+        arguments.repeat,
+        arguments.seed,
+    )
+    if arguments.output is not None:
+        with open(arguments.output, "w") as file:
+            json.dump(report, file, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
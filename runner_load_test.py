@@ -0,0 +1,197 @@
+"""
+This is the load test runner for the scoring server, see `runner_scoring_server.py`. It replays patients from a .csv
+file as single patient requests over `--concurrency` keep-alive connections and reports the latency percentiles and
+throughput seen by the clients, along with the server's own `/stats`. Run it against a running server with `python
+runner_load_test.py --port 8080`, or against a server started in the same process with `--serve heart.bn`.
+"""
+import argparse
+import asyncio
+import json
+import math
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.load.data_importing import import_csv_data
+
+
+async def request(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    method: str,
+    path: str,
+    payload=None,
+) -> Tuple[int, object]:
+    """Sends one HTTP request on a keep-alive connection and reads the JSON response."""
+    body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1")
+        + body
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def connect(host: str, port: int, unix_socket: Optional[str]):
+    if unix_socket is not None:
+        return await asyncio.open_unix_connection(unix_socket)
+    return await asyncio.open_connection(host, port)
+
+
+async def client(
+    patients: List[dict],
+    host: str,
+    port: int,
+    unix_socket: Optional[str],
+    latencies: List[float],
+    errors: List[int],
+):
+    reader, writer = await connect(host, port, unix_socket)
+    for patient in patients:
+        start = time.perf_counter()
+        status, _ = await request(reader, writer, "POST", "/score", patient)
+        latencies.append(time.perf_counter() - start)
+        if status != 200:
+            errors.append(status)
+    writer.close()
+
+
+def get_patients(file_location: str, target: str, n_requests: int) -> List[dict]:
+    """Returns: `n_requests` patients from the .csv file without their target, repeating the file as often as needed,
+    with missing values as None."""
+    data = import_csv_data(file_location).drop(columns=target, errors="ignore")
+    records = data.astype(object).where(data.notna(), None).to_dict(orient="records")
+    return (records * math.ceil(n_requests / len(records)))[:n_requests]
+
+
+async def load_test(arguments: argparse.Namespace) -> dict:
+    server = batcher = None
+    if arguments.serve is not None:
+        from utils.modelling.persistence import load_pipeline
+        from utils.modelling.serving import start_scoring_server
+
+        server, batcher = await start_scoring_server(
+            load_pipeline(arguments.serve),
+            arguments.host,
+            0,
+            arguments.unix_socket,
+            arguments.max_batch_size,
+            arguments.max_latency_ms / 1000,
+        )
+        if arguments.unix_socket is None:
+            arguments.port = server.sockets[0].getsockname()[1]
+
+    patients = get_patients(arguments.file_location, arguments.target, arguments.requests)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            client(
+                patients[i :: arguments.concurrency],
+                arguments.host,
+                arguments.port,
+                arguments.unix_socket,
+                latencies,
+                errors,
+            )
+            for i in range(arguments.concurrency)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    reader, writer = await connect(arguments.host, arguments.port, arguments.unix_socket)
+    _, server_stats = await request(reader, writer, "GET", "/stats")
+    writer.close()
+
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+        await batcher.stop()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "concurrency": arguments.concurrency,
+        "seconds": elapsed,
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "server": server_stats,
+    }
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Load tests the scoring server with patients from a .csv file.")
+    parser.add_argument(
+        "file_location",
+        nargs="?",
+        default="data/heartDisease.csv",
+        help="The .csv file of patients to send.",
+    )
+    parser.add_argument(
+        "--target",
+        default="AHD",
+        help="The column to drop from the patients.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="The address of the server.")
+    parser.add_argument("--port", type=int, default=8080, help="The port of the server.")
+    parser.add_argument(
+        "--unix-socket",
+        help="Connect to the server on this Unix socket instead of a port.",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=10_000,
+        help="The number of requests to send.",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=32,
+        help="The number of connections sending requests at once.",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="PIPELINE",
+        help="Start a server for this pipeline file in the same process first.",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=64,
+        help="The most rows the --serve server scores in one batch.",
+    )
+    parser.add_argument(
+        "--max-latency-ms",
+        type=float,
+        default=5.0,
+        help="The longest a request to the --serve server waits for others to join its batch.",
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    return parser
+
+
+def main(argv=None):
+    arguments = get_argument_parser().parse_args(argv)
+    results = asyncio.run(load_test(arguments))
+    print(json.dumps(results, indent=2))
+    if arguments.output is not None:
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
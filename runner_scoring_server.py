@@ -0,0 +1,88 @@
+"""
+This is the scoring server runner, serving AHD risk scores from a pipeline saved with `utils.modelling.persistence`, see
+`utils.modelling.serving`. Run it with `python runner_scoring_server.py heart.bn --port 8080`, or fit a pipeline on a
+.csv file first with `--fit data/heartDisease.csv`, and score a patient with `curl -d '{"Age": 63, "Sex": 1, ...}'
+localhost:8080/score`. Load test it with `runner_load_test.py`.
+"""
+import argparse
+import asyncio
+import signal
+import sys
+
+from utils.load.data_importing import import_csv_data
+from utils.modelling.persistence import load_pipeline, save_pipeline
+from utils.modelling.pipeline import fit_pipeline
+from utils.modelling.serving import start_scoring_server
+
+
+async def serve(pipeline: dict, arguments: argparse.Namespace) -> None:
+    server, batcher = await start_scoring_server(
+        pipeline,
+        arguments.host,
+        arguments.port,
+        arguments.unix_socket,
+        arguments.max_batch_size,
+        arguments.max_latency_ms / 1000,
+        arguments.n_workers,
+    )
+    address = arguments.unix_socket or "http://{}:{}".format(*server.sockets[0].getsockname()[:2])
+    print(f"Serving {pipeline['target']} scores on {address}", file=sys.stderr)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop.set)
+    async with server:
+        await stop.wait()
+    await batcher.stop()
+    print(batcher.get_stats(), file=sys.stderr)
+
+
+def get_argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Serves AHD risk scores from a fitted pipeline over HTTP.")
+    parser.add_argument("pipeline", help="The pipeline file to serve.")
+    parser.add_argument(
+        "--fit",
+        metavar="CSV",
+        help="Fit a pipeline on this .csv file and save it to the pipeline file first.",
+    )
+    parser.add_argument(
+        "--target",
+        default="AHD",
+        help="Node in the network which we point edges to, when fitting.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="The address to listen on.")
+    parser.add_argument("--port", type=int, default=8080, help="The port to listen on.")
+    parser.add_argument(
+        "--unix-socket",
+        help="Listen on this Unix socket instead of a port.",
+    )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=64,
+        help="The most rows to score in one batch.",
+    )
+    parser.add_argument(
+        "--max-latency-ms",
+        type=float,
+        default=5.0,
+        help="The longest a request waits for others to join its batch.",
+    )
+    parser.add_argument(
+        "--n-workers",
+        type=int,
+        default=1,
+        help="The number of threads to score batches in.",
+    )
+    return parser
+
+
+def main(argv=None):
+    arguments = get_argument_parser().parse_args(argv)
+    if arguments.fit is not None:
+        save_pipeline(fit_pipeline(import_csv_data(arguments.fit), arguments.target), arguments.pipeline)
+    asyncio.run(serve(load_pipeline(arguments.pipeline), arguments))
+
+
+if __name__ == "__main__":
+    main()
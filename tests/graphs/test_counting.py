@@ -0,0 +1,123 @@
+"""Tests for count tables"""
+import numpy as np
+import pandas as pd
+
+from utils.graphs.counting import (
+    get_conditional_probabilities,
+    get_contingency_table,
+    get_dense_conditional_probabilities,
+    get_family_counts,
+    get_sparse_conditional_probabilities,
+    get_sparse_contingency_table,
+    merge_sparse_contingency_tables,
+)
+
+
+def test_get_contingency_table():
+    """Tests get_contingency_table() counts the same as a groupby, and leaves out rows with missing values"""
+    test_codes = np.random.randint(-1, 3, size=(300, 3))
+
+    test_table = get_contingency_table(test_codes, [3, 3, 3])
+    expected_counts = (
+        pd.DataFrame(test_codes[(test_codes >= 0).all(axis=1)])
+        .groupby([0, 1, 2])
+        .size()
+    )
+
+    assert test_table.shape == (3, 3, 3), "get_contingency_table() has the wrong shape"
+    for index, count in expected_counts.items():
+        assert (
+            test_table[index] == count
+        ), "get_contingency_table() does not match the counts of a groupby"
+    assert (
+        test_table.sum() == expected_counts.sum()
+    ), "get_contingency_table() counted rows with missing values"
+
+    test_unique_codes, test_weights = np.unique(test_codes, axis=0, return_counts=True)
+    assert np.array_equal(
+        get_contingency_table(test_unique_codes, [3, 3, 3], test_weights), test_table
+    ), "get_contingency_table() did not count weighted distinct rows as the rows"
+
+
+def test_get_family_counts():
+    """Tests get_family_counts() gives the contingency table of every family, whether counted in one process or many"""
+    test_codes = np.asfortranarray(np.random.randint(-1, 4, size=(500, 4)))
+    families = {"a": [0], "b": [0, 1], "c": [3, 2, 1]}
+
+    for n_jobs in [1, 2]:
+        test_counts = get_family_counts(test_codes, [4, 4, 4, 4], families, n_jobs)
+
+        assert list(test_counts) == [
+            "a",
+            "b",
+            "c",
+        ], "get_family_counts() did not return the families in order"
+        for node, columns in families.items():
+            assert np.array_equal(
+                test_counts[node],
+                get_contingency_table(test_codes[:, columns], [4] * len(columns)),
+            ), "get_family_counts() does not match get_contingency_table()"
+
+
+def test_get_sparse_contingency_table():
+    """Tests get_sparse_contingency_table() holds the rows of get_contingency_table() whose parent states occur, and
+    leaves out rows with missing values"""
+    test_codes = np.random.randint(-1, 5, size=(60, 3))
+
+    test_table = get_sparse_contingency_table(test_codes, [5, 5, 5])
+    expected_table = get_contingency_table(test_codes, [5, 5, 5])
+
+    assert (
+        len(test_table["parent_codes"]) == (expected_table.sum(axis=-1) > 0).sum()
+    ), "get_sparse_contingency_table() did not keep only the observed parent states"
+    assert np.array_equal(
+        expected_table[tuple(test_table["parent_codes"].T)], test_table["counts"]
+    ), "get_sparse_contingency_table() does not match get_contingency_table()"
+    assert (
+        test_table["counts"].sum() == expected_table.sum()
+    ), "get_sparse_contingency_table() counted rows with missing values"
+
+
+def test_merge_sparse_contingency_tables():
+    """Tests merge_sparse_contingency_tables() adds the counts of two sparse tables, padding new states of the child"""
+    test_codes = np.random.randint(0, 3, size=(200, 2))
+    other_codes = np.random.randint(0, 4, size=(100, 2))
+
+    test_table = merge_sparse_contingency_tables(
+        get_sparse_contingency_table(test_codes, [3, 3]),
+        get_sparse_contingency_table(other_codes, [4, 4]),
+    )
+    expected_table = np.pad(get_contingency_table(test_codes, [3, 3]), [(0, 1), (0, 1)])
+    expected_table = expected_table + get_contingency_table(other_codes, [4, 4])
+
+    assert np.array_equal(
+        expected_table[tuple(test_table["parent_codes"].T)], test_table["counts"]
+    ), "merge_sparse_contingency_tables() did not add the counts"
+
+
+def test_get_sparse_conditional_probabilities():
+    """Tests sparse conditional probabilities laid out in full match the dense ones for the same smoothing, and that
+    parent states that never occur fall back to the smoothed marginal of the child"""
+    test_codes = np.random.randint(0, 4, size=(40, 3))
+    counts = get_contingency_table(test_codes, [4, 4, 4])
+
+    for pseudo_count in [0.0, 2.0]:
+        test_cpt = get_sparse_conditional_probabilities(
+            get_sparse_contingency_table(test_codes, [4, 4, 4]), pseudo_count
+        )
+        test_dense = get_dense_conditional_probabilities(test_cpt, [4, 4, 4])
+        expected_dense = get_conditional_probabilities(counts, pseudo_count)
+        observed = counts.sum(axis=-1) > 0
+
+        assert np.allclose(
+            test_dense.sum(axis=-1), 1
+        ), "get_sparse_conditional_probabilities() did not give distributions"
+        assert np.allclose(
+            test_dense[observed], expected_dense[observed]
+        ), "get_sparse_conditional_probabilities() does not match get_conditional_probabilities()"
+        assert np.allclose(
+            test_dense[~observed], (counts.sum(axis=(0, 1)) + 1) / (counts.sum() + 4)
+        ), "get_sparse_conditional_probabilities() did not fall back to the marginal"
+    assert np.allclose(
+        get_conditional_probabilities(counts, 2.0), test_dense
+    ), "get_conditional_probabilities() did not smooth unseen parent states towards the marginal"
@@ -0,0 +1,63 @@
+"""Tests for the batch mutual information matrix"""
+import numpy as np
+import pandas as pd
+from sklearn.metrics import mutual_info_score
+
+from utils.graphs.mutual_information import (
+    get_mutual_information_matrix,
+    get_top_k_mutual_information,
+)
+
+
+def test_get_mutual_information_matrix():
+    """Tests get_mutual_information_matrix() gives the same adjacency matrix as `DataFrame.corr()` with sklearn's
+    `mutual_info_score`, including when counting over several row chunks and threads."""
+    test_data = pd.DataFrame(
+        data={f"col{i}": np.random.randint(0, 2 + i % 4, size=200) for i in range(10)}
+    )
+    test_data["col3"] = test_data["col3"].astype(float)
+    test_data.loc[::7, "col3"] = np.nan
+
+    expected_matrix = test_data.corr(method=mutual_info_score)
+    test_matrix = get_mutual_information_matrix(test_data, chunk_size=33, n_jobs=3)
+
+    assert isinstance(
+        test_matrix, pd.DataFrame
+    ), "get_mutual_information_matrix() is not returning a pandas DataFrame as expected"
+    assert (
+        list(test_matrix.index) == list(test_matrix.columns) == list(test_data.columns)
+    ), "get_mutual_information_matrix() did not return the columns of the data on both axes"
+    assert np.allclose(
+        test_matrix.values, expected_matrix.values
+    ), "get_mutual_information_matrix() does not match DataFrame.corr(method=mutual_info_score)"
+
+
+def test_get_top_k_mutual_information():
+    """Tests get_top_k_mutual_information() finds the best neighbours in the full mutual information matrix, whatever
+    the block size"""
+    test_data = pd.DataFrame(
+        data={f"col{i}": np.random.randint(0, 2 + i % 4, size=300) for i in range(9)}
+    )
+    test_data["col1"] = test_data["col0"]
+    test_data.loc[::5, "col2"] = np.nan
+    full_matrix = get_mutual_information_matrix(test_data).to_numpy().copy()
+    np.fill_diagonal(full_matrix, -np.inf)
+
+    for block_size in [1, 4, None]:
+        test_neighbours, test_weights = get_top_k_mutual_information(
+            test_data, k=3, block_size=block_size, chunk_size=70
+        )
+
+        assert test_neighbours.shape == (
+            9,
+            3,
+        ), "get_top_k_mutual_information() has the wrong shape"
+        assert np.allclose(
+            test_weights, -np.sort(-full_matrix, axis=1)[:, :3]
+        ), "get_top_k_mutual_information() did not find the highest mutual information"
+        assert np.allclose(
+            np.take_along_axis(full_matrix, test_neighbours, axis=1), test_weights
+        ), "get_top_k_mutual_information() did not return the neighbours of its weights"
+        assert (
+            test_neighbours[0, 0] == 1
+        ), "get_top_k_mutual_information() missed a copied column"
@@ -0,0 +1,108 @@
+"""Tests for the generation of probability distributions"""
+from itertools import product
+
+import numpy as np
+import pandas as pd
+
+from utils.graphs.probability import (
+    get_conditional_pd,
+    get_conditional_probabilities,
+    get_pomegranate_cpt_rows,
+)
+
+
+def _groupby_conditional_pd(data, target, independent_variables):
+    """The groupby, join and Cartesian product pipeline get_conditional_pd() used to be built on."""
+    all_variables = independent_variables + [target]
+    grouped_df = (
+        data.groupby(all_variables)
+        .size()
+        .rename("count")
+        .reset_index(drop=False)
+        .set_index(independent_variables)
+        .join(data.groupby(independent_variables).size().rename("total"))
+    )
+    grouped_df["conditional_probability"] = grouped_df["count"] / grouped_df["total"]
+    filler_df = pd.DataFrame(
+        data=list(product(*(sorted(data[v].unique()) for v in all_variables))),
+        columns=all_variables,
+    )
+    return (
+        filler_df.merge(grouped_df.reset_index(), on=all_variables, how="left")
+        .fillna(0)
+        .astype({"count": int, "total": int})
+    )
+
+
+def test_get_conditional_pd():
+    """Tests get_conditional_pd() gives the same table as the groupby pipeline, including zero rows for combinations of
+    states that never occur"""
+    test_data = pd.DataFrame(
+        data={
+            "col1": np.random.randint(0, 3, size=200),
+            "col2": np.random.choice(["a", "b"], size=200),
+            "col3": np.random.randint(0, 4, size=200),
+            "col4": np.random.normal(size=200),
+        }
+    )
+    test_data.loc[(test_data["col1"] == 2) & (test_data["col2"] == "b"), "col3"] = 1
+
+    test_conditional_pd = get_conditional_pd(test_data, "col3", ["col1", "col2"])
+    expected_conditional_pd = _groupby_conditional_pd(
+        test_data, "col3", ["col1", "col2"]
+    )
+
+    assert list(test_conditional_pd.columns) == [
+        "col1",
+        "col2",
+        "col3",
+        "count",
+        "total",
+        "conditional_probability",
+    ], "get_conditional_pd() did not return the expected columns"
+    for column in ["col1", "col2", "col3", "count", "total"]:
+        assert (
+            test_conditional_pd[column].tolist()
+            == expected_conditional_pd[column].tolist()
+        ), f"get_conditional_pd() column {column} does not match the groupby pipeline"
+    assert np.allclose(
+        test_conditional_pd["conditional_probability"],
+        expected_conditional_pd["conditional_probability"],
+    ), "get_conditional_pd() probabilities do not match the groupby pipeline"
+
+
+def test_get_pomegranate_cpt_rows():
+    """Tests get_pomegranate_cpt_rows() gives the same rows as zipping up the stringified get_conditional_pd() table"""
+    test_data = pd.DataFrame(
+        data={
+            "col1": np.random.randint(0, 3, size=100),
+            "col2": np.random.randint(0, 2, size=100),
+            "col3": np.random.normal(size=100),
+        }
+    )
+    conditional_pd = get_conditional_pd(test_data, "col2", ["col1"]).astype(
+        {"col1": str, "col2": str}
+    )
+    expected_rows = [
+        list(row)
+        for row in zip(
+            *[
+                conditional_pd[var].to_list()
+                for var in ["col1", "col2", "conditional_probability"]
+            ]
+        )
+    ]
+    counts = conditional_pd["count"].to_numpy().reshape(test_data["col1"].nunique(), 2)
+
+    test_rows = get_pomegranate_cpt_rows(
+        get_conditional_probabilities(counts),
+        {"col1": sorted(test_data["col1"].unique()), "col2": [0, 1]},
+        ["col1", "col2"],
+    )
+
+    assert [row[:2] for row in test_rows] == [
+        row[:2] for row in expected_rows
+    ], "get_pomegranate_cpt_rows() states do not match get_conditional_pd()"
+    assert np.allclose(
+        [row[2] for row in test_rows], [row[2] for row in expected_rows]
+    ), "get_pomegranate_cpt_rows() probabilities do not match get_conditional_pd()"
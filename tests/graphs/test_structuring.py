@@ -2,8 +2,16 @@ import networkx as nx
 from networkx.algorithms import tree
 import numpy as np
 import pandas as pd
+from pytest import raises
 
-from utils.graphs.structuring import get_directed_edges
+from utils.graphs.structuring import (
+    get_approximate_maximum_spanning_tree,
+    get_directed_edges,
+    get_maximum_spanning_tree,
+    get_parents,
+    get_topological_order,
+    orient_graph,
+)
 
 
 def test_get_directed_edges():
@@ -17,3 +25,86 @@ def test_get_directed_edges():
     assert isinstance(
         test_directed_edges, list
     ), "get_directed_edges() is not returning a list as expected"
+
+
+def test_get_topological_order():
+    """Tests get_topological_order() puts every node after its parents, and refuses graphs with cycles"""
+    parents = {"t": ["a", "b"], "a": ["c", "d"], "b": [], "c": [], "d": []}
+
+    test_order = get_topological_order(parents)
+
+    assert sorted(test_order) == sorted(
+        parents
+    ), "get_topological_order() did not order every node"
+    for node, node_parents in parents.items():
+        for parent in node_parents:
+            assert test_order.index(parent) < test_order.index(
+                node
+            ), "get_topological_order() put a node before its parent"
+    with raises(ValueError):
+        get_topological_order({"a": ["b"], "b": ["a"]})
+
+
+def test_orient_graph():
+    """Tests orient_graph() points every edge of a forest towards the root of its component"""
+    test_graph = nx.Graph([("a", "t"), ("b", "t"), ("c", "a"), ("x", "y"), ("z", "y")])
+    test_graph.add_node("lonely")
+
+    test_edges, test_order, test_parents = orient_graph(test_graph, "t")
+
+    assert test_edges == [
+        ["a", "t"],
+        ["b", "t"],
+        ["c", "a"],
+        ["y", "x"],
+        ["z", "y"],
+    ], "orient_graph() did not point the edges towards the target in breadth first order"
+    assert test_parents == {
+        **get_parents(test_edges),
+        "lonely": [],
+    }, "orient_graph() did not return the parents of the directed edges"
+    assert sorted(test_order) == sorted(
+        test_graph.nodes
+    ), "orient_graph() did not order every node"
+    for node, node_parents in test_parents.items():
+        for parent in node_parents:
+            assert test_order.index(parent) < test_order.index(
+                node
+            ), "orient_graph() put a node before its parent"
+
+
+def test_get_maximum_spanning_tree():
+    """Tests get_maximum_spanning_tree() finds the same tree as networkx, and a forest where weights are zero"""
+    weights = np.random.uniform(size=(30, 30))
+    weights = weights + weights.T
+    weights[:5, 5:] = weights[5:, :5] = 0
+    nodes = [f"col{i}" for i in range(30)]
+    expected_tree = tree.maximum_spanning_tree(
+        nx.from_pandas_adjacency(pd.DataFrame(weights, index=nodes, columns=nodes))
+    )
+
+    test_tree = get_maximum_spanning_tree(weights, nodes)
+
+    assert {frozenset(edge) for edge in test_tree.edges} == {
+        frozenset(edge) for edge in expected_tree.edges
+    }, "get_maximum_spanning_tree() did not find the same tree as networkx"
+    assert (
+        nx.number_connected_components(test_tree) == 2
+    ), "get_maximum_spanning_tree() joined components with edges of weight zero"
+
+
+def test_get_approximate_maximum_spanning_tree():
+    """Tests get_approximate_maximum_spanning_tree() finds the maximum spanning tree when every edge is a candidate"""
+    weights = np.random.uniform(size=(20, 20))
+    weights = weights + weights.T
+    np.fill_diagonal(weights, -np.inf)
+    nodes = [f"col{i}" for i in range(20)]
+    neighbours = np.argsort(-weights, axis=1)[:, :19]
+
+    test_tree = get_approximate_maximum_spanning_tree(
+        neighbours, np.take_along_axis(weights, neighbours, axis=1), nodes
+    )
+
+    assert {frozenset(edge) for edge in test_tree.edges} == {
+        frozenset(edge) for edge in get_maximum_spanning_tree(weights, nodes).edges
+    }, "get_approximate_maximum_spanning_tree() did not find the maximum spanning tree"
@@ -2,8 +2,9 @@
 import os
 
 import pandas as pd
+from pytest import importorskip
 
-from utils.load.data_importing import import_csv_data
+from utils.load.data_importing import import_csv_data, import_data
 
 path_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 
@@ -27,3 +28,49 @@ def test_import_csv_data(tmp_path: str):
         "col1",
         "col2",
     ], "import_csv_data returned unexpected columns"
+
+
+def test_import_data(tmp_path: str):
+    """Ensures import_data() reads only the columns of the schema in their declared dtypes, and gives the same data
+    from a .csv file, its cache and a Parquet file.
+
+    Args:
+        tmp_path (str): Pytest inbuilt temporary data path.
+
+    """
+    pd.DataFrame(
+        data={
+            "Age": [63, 67, None, 41],
+            "Sex": [1, 1, 0, 1],
+            "Thal": ["fixed", "normal", None, "normal"],
+            "Unused": ["a", "b", "c", "d"],
+        }
+    ).to_csv(f"{tmp_path}/test_import_data.csv", index=False)
+    test_schema = {"Thal": "category", "Age": "float32", "Sex": "category"}
+
+    test_frame = import_data(f"{tmp_path}/test_import_data.csv", test_schema)
+    assert list(test_frame.columns) == [
+        "Thal",
+        "Age",
+        "Sex",
+    ], "import_data did not project the columns of the schema"
+    assert test_frame["Age"].dtype == "float32", "import_data did not use the dtype"
+    assert list(test_frame["Sex"].cat.categories) == [
+        "0",
+        "1",
+    ], "import_data did not give the categories as strings"
+
+    importorskip("pyarrow")
+    cache_dir = f"{tmp_path}/cache"
+    first = import_data(f"{tmp_path}/test_import_data.csv", test_schema, cache_dir)
+    assert len(os.listdir(cache_dir)) == 1, "import_data did not cache the .csv file"
+    cached = import_data(f"{tmp_path}/test_import_data.csv", test_schema, cache_dir)
+    pd.testing.assert_frame_equal(first, test_frame)
+    pd.testing.assert_frame_equal(cached, test_frame)
+
+    pd.read_csv(f"{tmp_path}/test_import_data.csv").to_parquet(
+        f"{tmp_path}/test_import_data.parquet"
+    )
+    pd.testing.assert_frame_equal(
+        import_data(f"{tmp_path}/test_import_data.parquet", test_schema), test_frame
+    )
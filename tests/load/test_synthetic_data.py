@@ -0,0 +1,51 @@
+"""Tests the synthetic benchmark data"""
+import networkx as nx
+from networkx.algorithms import tree
+
+from utils.graphs.mutual_information import get_mutual_information_matrix
+from utils.load.synthetic_data import get_synthetic_heart_disease_data
+
+
+def test_get_synthetic_heart_disease_data():
+    """Tests the synthetic data has the requested shape and is the same for the same seed"""
+    test_data, test_edges = get_synthetic_heart_disease_data(
+        n_rows=100, n_numeric=3, n_categorical=2
+    )
+
+    assert list(test_data.columns) == [
+        "Sex",
+        "ExAng",
+        "Numeric0",
+        "Numeric1",
+        "Numeric2",
+        "Categorical0",
+        "Categorical1",
+        "AHD",
+    ], "get_synthetic_heart_disease_data() returned unexpected columns"
+    assert (
+        test_data.shape[0] == 100
+    ), "get_synthetic_heart_disease_data() returned the wrong number of rows"
+    assert (
+        len(test_edges) == 7
+    ), "get_synthetic_heart_disease_data() did not plant a tree"
+    assert test_data.equals(
+        get_synthetic_heart_disease_data(n_rows=100, n_numeric=3, n_categorical=2)[0]
+    ), "get_synthetic_heart_disease_data() was not reproducible"
+
+
+def test_synthetic_data_planted_tree():
+    """Tests the planted tree is what the runner's structure learning finds on the hidden levels"""
+    test_data, test_edges = get_synthetic_heart_disease_data(
+        n_rows=20_000, n_numeric=4, n_categorical=3, missing_fraction=0
+    )
+    for column in test_data.columns:
+        if column.startswith("Numeric"):
+            test_data[column] = test_data[column] // 10
+
+    graph = tree.maximum_spanning_tree(
+        nx.from_pandas_adjacency(get_mutual_information_matrix(test_data))
+    )
+
+    assert {frozenset(edge) for edge in graph.edges} == {
+        frozenset(edge) for edge in test_edges
+    }, "the planted tree was not the maximum spanning tree of the mutual information"
@@ -0,0 +1,363 @@
+"""Tests for exact inference over the Bayes net"""
+
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from pytest import raises
+
+from utils.graphs.counting import (
+    get_sparse_conditional_probabilities,
+    get_sparse_contingency_table,
+)
+from utils.modelling.inference import (
+    ExactInferenceEngine,
+    get_inference_engine_from_counts,
+)
+
+
+def _random_cpt(*shape):
+    cpt = np.random.uniform(0.1, 1, size=shape)
+    return cpt / cpt.sum(axis=-1, keepdims=True)
+
+
+def _test_engine():
+    """A network pointing in to the target `t`, where `t` has two parents and `a` has two parents of its own."""
+    states = {
+        "c": ["0", "1"],
+        "d": ["0", "1", "2"],
+        "a": ["0", "1"],
+        "b": ["x", "y", "z"],
+        "t": ["No", "Yes"],
+    }
+    parents = {"c": [], "d": [], "a": ["c", "d"], "b": [], "t": ["a", "b"]}
+    cpts = {
+        "c": _random_cpt(2),
+        "d": _random_cpt(3),
+        "a": _random_cpt(2, 3, 2),
+        "b": _random_cpt(3),
+        "t": _random_cpt(2, 3, 2),
+    }
+    return ExactInferenceEngine(states, parents, cpts), cpts
+
+
+def _brute_force_posterior(cpts, evidence, node):
+    """Sums the full joint distribution to get the posterior of `node`."""
+    joint = np.einsum(
+        "c,d,cda,b,abt->cdabt", cpts["c"], cpts["d"], cpts["a"], cpts["b"], cpts["t"]
+    )
+    axes = "cdabt"
+    for observed, index in evidence.items():
+        mask = np.zeros(joint.shape[axes.index(observed)])
+        mask[index] = 1
+        shape = [1] * 5
+        shape[axes.index(observed)] = -1
+        joint = joint * mask.reshape(shape)
+    marginal = joint.sum(axis=tuple(i for i in range(5) if axes[i] != node))
+    return marginal / marginal.sum()
+
+
+def _brute_force_explanation(cpts, evidence):
+    """Searches the full joint distribution for the likeliest assignment consistent with the evidence."""
+    joint = np.einsum(
+        "c,d,cda,b,abt->cdabt", cpts["c"], cpts["d"], cpts["a"], cpts["b"], cpts["t"]
+    )
+    axes = "cdabt"
+    index = tuple(evidence[node] if node in evidence else slice(None) for node in axes)
+    consistent = np.zeros_like(joint)
+    consistent[index] = joint[index]
+    best = np.unravel_index(consistent.argmax(), joint.shape)
+    return dict(zip(axes, best)), consistent.max() / consistent.sum()
+
+
+def test_exact_inference_engine_query():
+    """Tests ExactInferenceEngine.query() gives the posterior of every unobserved node found by summing the joint
+    distribution, for every combination of evidence on two of the nodes"""
+    test_engine, cpts = _test_engine()
+
+    for b_index, c_index in product(range(3), range(2)):
+        test_query = {
+            "c": str(c_index),
+            "d": None,
+            "a": None,
+            "b": "xyz"[b_index],
+            "t": None,
+        }
+        test_result = test_engine.query(test_query)
+
+        assert set(test_result) == {
+            "d",
+            "a",
+            "t",
+        }, "query() did not return the nodes not held in evidence"
+        for node in test_result:
+            assert np.allclose(
+                list(test_result[node].values()),
+                _brute_force_posterior(cpts, {"b": b_index, "c": c_index}, node),
+            ), f"query() posterior of {node} does not match the joint distribution"
+        assert (
+            test_engine.query(test_query) == test_result
+        ), "query() is not stable for a repeated query"
+
+    with raises(ValueError):
+        test_engine.query({"c": "5"})
+
+
+def test_exact_inference_engine_cache():
+    """Tests ExactInferenceEngine.query() answers repeated queries from its cache, and a cache passed on to a newly
+    compiled engine is cleared"""
+    test_engine, _ = _test_engine()
+    test_query = {"c": "0", "d": None, "a": None, "b": "x", "t": None}
+
+    test_engine.warm_cache([test_query])
+    test_result = test_engine.query(test_query)
+    test_result["t"]["No"] = 2.0
+
+    assert test_engine.cache.get_stats()["hits"] == 1, "query() missed a warmed query"
+    assert (
+        test_engine.query(test_query)["t"]["No"] != 2.0
+    ), "query() returned the cached result itself"
+
+    test_new_engine = ExactInferenceEngine(
+        test_engine.states,
+        test_engine.parents,
+        test_engine.cpts,
+        test_engine.cache,
+    )
+    test_new_engine.query(test_query)
+
+    assert (
+        test_new_engine.cache.invalidations == 1
+    ), "query() did not clear results of another engine from the cache"
+
+
+def test_get_inference_engine_from_counts():
+    """Tests get_inference_engine_from_counts() normalises the counts in to conditional probabilities"""
+    test_engine = get_inference_engine_from_counts(
+        {"a": np.array([1, 3]), "t": np.array([[2, 2], [0, 6]])},
+        {"a": [0, 1], "t": ["No", "Yes"]},
+        [["a", "t"]],
+    )
+
+    test_result = test_engine.query({"a": None, "t": None})
+
+    assert np.allclose(
+        list(test_result["a"].values()), [0.25, 0.75]
+    ), "prior of the root is not normalised counts"
+    assert np.allclose(
+        list(test_result["t"].values()), [0.25 * 0.5, 0.25 * 0.5 + 0.75]
+    ), "marginal of the target does not follow from the counts"
+
+
+def test_exact_inference_engine_score():
+    """Tests ExactInferenceEngine.score() gives the same target posterior as query() for every row, with missing values
+    as unobserved nodes, and keeps the index of the data"""
+    test_engine, _ = _test_engine()
+    test_data = pd.DataFrame(
+        data={
+            "c": np.random.choice([0, 1, np.nan], size=50),
+            "d": np.random.choice([0, 1, 2, np.nan], size=50),
+            "b": np.random.choice(["x", "y", "z", None], size=50),
+        },
+        index=range(100, 150),
+    )
+
+    test_scores = test_engine.score(test_data, "t")
+
+    assert list(test_scores.columns) == [
+        "No",
+        "Yes",
+    ], "score() did not return a column per state of the target"
+    assert test_scores.index.equals(
+        test_data.index
+    ), "score() did not keep the index of the data"
+    for index, row in test_data.iterrows():
+        test_query = {
+            node: None if pd.isna(value) else str(value if node == "b" else int(value))
+            for node, value in row.items()
+        }
+        assert np.allclose(
+            list(test_engine.query(test_query)["t"].values()), test_scores.loc[index]
+        ), "score() does not match query() for a row"
+    assert np.allclose(
+        test_engine.score(test_engine.encode(test_data), "t").values, test_scores.values
+    ), "score() does not give the same result for encoded rows"
+
+    with raises(ValueError):
+        test_engine.score(pd.DataFrame(data={"b": ["w"]}), "t")
+
+
+def test_exact_inference_engine_sparse():
+    """Tests an engine compiled from sparse tables gives the same posteriors as one compiled from the same tables laid
+    out in full, with the unobserved parent states given the default probabilities"""
+    states = {"c": ["0", "1"], "d": ["0", "1", "2"], "t": ["No", "Yes"]}
+    parents = {"c": [], "d": [], "t": ["c", "d"]}
+    test_codes = np.array([[0, 0, 0], [0, 0, 1], [1, 2, 1], [1, 2, 1], [0, 1, 0]])
+    sparse_cpts = {
+        "c": get_sparse_conditional_probabilities(
+            get_sparse_contingency_table(test_codes[:, [0]], [2]), 1.0
+        ),
+        "d": get_sparse_conditional_probabilities(
+            get_sparse_contingency_table(test_codes[:, [1]], [3]), 1.0
+        ),
+        "t": get_sparse_conditional_probabilities(
+            get_sparse_contingency_table(test_codes, [2, 3, 2]), 1.0
+        ),
+    }
+    dense_cpts = {
+        "c": sparse_cpts["c"]["probabilities"][0],
+        "d": sparse_cpts["d"]["probabilities"][0],
+        "t": np.tile(sparse_cpts["t"]["default"], (2, 3, 1)),
+    }
+    for parent_codes, probabilities in zip(
+        sparse_cpts["t"]["parent_codes"], sparse_cpts["t"]["probabilities"]
+    ):
+        dense_cpts["t"][tuple(parent_codes)] = probabilities
+
+    test_engine = ExactInferenceEngine(states, parents, sparse_cpts)
+    dense_engine = ExactInferenceEngine(states, parents, dense_cpts)
+
+    for evidence in [{}, {"t": "Yes"}, {"c": "1", "t": "No"}, {"d": "0"}]:
+        test_query = test_engine.query(evidence)
+        expected_query = dense_engine.query(evidence)
+        for node, posterior in expected_query.items():
+            assert np.allclose(
+                list(test_query[node].values()), list(posterior.values())
+            ), "ExactInferenceEngine does not give the same posteriors from sparse tables"
+    test_data = pd.DataFrame({"c": ["0", "1", None, "1"], "d": ["1", None, "2", "1"]})
+    assert np.allclose(
+        test_engine.score(test_data, "t"), dense_engine.score(test_data, "t")
+    ), "ExactInferenceEngine does not give the same scores from sparse tables"
+    assert np.allclose(
+        test_engine.explain(test_data)["probability"],
+        dense_engine.explain(test_data)["probability"],
+    ), "ExactInferenceEngine does not give the same explanations from sparse tables"
+
+
+def test_exact_inference_engine_explain():
+    """Tests the most probable explanation matches searching the full joint distribution, and the batch explanations
+    and marginals match answering each row as a single query"""
+    test_engine, cpts = _test_engine()
+
+    for evidence in [{}, {"t": 1}, {"a": 0, "t": 1}, {"b": 2}, {"c": 1, "d": 2}]:
+        query = {
+            node: test_engine.states[node][index] for node, index in evidence.items()
+        }
+        test_explanation = test_engine.query_explanation(query)
+        expected, probability = _brute_force_explanation(cpts, evidence)
+        assert test_explanation["explanation"] == {
+            node: test_engine.states[node][index]
+            for node, index in expected.items()
+            if node not in evidence
+        }, "query_explanation() did not find the likeliest assignment"
+        assert np.isclose(
+            test_explanation["probability"], probability
+        ), "query_explanation() did not give the probability of the assignment"
+        for node in "cdabt":
+            assert np.allclose(
+                list(test_explanation["marginals"][node].values()),
+                _brute_force_posterior(cpts, evidence, node),
+            ), "query_explanation() did not give the posterior of every node"
+
+    test_data = pd.DataFrame(
+        {
+            "c": ["0", "1", None, "1"],
+            "a": [None, "1", "0", None],
+            "b": ["x", None, "z", None],
+            "t": [None, "Yes", None, None],
+        },
+        index=[3, 1, 4, 1],
+    )
+    test_explain = test_engine.explain(test_data)
+    assert list(test_explain["explanation"].index) == [
+        3,
+        1,
+        4,
+        1,
+    ], "explain() did not align the explanations with the data"
+    for i, (_, row) in enumerate(test_data.iterrows()):
+        query = {node: value for node, value in row.items() if pd.notna(value)}
+        expected = test_engine.query_explanation(query)
+        for node, state in expected["explanation"].items():
+            assert (
+                test_explain["explanation"].iloc[i][node] == state
+            ), "explain() did not match query_explanation()"
+        assert np.isclose(
+            test_explain["probability"].iloc[i], expected["probability"]
+        ), "explain() did not match the probability of query_explanation()"
+        for node, posterior in expected["marginals"].items():
+            assert np.allclose(
+                test_explain["marginals"][node].iloc[i].to_numpy(),
+                list(posterior.values()),
+            ), "explain() did not match the marginals of query_explanation()"
+
+
+def test_exact_inference_engine_sweep():
+    """Tests the what-if sweep matches the brute force posterior of the target with each node set to each state, the
+    rest of the evidence held, and a batch matches sweeping each row on its own"""
+    test_engine, cpts = _test_engine()
+
+    for evidence in [{}, {"a": 0}, {"c": 1, "b": 2}, {"d": 2, "a": 1, "b": 0}]:
+        query = {
+            node: test_engine.states[node][index] for node, index in evidence.items()
+        }
+        test_sweep = test_engine.sweep(query, "t")
+        assert len(test_sweep) == 2 + 3 + 2 + 3, "sweep() did not set every state"
+        expected_baseline = _brute_force_posterior(cpts, evidence, "t")[1]
+        for _, row in test_sweep.iterrows():
+            setting = dict(evidence)
+            setting[row["variable"]] = test_engine.states[row["variable"]].index(
+                row["state"]
+            )
+            assert np.isclose(
+                row["probability"], _brute_force_posterior(cpts, setting, "t")[1]
+            ), "sweep() did not match the posterior with the node set"
+            assert np.isclose(
+                row["probability"] - row["delta"], expected_baseline
+            ), "sweep() did not give the change from the posterior given the evidence"
+
+    test_data = pd.DataFrame(
+        {"c": ["0", None, "1"], "b": ["x", "y", None], "t": ["Yes", None, "No"]},
+        index=[7, 8, 9],
+    )
+    test_sweep = test_engine.sweep(test_data, "t")
+    for patient, query in zip(
+        [7, 8, 9], [{"c": "0", "b": "x"}, {"b": "y"}, {"c": "1"}]
+    ):
+        assert np.allclose(
+            test_sweep[test_sweep["patient"] == patient]["probability"],
+            test_engine.sweep(query, "t")["probability"],
+        ), "sweep() of a batch did not match sweeping each row"
+    with raises(ValueError):
+        test_engine.sweep({}, "a")
+
+
+def test_exact_inference_engine_log_likelihood():
+    """Tests the log-likelihood of each row matches the brute force probability of its evidence, and with a target
+    matches the probability of the evidence jointly with each state of the target"""
+    test_engine, cpts = _test_engine()
+    joint = np.einsum(
+        "c,d,cda,b,abt->cdabt", cpts["c"], cpts["d"], cpts["a"], cpts["b"], cpts["t"]
+    )
+    test_codes = np.array(
+        [[0, 2, 1, 0, 1], [-1, 1, -1, 2, 0], [1, -1, -1, -1, -1], [0, 0, 0, 1, -1]]
+    )
+
+    def brute_force_probability(row):
+        return joint[tuple(slice(None) if code < 0 else code for code in row)].sum()
+
+    assert np.allclose(
+        np.exp(test_engine.log_likelihood(test_codes)),
+        [brute_force_probability(row) for row in test_codes],
+    ), "log_likelihood() did not match the probability of the evidence"
+    test_joint = test_engine.log_likelihood(test_codes, "t")
+    assert list(test_joint.columns) == ["No", "Yes"]
+    for row, expected_row in zip(test_codes, test_joint.to_numpy()):
+        for state in range(2):
+            setting = row.copy()
+            setting[4] = state
+            assert np.isclose(
+                np.exp(expected_row[state]), brute_force_probability(setting)
+            ), "log_likelihood() did not match the probability with the target set"
+    with raises(ValueError):
+        test_engine.log_likelihood(test_codes, "a")
@@ -0,0 +1,83 @@
+"""Tests for saving and loading fitted pipelines"""
+import numpy as np
+from pytest import raises
+
+from utils.modelling.persistence import load_pipeline, save_pipeline
+
+
+def _test_pipeline():
+    return {
+        "target": "AHD",
+        "bins": 2,
+        "bin_edges": {"Age": np.array([29.95, 55.0, 80.0])},
+        "categories": {"Thal": ["fixed", "normal"], "AHD": ["No", "Yes"]},
+        "directed_edge_list": [["Age_2bin", "AHD"], ["Thal", "AHD"]],
+        "node_states": {
+            "Age_2bin": ["0", "1"],
+            "AHD": ["0", "1"],
+            "Thal": ["-1", "0", "1"],
+        },
+        "cpts": {
+            "Age_2bin": np.array([0.25, 0.75]),
+            "Thal": np.array([0.1, 0.4, 0.5]),
+            "AHD": np.random.uniform(size=(2, 3, 2)),
+        },
+    }
+
+
+def test_save_and_load_pipeline(tmp_path: str):
+    """Tests load_pipeline() gives back the pipeline saved by save_pipeline(), read or memory-mapped"""
+    file_location = f"{tmp_path}/pipeline.bn"
+    pipeline = _test_pipeline()
+
+    save_pipeline(pipeline, file_location)
+
+    for mmap in [False, True]:
+        test_pipeline = load_pipeline(file_location, mmap=mmap)
+        for key in [
+            "target",
+            "bins",
+            "categories",
+            "directed_edge_list",
+            "node_states",
+        ]:
+            assert (
+                test_pipeline[key] == pipeline[key]
+            ), f"load_pipeline() did not load the {key} saved by save_pipeline()"
+        for key in ["bin_edges", "cpts"]:
+            for name, array in pipeline[key].items():
+                assert np.array_equal(
+                    test_pipeline[key][name], array
+                ), f"load_pipeline() did not load the {key} saved by save_pipeline()"
+
+
+def test_save_and_load_sparse_pipeline(tmp_path: str):
+    """Tests load_pipeline() gives back the sparse tables saved by save_pipeline()"""
+    file_location = f"{tmp_path}/pipeline.bn"
+    pipeline = _test_pipeline()
+    pipeline["cpts"]["AHD"] = {
+        "parent_codes": np.array([[0, 1], [1, 2]]),
+        "probabilities": np.array([[0.2, 0.8], [0.6, 0.4]]),
+        "default": np.array([0.5, 0.5]),
+    }
+
+    save_pipeline(pipeline, file_location)
+    test_pipeline = load_pipeline(file_location, mmap=True)
+
+    assert np.array_equal(
+        test_pipeline["cpts"]["Thal"], pipeline["cpts"]["Thal"]
+    ), "load_pipeline() did not load the dense tables next to the sparse ones"
+    for part, array in pipeline["cpts"]["AHD"].items():
+        assert np.array_equal(
+            test_pipeline["cpts"]["AHD"][part], array
+        ), "load_pipeline() did not load the sparse tables saved by save_pipeline()"
+
+
+def test_load_pipeline_wrong_file(tmp_path: str):
+    """Tests load_pipeline() refuses files that are not pipeline files"""
+    file_location = f"{tmp_path}/not_a_pipeline.csv"
+    with open(file_location, "w") as file:
+        file.write("Age,Sex\n63,1\n")
+
+    with raises(ValueError):
+        load_pipeline(file_location)
@@ -0,0 +1,320 @@
+"""Tests for the fitted pipeline"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.load.synthetic_data import get_synthetic_heart_disease_data
+from utils.modelling.pipeline import (
+    explain_data,
+    fit_pipeline,
+    get_pipeline_inference_engine,
+    score_data,
+    sweep_data,
+    transform_data,
+    update_pipeline,
+    warm_pipeline_cache,
+)
+
+
+def _test_pipeline():
+    """A fitted pipeline for `Age` and `Thal` pointing in to `AHD`."""
+    return {
+        "target": "AHD",
+        "bins": 2,
+        "bin_edges": {"Age": np.array([29.95, 55.0, 80.0])},
+        "categories": {
+            "Sex": ["0", "1"],
+            "Thal": ["fixed", "normal", "reversable"],
+            "AHD": ["No", "Yes"],
+        },
+        "directed_edge_list": [["Age_2bin", "AHD"], ["Thal", "AHD"]],
+        "node_states": {
+            "Age_2bin": ["0", "1"],
+            "AHD": ["0", "1"],
+            "Thal": ["-1", "0", "1", "2"],
+        },
+        "cpts": {
+            "Age_2bin": np.array([0.5, 0.5]),
+            "Thal": np.array([0.1, 0.3, 0.3, 0.3]),
+            "AHD": np.array(
+                [
+                    [[0.5, 0.5], [0.9, 0.1], [0.6, 0.4], [0.2, 0.8]],
+                    [[0.5, 0.5], [0.7, 0.3], [0.4, 0.6], [0.1, 0.9]],
+                ]
+            ),
+        },
+    }
+
+
+def test_transform_data():
+    """Tests transform_data() bins and codes new data with the stored bin edges and categories"""
+    data = pd.DataFrame(
+        data={
+            "Age": [30, 56, 99],
+            "Sex": [0, 1, 1],
+            "ExAng": [0, 0, 1],
+            "Thal": ["reversable", None, "unseen"],
+        }
+    )
+
+    with pytest.raises(ValueError, match="`Age` has values \\['99'\\]"):
+        transform_data(data, _test_pipeline())
+    with pytest.raises(ValueError, match="`Thal` has values \\['unseen'\\]"):
+        transform_data(data, _test_pipeline())
+    test_data = transform_data(data, _test_pipeline(), unknown_values="missing")
+
+    assert list(test_data.columns) == [
+        "Age_2bin",
+        "Sex",
+        "Thal",
+    ], "transform_data() did not keep only the columns in the pipeline"
+    assert test_data["Age_2bin"].tolist()[:2] == [
+        0,
+        1,
+    ], "transform_data() did not bin with the stored bin edges"
+    assert np.isnan(
+        test_data["Age_2bin"].iloc[2]
+    ), "transform_data() did not leave values outside the bin edges missing"
+    assert test_data["Thal"].tolist()[:2] == [
+        2,
+        -1,
+    ], "transform_data() did not code with the stored categories"
+    assert np.isnan(
+        test_data["Thal"].iloc[2]
+    ), "transform_data() did not leave unknown categories missing"
+
+
+def test_score_data():
+    """Tests score_data() matches querying the pipeline's engine row by row, with missing values left unobserved"""
+    pipeline = _test_pipeline()
+    engine = get_pipeline_inference_engine(pipeline)
+    data = pd.DataFrame(
+        data={
+            "Age": [30, 70, 70],
+            "Sex": [0, 1, 1],
+            "ExAng": [0, 0, 1],
+            "Thal": ["normal", "fixed", None],
+        },
+        index=[5, 6, 7],
+    )
+
+    test_scores = score_data(data, pipeline)
+
+    assert list(test_scores.index) == [
+        5,
+        6,
+        7,
+    ], "score_data() did not align the scores with the data"
+    expected = [
+        engine.query({"Age_2bin": "0", "Thal": "1"})["AHD"],
+        engine.query({"Age_2bin": "1", "Thal": "0"})["AHD"],
+        engine.query({"Age_2bin": "1"})["AHD"],
+    ]
+    for i, posterior in enumerate(expected):
+        assert np.allclose(
+            test_scores.iloc[i].to_numpy(), list(posterior.values())
+        ), "score_data() did not match querying the engine"
+
+    with pytest.raises(ValueError, match="`Thal` has values \\['weird'\\]"):
+        score_data(data.assign(Thal="weird"), pipeline)
+    pipeline["cpts"]["Thal"] = np.array([0.0, 0.5, 0.5, 0.0])
+    test_scores = score_data(data.assign(Thal="reversable"), pipeline)
+    assert (
+        test_scores.isna().all().all()
+    ), "score_data() did not give NaN for evidence with zero probability"
+
+
+def test_explain_data():
+    """Tests explain_data() matches asking the pipeline's engine for the explanation of each row"""
+    pipeline = _test_pipeline()
+    engine = get_pipeline_inference_engine(pipeline)
+    data = pd.DataFrame(
+        data={
+            "Age": [30, 70],
+            "Sex": [0, 1],
+            "ExAng": [0, 0],
+            "Thal": ["normal", None],
+        },
+        index=[5, 6],
+    )
+
+    test_explanations = explain_data(data, pipeline)
+
+    expected = [
+        engine.query_explanation({"Age_2bin": "0", "Thal": "1"}),
+        engine.query_explanation({"Age_2bin": "1"}),
+    ]
+    for i, explanation in enumerate(expected):
+        for node, state in explanation["explanation"].items():
+            assert (
+                test_explanations["explanation"].loc[5 + i, node] == state
+            ), "explain_data() did not match the engine's explanation"
+        assert np.isclose(
+            test_explanations["probability"].loc[5 + i], explanation["probability"]
+        ), "explain_data() did not match the probability of the engine's explanation"
+        assert np.allclose(
+            test_explanations["marginals"]["AHD"].loc[5 + i].to_numpy(),
+            list(explanation["marginals"]["AHD"].values()),
+        ), "explain_data() did not match the engine's marginals"
+
+
+def test_sweep_data():
+    """Tests sweep_data() matches scoring each row with each node set to each of its states"""
+    pipeline = _test_pipeline()
+    engine = get_pipeline_inference_engine(pipeline)
+    data = pd.DataFrame(
+        data={
+            "Age": [30, None],
+            "Sex": [0, 1],
+            "ExAng": [0, 0],
+            "Thal": [None, "fixed"],
+        },
+        index=[5, 6],
+    )
+
+    test_sweep = sweep_data(data, pipeline)
+
+    assert set(test_sweep["patient"]) == {5, 6}, "sweep_data() lost the index"
+    queries = [{"Age_2bin": "0"}, {"Thal": "0"}]
+    for patient, query in zip([5, 6], queries):
+        for variable in ["Age_2bin", "Thal"]:
+            for state in engine.states[variable]:
+                setting = dict(query, **{variable: state})
+                expected = engine.query(setting)["AHD"]["1"]
+                row = test_sweep[
+                    (test_sweep["patient"] == patient)
+                    & (test_sweep["variable"] == variable)
+                    & (test_sweep["state"] == state)
+                ]
+                assert np.isclose(
+                    row["probability"].iloc[0], expected
+                ), "sweep_data() did not match querying the engine with the node set"
+
+
+def test_fit_pipeline():
+    """Tests fit_pipeline() learns a tree over every node with normalised probability arrays, ready for scoring"""
+    data, planted_edges = get_synthetic_heart_disease_data(
+        n_rows=2000, n_numeric=3, n_categorical=2
+    )
+
+    test_pipeline = fit_pipeline(data.copy(), "AHD")
+
+    assert set(test_pipeline["node_states"]) == {
+        "Sex",
+        "ExAng",
+        "Numeric0_5bin",
+        "Numeric1_5bin",
+        "Numeric2_5bin",
+        "Categorical0",
+        "Categorical1",
+        "AHD",
+    }, "fit_pipeline() did not learn a node per column"
+    assert len(test_pipeline["directed_edge_list"]) == len(
+        planted_edges
+    ), "fit_pipeline() did not learn a tree"
+    for node, cpt in test_pipeline["cpts"].items():
+        assert cpt.shape[-1] == len(
+            test_pipeline["node_states"][node]
+        ), "fit_pipeline() put the wrong states on the last axis of a CPT"
+    test_scores = score_data(data.head(50), test_pipeline)
+    assert np.allclose(
+        test_scores.sum(axis=1), 1
+    ), "score_data() did not give distributions after fit_pipeline()"
+
+
+def test_update_pipeline():
+    """Tests update_pipeline() adds the counts of a batch in place, the same whether the batch comes at once or in parts"""
+    data, _ = get_synthetic_heart_disease_data(
+        n_rows=3000, n_numeric=2, n_categorical=2, missing_fraction=0
+    )
+    history, batch = data.iloc[:2000], data.iloc[2000:].copy()
+    batch.loc[batch.index[:10], "Categorical0"] = "unseen"
+    pipeline = fit_pipeline(history.copy(), "AHD")
+    old_total = pipeline["family_counts"]["Sex"].sum()
+    parts_pipeline = fit_pipeline(history.copy(), "AHD")
+
+    test_changed = update_pipeline(pipeline, batch)
+    update_pipeline(parts_pipeline, batch.iloc[:400])
+    update_pipeline(parts_pipeline, batch.iloc[400:])
+
+    assert (
+        not test_changed
+    ), "update_pipeline() flagged a change in structure on data from the same tree"
+    assert pipeline["family_counts"]["Sex"].sum() == old_total + len(
+        batch
+    ), "update_pipeline() did not add the batch to the counts"
+    assert (
+        pipeline["categories"]["Categorical0"][-1] == "unseen"
+    ), "update_pipeline() did not add the unseen category"
+    assert pipeline["node_states"]["Categorical0"][-1] == str(
+        len(pipeline["categories"]["Categorical0"]) - 1
+    ), "update_pipeline() did not add a state for the unseen category"
+    assert (
+        pipeline["family_counts"]["Categorical0"]
+        .reshape(-1, len(pipeline["node_states"]["Categorical0"]))[:, -1]
+        .sum()
+        == 10
+    ), "update_pipeline() did not count the unseen category in its own state"
+    for node, counts in pipeline["family_counts"].items():
+        assert np.array_equal(
+            counts, parts_pipeline["family_counts"][node]
+        ), "update_pipeline() counted differently when the batch came in parts"
+        assert np.allclose(
+            pipeline["cpts"][node][counts.sum(axis=-1) > 0].sum(axis=-1), 1
+        ), "update_pipeline() did not normalise the CPTs"
+    assert np.array_equal(
+        pipeline["joint_counts"], parts_pipeline["joint_counts"]
+    ), "update_pipeline() counted the mutual information differently when the batch came in parts"
+    assert (
+        pipeline["version"] == 1 and parts_pipeline["version"] == 2
+    ), "update_pipeline() did not count the updates"
+
+
+def test_fit_pipeline_sparse():
+    """Tests a sparse pipeline scores like the dense pipeline with the same smoothing, and stays the same after
+    updates"""
+    data, _ = get_synthetic_heart_disease_data(
+        n_rows=3000, n_numeric=3, n_categorical=2
+    )
+    history, batch = data.iloc[:2000], data.iloc[2000:].copy()
+    batch.loc[batch.index[:10], "Categorical0"] = "unseen"
+
+    test_pipeline = fit_pipeline(history.copy(), "AHD", sparse=True, smoothing=2.0)
+    dense_pipeline = fit_pipeline(history.copy(), "AHD", smoothing=2.0)
+
+    assert all(
+        isinstance(counts, dict) for counts in test_pipeline["family_counts"].values()
+    ), "fit_pipeline() did not keep sparse counts"
+    assert np.allclose(
+        score_data(data.head(100), test_pipeline),
+        score_data(data.head(100), dense_pipeline),
+    ), "score_data() does not give the same scores for a sparse pipeline"
+    update_pipeline(test_pipeline, batch)
+    update_pipeline(dense_pipeline, batch)
+    assert np.allclose(
+        score_data(data.head(100), test_pipeline),
+        score_data(data.head(100), dense_pipeline),
+    ), "update_pipeline() does not give the same scores for a sparse pipeline"
+
+
+def test_warm_pipeline_cache():
+    """Tests warm_pipeline_cache() fills the engine's cache with the training data's evidence patterns, and score_data()
+    ignores an engine compiled before an update"""
+    data, _ = get_synthetic_heart_disease_data(
+        n_rows=500, n_numeric=2, n_categorical=1, missing_fraction=0
+    )
+    pipeline = fit_pipeline(data.copy(), "AHD")
+    engine = get_pipeline_inference_engine(pipeline)
+
+    warm_pipeline_cache(engine, data, pipeline, n_queries=5)
+
+    assert (
+        engine.cache.get_stats()["size"] == 5
+    ), "warm_pipeline_cache() did not run the queries"
+
+    update_pipeline(pipeline, data.iloc[:100], check_structure=False)
+
+    assert np.array_equal(
+        score_data(data, pipeline, engine).values, score_data(data, pipeline).values
+    ), "score_data() used an engine compiled before the update"
@@ -0,0 +1,84 @@
+"""Tests for the query cache"""
+import pandas as pd
+from pytest import raises
+
+from utils.modelling.query_cache import QueryCache, get_frequent_queries
+
+
+def test_query_cache_lru():
+    """Tests QueryCache evicts the least recently used result and counts hits, misses and evictions"""
+    test_cache = QueryCache(maxsize=2)
+
+    test_cache.put("a", 1)
+    test_cache.put("b", 2)
+    assert test_cache.get("a") == 1, "get() did not return the cached result"
+    test_cache.put("c", 3)
+
+    assert "b" not in test_cache, "the least recently used result was not evicted"
+    assert "a" in test_cache and "c" in test_cache, "the wrong result was evicted"
+    assert test_cache.get("b") is None, "get() did not return the default on a miss"
+    assert test_cache.get_stats() == {
+        "hits": 1,
+        "misses": 1,
+        "evictions": 1,
+        "invalidations": 0,
+        "size": 2,
+        "maxsize": 2,
+    }, "get_stats() did not count the uses of the cache"
+
+    with raises(ValueError):
+        QueryCache(policy="fifo")
+
+
+def test_query_cache_lfu():
+    """Tests QueryCache with the "lfu" policy evicts the least frequently used result, least recently used first"""
+    test_cache = QueryCache(maxsize=3, policy="lfu")
+    for key in "abc":
+        test_cache.put(key, key)
+    test_cache.get("a")
+    test_cache.get("a")
+    test_cache.get("c")
+
+    test_cache.put("d", "d")
+    test_cache.put("e", "e")
+
+    assert set(test_cache._results) == {
+        "a",
+        "c",
+        "e",
+    }, "the least frequently used results were not evicted"
+
+
+def test_query_cache_validate():
+    """Tests QueryCache.validate() clears the cache only when the model changes"""
+    test_cache = QueryCache()
+    test_computes = []
+
+    test_cache.validate("model")
+    test_cache.get_or_compute("a", lambda: test_computes.append("a") or 1)
+    test_cache.validate("model")
+    test_cache.get_or_compute("a", lambda: test_computes.append("a") or 1)
+    test_cache.validate("refitted model")
+
+    assert test_computes == ["a"], "get_or_compute() recomputed a cached result"
+    assert len(test_cache) == 0, "validate() did not clear the cache for a new model"
+    assert test_cache.invalidations == 1, "validate() did not count the invalidation"
+
+
+def test_get_frequent_queries():
+    """Tests get_frequent_queries() returns the evidence patterns most frequent first, as strings with missing values
+    and the target as None"""
+    test_data = pd.DataFrame(
+        data={
+            "a": [1, 1, 1, 2, 2, None],
+            "b": ["x", "x", "x", "y", "y", "y"],
+            "t": [0, 1, 0, 1, 1, 0],
+        }
+    )
+
+    test_queries = get_frequent_queries(test_data, "t", n_queries=2)
+
+    assert test_queries == [
+        {"a": "1.0", "b": "x", "t": None},
+        {"a": "2.0", "b": "y", "t": None},
+    ], "get_frequent_queries() did not return the most frequent patterns"
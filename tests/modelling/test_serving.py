@@ -0,0 +1,150 @@
+"""Tests for the scoring server"""
+import asyncio
+import json
+import re
+
+import numpy as np
+import pytest
+
+from utils.load.synthetic_data import get_synthetic_heart_disease_data
+from utils.modelling.pipeline import (
+    fit_pipeline,
+    get_pipeline_inference_engine,
+    score_data,
+)
+from utils.modelling.serving import (
+    MicroBatcher,
+    get_rows_encoder,
+    rows_to_data_frame,
+    start_scoring_server,
+)
+
+
+def test_micro_batcher():
+    """Tests MicroBatcher coalesces concurrent requests in to batches, gives each request its own results back, and only
+    fails the requests that can't be scored"""
+    test_batches = []
+
+    def score_batch(rows):
+        test_batches.append(len(rows))
+        if any(row["x"] < 0 for row in rows):
+            raise ValueError("negative x")
+        return [{"double": row["x"] * 2} for row in rows]
+
+    async def run():
+        batcher = MicroBatcher(score_batch, max_batch_size=8, max_latency=0.05)
+        await batcher.start()
+        results = await asyncio.gather(
+            *(batcher.score([{"x": i}, {"x": i + 100}]) for i in range(10)),
+            batcher.score([{"x": -1}]),
+            return_exceptions=True,
+        )
+        await batcher.stop()
+        return results, batcher.get_stats()
+
+    test_results, test_stats = asyncio.run(run())
+
+    for i, result in enumerate(test_results[:10]):
+        assert result == [
+            {"double": 2 * i},
+            {"double": 2 * i + 200},
+        ], "MicroBatcher did not give a request its own results"
+    assert isinstance(
+        test_results[10], ValueError
+    ), "MicroBatcher did not fail the request that could not be scored"
+    assert max(test_batches) > 2, "MicroBatcher did not coalesce requests"
+    assert max(test_batches) <= 8, "MicroBatcher made a batch bigger than the limit"
+    assert (
+        test_stats["requests"] == 11 and test_stats["errors"] == 1
+    ), "MicroBatcher did not count the requests"
+
+
+
+def test_get_rows_encoder():
+    """Tests get_rows_encoder() codes patients the same as scoring them from a pd.DataFrame, and rejects values the
+    pipeline can't score"""
+    data, _ = get_synthetic_heart_disease_data(
+        n_rows=500, n_numeric=2, missing_fraction=0.1
+    )
+    pipeline = fit_pipeline(data.copy(), "AHD")
+    engine = get_pipeline_inference_engine(pipeline)
+    patients = (
+        data.drop(columns="AHD")
+        .astype(object)
+        .where(data.drop(columns="AHD").notna(), None)
+        .to_dict(orient="records")
+    )
+
+    test_codes = get_rows_encoder(pipeline, engine.nodes)(patients)
+
+    assert test_codes.shape == (
+        500,
+        len(engine.nodes),
+    ), "get_rows_encoder() did not give a column per node"
+    assert np.allclose(
+        engine.score(test_codes, "AHD").to_numpy(),
+        score_data(rows_to_data_frame(patients, pipeline), pipeline).to_numpy(),
+    ), "get_rows_encoder() did not code the patients as score_data() does"
+    for test_patient, test_message in [
+        ({"Numeric0": "high"}, "`Numeric0` has values ['high'] that are not numbers"),
+        ({"Categorical0": "weird"}, "`Categorical0` has values ['weird']"),
+    ]:
+        with pytest.raises(ValueError, match=re.escape(test_message)):
+            get_rows_encoder(pipeline)([test_patient])
+
+def test_scoring_server():
+    """Tests the scoring server gives the same scores as score_data() for a patient and a list of patients"""
+    data, _ = get_synthetic_heart_disease_data(n_rows=500, n_numeric=2)
+    pipeline = fit_pipeline(data.copy(), "AHD")
+    patients = (
+        data.drop(columns="AHD").iloc[:3].astype(object).to_dict(orient="records")
+    )
+    expected = score_data(rows_to_data_frame(patients, pipeline), pipeline)
+
+    async def post(port, payload):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        body = json.dumps(payload).encode("utf-8")
+        writer.write(
+            f"POST /score HTTP/1.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+            + body
+        )
+        response = await reader.read()
+        writer.close()
+        status = int(response.split(b" ")[1])
+        return status, json.loads(response.split(b"\r\n\r\n", 1)[1])
+
+    async def run():
+        server, batcher = await start_scoring_server(pipeline, port=0)
+        port = server.sockets[0].getsockname()[1]
+        results = [
+            await post(port, patients[0]),
+            await post(port, {"rows": patients}),
+            await post(port, "not a patient"),
+            await post(port, {**patients[0], "Categorical0": "weird"}),
+            await post(port, {**patients[0], "Numeric0": 500.0}),
+        ]
+        server.close()
+        await server.wait_closed()
+        await batcher.stop()
+        return results
+
+    test_single, test_rows, test_bad, test_category, test_number = asyncio.run(run())
+
+    assert test_single[0] == 200, "the server did not score a patient"
+    assert np.allclose(
+        list(test_single[1].values()), expected.iloc[0]
+    ), "the server did not give the same score as score_data()"
+    assert np.allclose(
+        [list(scores.values()) for scores in test_rows[1]["scores"]], expected.values
+    ), "the server did not give the same scores as score_data() for a list of patients"
+    assert list(test_single[1]) == [
+        "No",
+        "Yes",
+    ], "the server did not give the scores under the target's categories"
+    assert test_bad[0] == 400, "the server did not reject a bad request"
+    assert test_category[0] == 400 and "`Categorical0` has values ['weird']" in (
+        test_category[1]["error"]
+    ), "the server did not reject a patient with an unknown category"
+    assert test_number[0] == 400 and "`Numeric0` has values ['500.0']" in (
+        test_number[1]["error"]
+    ), "the server did not reject a patient with a number outside of the bin edges"
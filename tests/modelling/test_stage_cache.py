@@ -0,0 +1,101 @@
+"""Tests for the on-disk cache of pipeline stages"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from utils.modelling.stage_cache import StageCache, get_fingerprint
+
+
+def test_get_fingerprint():
+    """Tests get_fingerprint() gives the same fingerprint for the same inputs and a new one when any of them change"""
+    test_data = pd.DataFrame(
+        {"Age": [63.0, 67.0, None], "Thal": ["fixed", None, "normal"]}
+    )
+    test_fingerprint = get_fingerprint("preprocessing", test_data, {"bins": 5})
+
+    assert test_fingerprint == get_fingerprint(
+        "preprocessing", test_data.copy(), {"bins": 5}
+    ), "get_fingerprint() did not give the same fingerprint for the same inputs"
+    changed_data = test_data.copy()
+    changed_data.loc[1, "Thal"] = "normal"
+    for changed_inputs in [
+        ("preprocessing", test_data, {"bins": 4}),
+        ("preprocessing", changed_data, {"bins": 5}),
+        ("preprocessing", test_data.set_index(pd.Index([1, 2, 3])), {"bins": 5}),
+        ("mutual information", test_data, {"bins": 5}),
+    ]:
+        assert (
+            get_fingerprint(*changed_inputs) != test_fingerprint
+        ), "get_fingerprint() did not change with the inputs"
+
+
+def test_stage_cache(tmp_path):
+    """Tests StageCache gives back what was stored in the same dtypes and computes only on a miss"""
+    test_cache = StageCache(str(tmp_path))
+    test_output = {
+        "training_df": pd.DataFrame(
+            {
+                "Age_5bin": pd.Categorical.from_codes(
+                    np.array([0, 4, -1], dtype=np.int8), categories=range(5)
+                ),
+                "Thal": np.array([1, 0, 2], dtype=np.int8),
+            },
+            index=[3, 5, 7],
+        ),
+        "directed_edge_list": [["Thal", "AHD"]],
+        "family_counts": {"AHD": np.arange(6).reshape(3, 2)},
+    }
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return test_output
+
+    test_cache.get_or_compute("key", compute)
+    cached_output = test_cache.get_or_compute("key", compute)
+
+    assert len(calls) == 1, "get_or_compute() did not load the output on a hit"
+    pd.testing.assert_frame_equal(
+        cached_output["training_df"], test_output["training_df"]
+    )
+    assert cached_output["directed_edge_list"] == [["Thal", "AHD"]]
+    assert np.array_equal(
+        cached_output["family_counts"]["AHD"], test_output["family_counts"]["AHD"]
+    ), "StageCache did not give back the arrays"
+    assert test_cache.get("missing") is None, "get() did not return the default"
+    assert (test_cache.hits, test_cache.misses) == (1, 2)
+
+
+
+def test_stage_cache_bad_file(tmp_path):
+    """Tests StageCache counts a truncated or foreign file as a miss and removes it instead of failing"""
+    test_cache = StageCache(str(tmp_path))
+    test_cache.put("truncated", np.zeros(400))
+    location = os.path.join(str(tmp_path), "truncated.npz")
+    with open(location, "rb") as file:
+        data = file.read()
+    with open(location, "wb") as file:
+        file.write(data[: len(data) // 2])
+    np.savez(os.path.join(str(tmp_path), "foreign.npz"), values=np.arange(3))
+
+    for key in ("truncated", "foreign"):
+        assert test_cache.get(key) is None, "get() did not return the default"
+        assert key not in test_cache, "get() did not remove the bad file"
+    assert (test_cache.hits, test_cache.misses) == (0, 2)
+    assert (
+        test_cache.get_or_compute("truncated", lambda: 1) == 1
+    ), "get_or_compute() did not recompute the output"
+
+def test_stage_cache_eviction(tmp_path):
+    """Tests StageCache evicts the least recently used outputs once it holds more than its size limit"""
+    test_cache = StageCache(str(tmp_path), max_bytes=12_000)
+    for key in "abc":
+        test_cache.put(key, np.zeros(400))
+    test_cache.get("a")
+
+    test_cache.put("d", np.zeros(400))
+
+    assert "b" not in test_cache, "the least recently used output was not evicted"
+    assert all(key in test_cache for key in "acd"), "the wrong output was evicted"
+    assert test_cache.get_stats()["bytes"] <= 12_000, "the cache is over its limit"
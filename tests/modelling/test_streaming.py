@@ -0,0 +1,78 @@
+"""Tests for the chunked training path"""
+import numpy as np
+import pandas as pd
+
+from utils.graphs.mutual_information import get_joint_counts
+from utils.modelling.streaming import (
+    encode_chunk,
+    get_streaming_family_counts,
+    get_streaming_joint_counts,
+    get_streaming_schema,
+    transform_chunk,
+)
+
+
+def _write_test_csv(tmp_path: str) -> str:
+    file_location = f"{tmp_path}/test_streaming.csv"
+    pd.DataFrame(
+        data={
+            "Age": np.random.randint(30, 80, size=250),
+            "Sex": np.random.randint(0, 2, size=250),
+            "ExAng": np.random.randint(0, 2, size=250),
+            "Thal": np.random.choice(["fixed", "normal", "reversable"], size=250),
+            "AHD": np.random.choice(["No", "Yes"], size=250),
+        }
+    ).to_csv(file_location, index=False)
+    return file_location
+
+
+def test_get_streaming_schema(tmp_path: str):
+    """Tests get_streaming_schema() finds the bin edges and categories of the whole file when reading it in chunks"""
+    file_location = _write_test_csv(tmp_path)
+    data = pd.read_csv(file_location)
+
+    test_schema = get_streaming_schema(file_location, bins=4, chunksize=60)
+
+    assert np.allclose(
+        test_schema["bin_edges"]["Age"], pd.cut(data["Age"], 4, retbins=True)[1]
+    ), "get_streaming_schema() did not find the same bin edges as pd.cut"
+    assert test_schema["categories"]["Thal"] == [
+        "fixed",
+        "normal",
+        "reversable",
+    ], "get_streaming_schema() did not find the categories of the data"
+    assert list(test_schema["node_values"]) == [
+        "Age_4bin",
+        "Sex",
+        "ExAng",
+        "Thal",
+        "AHD",
+    ], "get_streaming_schema() did not return the nodes in the order of the runner"
+
+
+def test_get_streaming_counts(tmp_path: str):
+    """Tests the counts summed over chunks match the counts of the whole file"""
+    file_location = _write_test_csv(tmp_path)
+    schema = get_streaming_schema(file_location, bins=4, chunksize=60)
+    node_values = schema["node_values"]
+    cardinalities = np.array([len(values) for values in node_values.values()])
+    codes = encode_chunk(
+        transform_chunk(pd.read_csv(file_location), schema), node_values
+    )
+
+    test_joint_counts = get_streaming_joint_counts(file_location, schema, chunksize=60)
+    test_family_counts = get_streaming_family_counts(
+        file_location, schema, [["Thal", "AHD"], ["Sex", "AHD"]], chunksize=60
+    )
+
+    assert np.array_equal(
+        test_joint_counts, get_joint_counts(codes, cardinalities)
+    ), "get_streaming_joint_counts() does not match the counts of the whole file"
+    assert test_family_counts["AHD"].shape == (
+        4,
+        3,
+        3,
+    ), "get_streaming_family_counts() did not order the axes parents first"
+    assert (
+        test_family_counts["AHD"].sum() == 250
+    ), "get_streaming_family_counts() did not count every row"
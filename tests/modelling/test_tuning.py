@@ -0,0 +1,68 @@
+"""Tests for the bin count sweep"""
+import numpy as np
+import pandas as pd
+
+from utils.load.synthetic_data import get_synthetic_heart_disease_data
+from utils.modelling.tuning import get_bin_mapping, sweep_bin_counts
+from utils.modelling.validation import evaluate_pipeline
+from utils.preprocessing.generic_preprocessing import get_bin_codes, get_bin_edges
+
+
+def test_get_bin_mapping():
+    """Tests mapping fine bins on to coarse bins gives the same bins as binning the values with the coarse edges"""
+    test_values = pd.Series(np.random.default_rng(0).normal(size=1000))
+    test_bin_edges = get_bin_edges(test_values.min(), test_values.max(), 4)
+    test_fine_edges = np.unique(
+        np.concatenate(
+            [test_bin_edges, get_bin_edges(test_values.min(), test_values.max(), 7)]
+        )
+    )
+
+    test_mapping = get_bin_mapping(test_fine_edges, test_bin_edges)
+    test_fine_codes = np.asarray(get_bin_codes(test_values, test_fine_edges).codes)
+
+    assert np.array_equal(
+        test_mapping[test_fine_codes],
+        np.asarray(get_bin_codes(test_values, test_bin_edges).codes),
+    ), "get_bin_mapping() did not give the bins of the coarse edges"
+    assert np.array_equal(
+        get_bin_mapping(test_fine_edges, test_fine_edges[2:-2])[[0, 1, -1]],
+        [-1, -1, -1],
+    ), "get_bin_mapping() did not leave out fine bins outside of the coarse edges"
+
+
+def test_sweep_bin_counts():
+    """Tests the sweep reports every candidate, and the equal width and quantile candidates, coarsened from the counts,
+    score the same as refitting the pipeline with each of them"""
+    test_data, _ = get_synthetic_heart_disease_data(600, seed=1)
+
+    test_report = sweep_bin_counts(test_data, "AHD", bin_counts=(3, 5), k=3)
+
+    assert list(zip(test_report["strategy"], test_report["bins"])) == [
+        ("uniform", 3),
+        ("uniform", 5),
+        ("quantile", 3),
+        ("quantile", 5),
+        ("supervised", 3),
+        ("supervised", 5),
+    ], "sweep_bin_counts() did not report every candidate"
+    assert np.isfinite(
+        test_report["log_likelihood"]
+    ).all(), "sweep_bin_counts() did not give a finite log-likelihood"
+    assert (
+        0.5 < test_report["auc"]
+    ).all(), "sweep_bin_counts() did not beat chance with every candidate"
+    for _, test_row in test_report[test_report["strategy"] != "supervised"].iterrows():
+        expected_report = evaluate_pipeline(
+            test_data,
+            "AHD",
+            k=3,
+            n_resamples=0,
+            bins=test_row["bins"],
+            binning=test_row["strategy"],
+            smoothing=1.0,
+        )["cross_validation"]
+        for test_key in ("log_loss", "accuracy", "auc"):
+            assert np.isclose(
+                test_row[test_key], expected_report[test_key]
+            ), "sweep_bin_counts() did not match refitting the pipeline"
@@ -0,0 +1,94 @@
+"""Tests for the cross validation and bootstrap harness"""
+import numpy as np
+import pytest
+from sklearn.metrics import log_loss, roc_auc_score
+
+from utils.load.synthetic_data import get_synthetic_heart_disease_data
+from utils.modelling.validation import (
+    evaluate_pipeline,
+    get_auc,
+    get_edge_frequencies,
+    get_log_loss,
+)
+
+
+def test_get_auc():
+    """Tests get_auc() agrees with sklearn, ties included"""
+    test_random = np.random.default_rng(0)
+    test_truth = test_random.integers(0, 2, 200).astype(bool)
+    test_scores = test_random.integers(0, 10, 200) + test_truth * 2
+    # Tenths of the integer scores, with noise in the last bits of the floats, that should rank as the same ties
+    test_noisy_scores = test_scores / 10 + test_truth * 1e-16 - 1e-16
+
+    assert np.isclose(
+        get_auc(test_truth, test_scores), roc_auc_score(test_truth, test_scores)
+    ), "get_auc() did not agree with sklearn"
+    assert get_auc(test_truth, test_noisy_scores) == get_auc(
+        test_truth, test_scores
+    ), "get_auc() did not count near ties as ties"
+    assert np.isnan(
+        get_auc(np.ones(5, dtype=bool), np.arange(5))
+    ), "get_auc() did not give nan without negatives"
+
+
+def test_get_log_loss():
+    """Tests get_log_loss() agrees with sklearn"""
+    test_random = np.random.default_rng(0)
+    test_probabilities = test_random.dirichlet(np.ones(3), 100)
+    test_truth = test_random.integers(0, 3, 100)
+
+    assert np.isclose(
+        get_log_loss(test_truth, test_probabilities),
+        log_loss(test_truth, test_probabilities, labels=[0, 1, 2]),
+    ), "get_log_loss() did not agree with sklearn"
+
+
+def test_get_edge_frequencies():
+    """Tests get_edge_frequencies() counts undirected edges"""
+    test_frequencies = get_edge_frequencies(
+        [[["a", "b"], ["c", "b"]], [["b", "a"]], [["a", "c"]], [["b", "a"]]]
+    )
+
+    assert test_frequencies == {
+        "a -- b": 0.75,
+        "a -- c": 0.25,
+        "b -- c": 0.25,
+    }, "get_edge_frequencies() did not count undirected edges"
+
+
+def test_evaluate_pipeline():
+    """Tests evaluate_pipeline() reports sensible metrics and frequencies, and gives the same report over processes"""
+    test_data, _ = get_synthetic_heart_disease_data(600, seed=1)
+    test_report = evaluate_pipeline(test_data, "AHD", k=4, n_resamples=6)
+    test_parallel_report = evaluate_pipeline(
+        test_data, "AHD", k=4, n_resamples=6, n_jobs=2
+    )
+    test_cross_validation = test_report["cross_validation"]
+
+    assert (
+        test_cross_validation["rows"] == 600
+    ), "evaluate_pipeline() did not score every row once"
+    assert (
+        0.5 < test_cross_validation["auc"] <= 1
+    ), "evaluate_pipeline() did not beat chance"
+    assert (
+        len(test_cross_validation["fold_auc"]) == 4
+    ), "evaluate_pipeline() did not report every fold"
+    assert all(
+        0 < frequency <= 1
+        for frequency in test_report["bootstrap"]["edge_frequencies"].values()
+    ), "evaluate_pipeline() did not give edge frequencies"
+    assert np.isclose(
+        sum(test_report["bootstrap"]["edge_frequencies"].values()),
+        test_data.shape[1] - 1,
+    ), "evaluate_pipeline() did not give a tree for every resample"
+    for test_key in ("auc", "log_loss", "accuracy"):
+        assert np.isclose(
+            test_cross_validation[test_key],
+            test_parallel_report["cross_validation"][test_key],
+        ), "evaluate_pipeline() did not give the same report over processes"
+    assert (
+        test_report["bootstrap"] == test_parallel_report["bootstrap"]
+    ), "evaluate_pipeline() did not give the same edges over processes"
+    with pytest.raises(ValueError, match="supervised"):
+        evaluate_pipeline(test_data, "AHD", k=4, n_resamples=0, binning="supervised")
@@ -19,5 +19,8 @@ def test_convert_columns_to_correct_types():
         correct_types_df, pd.DataFrame
     ), "convert_columns_to_correct_types() did not return pd.DataFrame"
     assert is_string_dtype(
-        correct_types_df.dtypes["Sex"]
-    ), "column has not been converted to numeric."
+        correct_types_df["Sex"].cat.categories.dtype
+    ), "categories of the column have not been converted to strings."
+    assert (
+        correct_types_df["Sex"].cat.codes.dtype == "int8"
+    ), "column is not stored as compact codes."
@@ -0,0 +1,90 @@
+"""Tests for fitting bin edges"""
+import numpy as np
+import pandas as pd
+from pytest import approx, raises
+
+from utils.preprocessing.binning import (
+    fit_bin_edges,
+    get_quantile_bin_edges,
+    get_quantile_sketch,
+    get_sketch_bin_edges,
+    get_supervised_bin_edges,
+    merge_quantile_sketches,
+)
+from utils.preprocessing.generic_preprocessing import get_bin_codes, get_bin_edges
+
+
+def test_get_quantile_bin_edges():
+    """This tests get_quantile_bin_edges() puts the same number of values in every bin, whatever the outliers, and
+    merges bins that would be empty because of repeated values"""
+    test_values = pd.Series(np.concatenate([np.arange(999.0), [1e9]]))
+
+    test_bin_edges = get_quantile_bin_edges(test_values, 4)
+
+    assert np.array_equal(
+        np.bincount(get_bin_codes(test_values, test_bin_edges).codes), [250] * 4
+    ), "get_quantile_bin_edges() did not put the same number of values in every bin"
+    assert (
+        len(get_quantile_bin_edges(pd.Series([1, 1, 1, 1, 1, 2, 3, np.nan]), 4)) == 3
+    ), "get_quantile_bin_edges() did not merge bins of repeated values"
+
+
+def test_merge_quantile_sketches():
+    """This tests quantile bins from merged sketches of chunks are close to the exact quantile bins"""
+    test_values = pd.Series(np.random.default_rng(0).normal(50, 10, 100_000))
+
+    test_sketch = None
+    for chunk in np.array_split(test_values, 20):
+        chunk_sketch = get_quantile_sketch(pd.Series(chunk), size=500)
+        test_sketch = (
+            chunk_sketch
+            if test_sketch is None
+            else merge_quantile_sketches(test_sketch, chunk_sketch, size=500)
+        )
+
+    assert test_sketch[1].sum() == approx(
+        len(test_values)
+    ), "merge_quantile_sketches() lost track of the number of values"
+    assert np.allclose(
+        get_sketch_bin_edges(test_sketch, 5),
+        get_quantile_bin_edges(test_values, 5),
+        atol=0.5,
+    ), "get_sketch_bin_edges() is not close to the exact quantiles"
+
+
+def test_get_supervised_bin_edges():
+    """This tests get_supervised_bin_edges() puts an edge where the target changes, and the bins keep more information
+    about the target than equal width bins"""
+    rng = np.random.default_rng(0)
+    test_values = pd.Series(rng.uniform(0, 100, 5000))
+    test_target = pd.Series(np.where(test_values > 37, "Yes", "No"))
+
+    test_bin_edges = get_supervised_bin_edges(test_values, test_target, 2)
+
+    assert len(test_bin_edges) == 3, "get_supervised_bin_edges() did not give 2 bins"
+    assert (
+        abs(test_bin_edges[1] - 37) < 2
+    ), "get_supervised_bin_edges() did not cut where the target changes"
+    assert pd.crosstab(get_bin_codes(test_values, test_bin_edges), test_target).min(
+        axis=1
+    ).sum() < 0.01 * len(
+        test_values
+    ), "get_supervised_bin_edges() bins do not separate the target"
+
+
+def test_fit_bin_edges():
+    """This tests fit_bin_edges() fits every column, matching get_bin_edges() for uniform bins"""
+    test_data = pd.DataFrame(data={"col1": [1.5, 7.0, 3.2, 9.9], "col2": [1, 2, 3, 4]})
+
+    test_bin_edges = fit_bin_edges(test_data, 3)
+
+    for column in test_data.columns:
+        assert np.array_equal(
+            test_bin_edges[column],
+            get_bin_edges(test_data[column].min(), test_data[column].max(), 3),
+        ), "fit_bin_edges() uniform edges do not match get_bin_edges()"
+
+    with raises(ValueError):
+        fit_bin_edges(test_data, 3, strategy="kmeans")
+    with raises(ValueError):
+        fit_bin_edges(test_data, 3, strategy="supervised")
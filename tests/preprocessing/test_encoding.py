@@ -0,0 +1,93 @@
+"""Tests for integer encoding of discretised data"""
+import numpy as np
+import pandas as pd
+
+from utils.preprocessing.encoding import (
+    encode_categorical_columns,
+    encode_categories,
+    encode_data_frame,
+)
+
+
+def test_encode_data_frame():
+    """This tests encode_data_frame() returns compact, sorted codes with -1 for missing values"""
+    test_data = pd.DataFrame(
+        data={"col1": [3, 1, 2, 1, 3], "col2": ["b", "a", None, "a", "b"]}
+    )
+
+    test_codes, test_states = encode_data_frame(test_data)
+
+    assert (
+        test_codes.dtype == np.int8
+    ), "encode_data_frame() did not use the smallest dtype"
+    assert test_codes[:, 0].tolist() == [
+        2,
+        0,
+        1,
+        0,
+        2,
+    ], "encode_data_frame() codes are not in sorted order"
+    assert test_codes[:, 1].tolist() == [
+        1,
+        0,
+        -1,
+        0,
+        1,
+    ], "encode_data_frame() did not mark missing values with -1"
+    assert list(test_states["col2"]) == [
+        "a",
+        "b",
+    ], "encode_data_frame() returned unexpected states"
+
+
+def test_encode_categorical_columns():
+    """This tests encode_categorical_columns() keeps the columns with few unique values, whether or not the sample
+    already rules the others out, and codes them in sorted order with -1 for missing values"""
+    test_data = pd.DataFrame(
+        data={
+            "many": np.arange(100.0),
+            "late": [1.0] * 50 + list(np.arange(50.0)),
+            "few": [2.0, np.nan, 1.0, 2.0] * 25,
+            "constant": [7] * 100,
+            "text": ["b", "a", None, "c"] * 25,
+            "excluded": ["a", "b"] * 50,
+        }
+    )
+
+    for sample_size in [10, 1000]:
+        test_codes, test_categories = encode_categorical_columns(
+            test_data, ["excluded"], unique_value_limit=15, sample_size=sample_size
+        )
+
+        assert list(test_codes.columns) == [
+            "few",
+            "text",
+        ], "encode_categorical_columns() did not find the categorical columns"
+        assert test_categories == {
+            "few": [1.0, 2.0],
+            "text": ["a", "b", "c"],
+        }, "encode_categorical_columns() did not give the sorted categories"
+        assert test_codes["text"].tolist()[:4] == [
+            1,
+            0,
+            -1,
+            2,
+        ], "encode_categorical_columns() did not code against the sorted categories"
+        assert (
+            test_codes["few"].dtype == np.int8
+        ), "encode_categorical_columns() did not use the smallest dtype"
+
+
+def test_encode_categories():
+    """This tests encode_categories() codes new data, plain or categorical, the same as the data the categories were
+    found on, with -1 for missing and unseen values"""
+    test_column = pd.Series(["c", "a", None, "z", "b"])
+
+    for column in [test_column, test_column.astype("category")]:
+        assert encode_categories(column, ["a", "b", "c"]).tolist() == [
+            2,
+            0,
+            -1,
+            -1,
+            1,
+        ], "encode_categories() did not code against the categories"
@@ -1,12 +1,15 @@
 """Tests for data preprocessing functions"""
 
 import pandas as pd
+import numpy as np
 from pytest import raises
 
 from utils.preprocessing.generic_preprocessing import (
     reduce_data_frame_to_categorical_columns,
     reduce_data_frame_to_numeric_columns,
     bin_numeric_data,
+    get_bin_codes,
+    get_bin_edges,
 )
 
 
@@ -84,6 +87,49 @@ def test_bin_numeric_data():
         ), "expected columns were not found in dataframe output by bin_numeric_data()"
 
 
+def test_get_bin_edges():
+    """This tests get_bin_edges() gives the same edges as pd.cut, and that bin_numeric_data() bins the same way with
+    them"""
+    test_data = pd.DataFrame(
+        data={"col1": [1.5, 7.0, 3.2, 9.9, 4.4], "col2": [2, 2, 2, 2, 2],}
+    )
+
+    for column in test_data.columns:
+        test_bin_edges = get_bin_edges(
+            test_data[column].min(), test_data[column].max(), 3
+        )
+        assert np.allclose(
+            test_bin_edges, pd.cut(test_data[column], 3, retbins=True)[1]
+        ), "get_bin_edges() did not return the same edges as pd.cut"
+
+    test_binned_data = bin_numeric_data(
+        test_data,
+        3,
+        bin_edges={
+            column: get_bin_edges(test_data[column].min(), test_data[column].max(), 3)
+            for column in test_data.columns
+        },
+    )
+    assert test_binned_data.equals(
+        bin_numeric_data(test_data, 3)
+    ), "bin_numeric_data() did not bin the same way with fixed bin edges"
+
+
+def test_get_bin_codes():
+    """This tests get_bin_codes() bins the same way as pd.cut, with missing values and values outside the edges as
+    missing, in int8 codes"""
+    test_values = pd.Series([0.5, 1.0, 1.5, 2.0, 7.0, np.nan, 9.0, 10.5])
+    test_bin_edges = np.array([1.0, 4.0, 7.0, 10.0])
+
+    test_codes = get_bin_codes(test_values, test_bin_edges)
+
+    assert test_codes.codes.dtype == np.int8, "get_bin_codes() did not use int8 codes"
+    assert np.array_equal(
+        test_codes.codes,
+        pd.cut(test_values, test_bin_edges, labels=False).fillna(-1).astype(int),
+    ), "get_bin_codes() did not bin the same way as pd.cut"
+
+
 def test_reduce_data_frame_to_categorical_columns():
     """This tests reduce_data_frame_to_categorical_columns() by passing in different dataframes and checking that it
     returns the ones we passed in but only with numeric columns"""
@@ -0,0 +1,86 @@
+"""Tests for the profiling instrumentation"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from utils.profiling import (
+    disable_profiling,
+    enable_profiling,
+    is_profiling_enabled,
+    profile_stage,
+    profiled,
+    summarise_records,
+    write_profile_report,
+)
+
+
+@profiled
+def _double(data: pd.DataFrame) -> pd.DataFrame:
+    return data * 2
+
+
+def test_profiled_disabled():
+    """Tests profiled functions record nothing while profiling is disabled"""
+    disable_profiling()
+    data = pd.DataFrame(data={"a": [1, 2, 3]})
+
+    test_output = _double(data)
+
+    assert not is_profiling_enabled(), "profiled() enabled profiling"
+    assert test_output["a"].tolist() == [
+        2,
+        4,
+        6,
+    ], "profiled() changed the output of the function"
+    assert disable_profiling() == [], "profiled() recorded a stage while disabled"
+
+
+def test_profile_stage():
+    """Tests stages record their wall time, shape and memory, with nested stages finishing first"""
+    enable_profiling(trace_memory=True)
+    with profile_stage("outer"):
+        _double(pd.DataFrame(data={"a": range(10), "b": range(10)}))
+        with profile_stage("inner"):
+            array = np.ones(100_000)
+        del array
+    test_records = disable_profiling()
+
+    assert [record["stage"] for record in test_records] == [
+        f"{_double.__module__}._double",
+        "inner",
+        "outer",
+    ], "profile_stage() did not record the stages in the order they finished"
+    assert test_records[0]["rows"] == 10, "profiled() did not record the rows"
+    assert test_records[0]["columns"] == 2, "profiled() did not record the columns"
+    assert [record["depth"] for record in test_records] == [
+        1,
+        1,
+        0,
+    ], "profile_stage() did not record how deep the stages were nested"
+    assert (
+        test_records[2]["traced_peak"] >= test_records[1]["traced_peak"] >= 800_000
+    ), "profile_stage() did not record the peak memory of the stages"
+    assert all(
+        record["wall_time"] >= 0 for record in test_records
+    ), "profile_stage() did not record the wall time"
+
+
+def test_write_profile_report(tmp_path: str):
+    """Tests write_profile_report() writes the records and their summary as JSON"""
+    file_location = f"{tmp_path}/profile.json"
+    records = [
+        {"stage": "a", "depth": 0, "wall_time": 1.0},
+        {"stage": "a", "depth": 0, "wall_time": 2.0},
+    ]
+
+    write_profile_report(records, file_location)
+    with open(file_location) as file:
+        test_report = json.load(file)
+
+    assert test_report["stages"] == records, "write_profile_report() lost records"
+    assert (
+        test_report["summary"]
+        == summarise_records(records)
+        == {"a": {"calls": 2, "wall_time": 3.0}}
+    ), "write_profile_report() did not summarise the records"
@@ -1,10 +1,20 @@
 """This module is for "querying" models, which is functions for asking questions of models, such as 'what would happen
 if this variable was set to the value X? Or what is likely to happen for car Y?'"""
 
+from typing import Optional, Union
+
+import pandas as pd
 from pomegranate import BayesianNetwork
 
+from utils.modelling.inference import compile_bayesian_network
+from utils.modelling.query_cache import QueryCache
+from utils.profiling import profiled
+
 
-def query_bayesian_network(model: BayesianNetwork, query: dict) -> dict:
+@profiled
+def query_bayesian_network(
+    model: BayesianNetwork, query: dict, cache: Optional[QueryCache] = None
+) -> dict:
     """This will take an existing `BayesianNetwork` and will run some queries over the data and return the outputs. The
     output is the conditional joint probability distribution of the nodes in the network not held in evidence. Where
     "holding in evidence" means passing in a value to the network for a node.
@@ -14,12 +24,30 @@ def query_bayesian_network(model: BayesianNetwork, query: dict) -> dict:
         state_name_order: The order the states were added to the network
         query: The query, which will be in the form of a dictionary, where the keys are the names of the nodes/state and
             the value is the value you want to set that state to in the network.
+        cache: A `QueryCache` of earlier results, keyed on the evidence in the order of the model's states. It is
+            cleared when it is passed a different model, such as a refitted one.
 
     Returns: The joint conditional probability distribution of the nodes not held in evidence, given the state of the
         nodes held in evidence.
 
     """
     state_name_order = [state.name for state in model.states]
+    if cache is None:
+        return _query_bayesian_network(model, query, state_name_order)
+    key = tuple(
+        None if query[state_name] is None else str(query[state_name])
+        for state_name in state_name_order
+    )
+    cache.validate(model)
+    out_dict = cache.get_or_compute(
+        key, lambda: _query_bayesian_network(model, query, state_name_order)
+    )
+    return {node: dict(states) for node, states in out_dict.items()}
+
+
+def _query_bayesian_network(
+    model: BayesianNetwork, query: dict, state_name_order: list
+) -> dict:
     results = model.predict_proba(
         [[query[state_name] for state_name in state_name_order]]
     )[0]
@@ -28,3 +56,47 @@ def query_bayesian_network(model: BayesianNetwork, query: dict) -> dict:
         if query[state_name_order[i]] is None:
             out_dict[state_name_order[i]] = results[i].parameters[0]
     return out_dict
+
+
+@profiled
+def score_bayesian_network(
+    model: BayesianNetwork, data: pd.DataFrame, target: str
+) -> pd.DataFrame:
+    """The batch form of query_bayesian_network(), this gives the posterior distribution of the `target` for every row
+    of `data` in one call, using exact inference. When scoring several tables with the same model, compile it once with
+    `utils.modelling.inference.compile_bayesian_network` and call `score` on the result instead.
+
+    Args:
+        model: A trained pomegranate `BayesianNetwork`.
+        data: The evidence, with a column per observed node and missing values for nodes not held in evidence.
+        target: The node to get the posterior distribution of.
+
+    Returns: A pd.DataFrame with a column per state of the `target`, aligned to the index of `data`.
+
+    """
+    return compile_bayesian_network(model).score(data, target)
+
+
+@profiled
+def sweep_bayesian_network(
+    model: BayesianNetwork,
+    data: Union[pd.DataFrame, dict],
+    target: str,
+    target_state: Optional[str] = None,
+) -> pd.DataFrame:
+    """Answers "what would happen to the `target` if this variable was set to the value X" for every variable and value
+    at once, instead of running query_bayesian_network() once per variable per value per patient. The posterior of the
+    `target` under every single variable setting comes from one pass of exact inference over the network.
+
+    Args:
+        model: A trained pomegranate `BayesianNetwork`.
+        data: The evidence of a single patient, as a query for query_bayesian_network(), or of many, with a column per
+            observed node and missing values for nodes not held in evidence.
+        target: The node to get the posterior distribution of.
+        target_state: The state of the `target` to give the probability of, defaults to its last state.
+
+    Returns: A tidy pd.DataFrame with a row per patient, variable and value, giving the "probability" of the
+        `target_state` with the variable set to the value and its "delta" from the probability given the evidence alone.
+
+    """
+    return compile_bayesian_network(model).sweep(data, target, target_state)
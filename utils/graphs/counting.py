@@ -0,0 +1,264 @@
+"""
+A module for building count tables, the sufficient statistics the probability distributions are estimated from. A table
+is either dense, an array with an axis per variable, or sparse, a dictionary holding the "parent_codes" of only the
+combinations of parent states that were observed and the "counts" of the child's states for each of them, so its size
+grows with the data rather than with the number of possible combinations.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+# The codes shared with a worker process by get_family_counts(), memory-mapped so every worker reads the same pages.
+_worker_codes: Optional[np.ndarray] = None
+
+
+def get_contingency_table(
+    codes: np.ndarray,
+    cardinalities: Sequence[int],
+    weights: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Counts the joint occurrences of the states of several variables with a single `np.bincount` over the mixed-radix
+    index of their codes. Rows where any of the variables is missing are left out.
+
+    Args:
+        codes (np.ndarray): The integer codes of the variables, one column per variable, -1 marks a missing value.
+        cardinalities (Sequence[int]): The number of states of each variable.
+        weights (np.ndarray, optional): The number of times each row occurs, so distinct rows can be counted in place
+            of the data they came from. Defaults to once each.
+
+    Returns: An N-dimensional array of counts with one axis per variable, in the order of the columns of `codes`.
+
+    """
+    cardinalities = tuple(int(cardinality) for cardinality in cardinalities)
+    if codes.ndim == 1:
+        codes = codes[:, None]
+    present = (codes >= 0).all(axis=1)
+    flat_index = np.ravel_multi_index(
+        tuple(codes[present].T.astype(np.intp)), cardinalities
+    )
+    return np.bincount(
+        flat_index,
+        weights=None if weights is None else weights[present],
+        minlength=int(np.prod(cardinalities)),
+    ).reshape(cardinalities)
+
+
+def get_sparse_contingency_table(
+    codes: np.ndarray, cardinalities: Sequence[int]
+) -> Dict[str, np.ndarray]:
+    """Counts the joint occurrences of the states of several variables like get_contingency_table(), but only for the
+    combinations of states of the parents, every variable but the last, that occur. Rows where any of the variables is
+    missing are left out.
+
+    Args:
+        codes (np.ndarray): The integer codes of the variables, one column per variable with the child last, -1 marks a
+            missing value.
+        cardinalities (Sequence[int]): The number of states of each variable.
+
+    Returns: A sparse table, a dictionary of the "parent_codes" of each observed combination, with a row per combination
+        and a column per parent, and the "counts" of each state of the child for each combination.
+
+    """
+    cardinalities = tuple(int(cardinality) for cardinality in cardinalities)
+    if codes.ndim == 1:
+        codes = codes[:, None]
+    codes = codes[(codes >= 0).all(axis=1)].astype(np.int64)
+    parent_codes, inverse = np.unique(codes[:, :-1], axis=0, return_inverse=True)
+    if len(codes) == 0 and len(cardinalities) == 1:
+        # A table without parents always has its single, empty, combination
+        parent_codes = np.zeros((1, 0), dtype=np.int64)
+    counts = np.bincount(
+        inverse.ravel() * cardinalities[-1] + codes[:, -1],
+        minlength=len(parent_codes) * cardinalities[-1],
+    ).reshape(len(parent_codes), cardinalities[-1])
+    return {"parent_codes": parent_codes, "counts": counts}
+
+
+def merge_sparse_contingency_tables(
+    table: Dict[str, np.ndarray], other_table: Dict[str, np.ndarray]
+) -> Dict[str, np.ndarray]:
+    """Adds two sparse tables of the same variables together, the child may have more states in one than the other.
+
+    Args:
+        table (Dict[str, np.ndarray]): A sparse table, as output by get_sparse_contingency_table().
+        other_table (Dict[str, np.ndarray]): Another sparse table of the same variables.
+
+    Returns: The sparse table of the summed counts.
+
+    """
+    n_states = max(table["counts"].shape[1], other_table["counts"].shape[1])
+    counts = np.concatenate(
+        [
+            np.pad(t["counts"], [(0, 0), (0, n_states - t["counts"].shape[1])])
+            for t in (table, other_table)
+        ]
+    )
+    parent_codes, inverse = np.unique(
+        np.concatenate([table["parent_codes"], other_table["parent_codes"]]).astype(
+            np.int64
+        ),
+        axis=0,
+        return_inverse=True,
+    )
+    summed = np.zeros((len(parent_codes), n_states))
+    np.add.at(summed, inverse.ravel(), counts)
+    return {"parent_codes": parent_codes, "counts": summed}
+
+
+def _get_prior(child_counts: np.ndarray) -> np.ndarray:
+    """The prior of a child's states that conditional probabilities are smoothed towards: its marginal frequencies
+    with one added to each state, so no state is ever impossible."""
+    return (child_counts + 1) / (child_counts.sum() + len(child_counts))
+
+
+def get_conditional_probabilities(
+    counts: np.ndarray, pseudo_count: float = 0.0
+) -> np.ndarray:
+    """Normalises a table of counts along its last axis, giving the probability of each state of the child given each
+    combination of states of the parents. Combinations of parent states that never occur get a probability of zero.
+
+    With a `pseudo_count`, each combination is smoothed with a Dirichlet prior of that many pseudo-observations spread
+    over the child's states in proportion to their marginal frequencies, so combinations that never occur get the
+    marginal distribution of the child instead.
+
+    Args:
+        counts (np.ndarray): The joint counts of the parents and the child, with the child on the last axis.
+        pseudo_count (float): The weight of the prior, in observations, 0 for the maximum likelihood estimate.
+
+    Returns: The conditional probabilities, with the same shape as `counts`.
+
+    """
+    if pseudo_count > 0:
+        prior = _get_prior(counts.reshape(-1, counts.shape[-1]).sum(axis=0))
+        counts = counts + pseudo_count * prior
+    totals = counts.sum(axis=-1, keepdims=True)
+    return np.divide(
+        counts,
+        totals,
+        out=np.zeros(counts.shape),
+        where=np.broadcast_to(totals > 0, counts.shape),
+    )
+
+
+def get_sparse_conditional_probabilities(
+    table: Dict[str, np.ndarray], pseudo_count: float = 0.0
+) -> Dict[str, np.ndarray]:
+    """Normalises a sparse table of counts like get_conditional_probabilities(). The observed combinations of parent
+    states keep their own row of probabilities, and every other combination shares a single "default" row, the prior
+    of the child, so unseen combinations never make the evidence impossible.
+
+    Args:
+        table (Dict[str, np.ndarray]): A sparse table, as output by get_sparse_contingency_table().
+        pseudo_count (float): The weight of the prior in each observed combination, in observations.
+
+    Returns: A sparse conditional probability table, a dictionary of the "parent_codes" of each observed combination,
+        their "probabilities" with a row per combination and a column per state of the child, and the "default"
+        probabilities of every other combination.
+
+    """
+    counts = np.asarray(table["counts"], dtype=np.float64)
+    prior = _get_prior(counts.sum(axis=0))
+    counts = counts + pseudo_count * prior
+    totals = counts.sum(axis=-1, keepdims=True)
+    return {
+        "parent_codes": np.asarray(table["parent_codes"]),
+        "probabilities": np.divide(
+            counts,
+            totals,
+            out=np.broadcast_to(prior, counts.shape).copy(),
+            where=np.broadcast_to(totals > 0, counts.shape),
+        ),
+        "default": prior,
+    }
+
+
+def get_dense_conditional_probabilities(
+    cpt: Dict[str, np.ndarray], cardinalities: Sequence[int]
+) -> np.ndarray:
+    """Lays a sparse conditional probability table out in full, as the array get_conditional_probabilities() gives,
+    for consumers that need every combination of parent states, such as pomegranate.
+
+    Args:
+        cpt (Dict[str, np.ndarray]): A sparse table, as output by get_sparse_conditional_probabilities().
+        cardinalities (Sequence[int]): The number of states of each parent and the child.
+
+    Returns: The conditional probabilities, with one axis per parent followed by the child's axis.
+
+    """
+    cardinalities = tuple(int(cardinality) for cardinality in cardinalities)
+    dense = np.empty(cardinalities)
+    dense[...] = np.asarray(cpt["default"])[: cardinalities[-1]]
+    parent_codes = np.asarray(cpt["parent_codes"]).astype(np.intp)
+    dense[tuple(parent_codes.T)] = cpt["probabilities"]
+    return dense
+
+
+def _attach_codes(file_location: str) -> None:
+    """Memory-maps the codes written by get_family_counts() in to a worker process."""
+    global _worker_codes
+    _worker_codes = np.load(file_location, mmap_mode="r")
+
+
+def _count_families(
+    families: List[Tuple[str, List[int], List[int]]], sparse: bool = False
+) -> Dict[str, Union[np.ndarray, Dict[str, np.ndarray]]]:
+    """Counts a batch of families in a worker process, each given as its node, columns and cardinalities."""
+    count = get_sparse_contingency_table if sparse else get_contingency_table
+    return {
+        node: count(_worker_codes[:, columns], cardinalities)
+        for node, columns, cardinalities in families
+    }
+
+
+def get_family_counts(
+    codes: np.ndarray,
+    cardinalities: Sequence[int],
+    families: Dict[str, List[int]],
+    n_jobs: int = 1,
+    sparse: bool = False,
+) -> Dict[str, Union[np.ndarray, Dict[str, np.ndarray]]]:
+    """Builds the contingency table of every family of variables. Each table only needs its own columns of `codes`, so
+    with `n_jobs` above 1 the tables are counted over a pool of processes. The codes are written once to a memory-mapped
+    file that every process maps, rather than being copied to each of them.
+
+    Args:
+        codes (np.ndarray): The integer codes of the variables, one column per variable, -1 marks a missing value.
+        cardinalities (Sequence[int]): The number of states of each variable.
+        families (Dict[str, List[int]]): The columns of `codes` in each family, keyed by the family's name.
+        n_jobs (int): The number of processes to count over.
+        sparse (bool): Whether to count sparse tables with get_sparse_contingency_table(), the last column of each
+            family being the child.
+
+    Returns: The contingency table of each family, with one axis per column in the order given in `families`.
+
+    """
+    tasks = [
+        (node, columns, [int(cardinalities[i]) for i in columns])
+        for node, columns in families.items()
+    ]
+    if n_jobs <= 1 or len(tasks) < 2:
+        count = get_sparse_contingency_table if sparse else get_contingency_table
+        return {
+            node: count(codes[:, columns], node_cardinalities)
+            for node, columns, node_cardinalities in tasks
+        }
+
+    n_jobs = min(n_jobs, len(tasks))
+    # Largest tables first, dealt round robin, so the batches take about as long as each other
+    tasks.sort(key=lambda task: -int(np.prod(task[2])))
+    batches = [tasks[i::n_jobs] for i in range(n_jobs)]
+    family_counts = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        file_location = os.path.join(directory, "codes.npy")
+        np.save(file_location, codes)
+        with ProcessPoolExecutor(
+            max_workers=n_jobs, initializer=_attach_codes, initargs=(file_location,)
+        ) as executor:
+            for batch_counts in executor.map(
+                _count_families, batches, [sparse] * len(batches)
+            ):
+                family_counts.update(batch_counts)
+    return {node: family_counts[node] for node in families}
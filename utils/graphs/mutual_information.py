@@ -0,0 +1,238 @@
+"""
+A module for computing the pairwise mutual information between discretised variables in batch
+"""
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.preprocessing.encoding import encode_data_frame
+from utils.profiling import profiled
+
+# The one-hot block of a row chunk is kept under this many cells so memory stays bounded on long data.
+_MAX_CHUNK_CELLS = 2**24
+
+
+def _get_offsets(cardinalities: np.ndarray) -> np.ndarray:
+    """Gets the position of the first state of every variable in the stacked one-hot layout."""
+    return np.concatenate([[0], np.cumsum(cardinalities)[:-1]]).astype(np.int64)
+
+
+def _one_hot(codes: np.ndarray, offsets: np.ndarray, total_states: int) -> np.ndarray:
+    """One-hot encodes a chunk of `codes` in to the stacked layout, missing (-1) codes produce all-zero blocks."""
+    one_hot = np.zeros((codes.shape[0], total_states), dtype=np.float32)
+    rows, columns = np.nonzero(codes >= 0)
+    one_hot[rows, codes[rows, columns].astype(np.int64) + offsets[columns]] = 1
+    return one_hot
+
+
+def get_joint_counts(
+    codes: np.ndarray,
+    cardinalities: np.ndarray,
+    chunk_size: Optional[int] = None,
+    n_jobs: int = 1,
+) -> np.ndarray:
+    """Counts the joint occurrences of every pair of states of every pair of variables in one pass. The counts are laid
+    out as a square matrix where the block at `[offset_i:offset_i + k_i, offset_j:offset_j + k_j]` is the contingency
+    table of variables `i` and `j`, and the diagonal blocks hold the marginal counts.
+
+    Args:
+        codes (np.ndarray): The integer codes of the data, one column per variable, -1 marks a missing value.
+        cardinalities (np.ndarray): The number of states of each variable.
+        chunk_size (int, optional): The number of rows to count at once, defaults to a size that keeps the one-hot
+            block of a chunk at around 64MB.
+        n_jobs (int): The number of threads to spread the column blocks of each chunk over.
+
+    Returns: The stacked joint count matrix.
+
+    """
+    cardinalities = np.asarray(cardinalities, dtype=np.int64)
+    offsets = _get_offsets(cardinalities)
+    total_states = int(cardinalities.sum())
+    if chunk_size is None:
+        chunk_size = max(1, _MAX_CHUNK_CELLS // max(total_states, 1))
+    state_blocks = np.array_split(
+        np.arange(total_states), max(1, min(n_jobs, total_states))
+    )
+    block_pairs = [
+        (i, j) for i in range(len(state_blocks)) for j in range(i, len(state_blocks))
+    ]
+    joint_counts = np.zeros((total_states, total_states), dtype=np.float64)
+
+    def count_block(one_hot: np.ndarray, i: int, j: int) -> None:
+        rows, columns = state_blocks[i], state_blocks[j]
+        if len(rows) and len(columns):
+            joint_counts[rows[0] : rows[-1] + 1, columns[0] : columns[-1] + 1] += (
+                one_hot[:, rows[0] : rows[-1] + 1].T
+                @ one_hot[:, columns[0] : columns[-1] + 1]
+            )
+
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        for start in range(0, codes.shape[0], chunk_size):
+            one_hot = _one_hot(codes[start : start + chunk_size], offsets, total_states)
+            list(executor.map(lambda pair: count_block(one_hot, *pair), block_pairs))
+
+    upper = np.triu_indices(total_states, 1)
+    joint_counts.T[upper] = joint_counts[upper]
+    return joint_counts
+
+
+def _get_block_mutual_information(
+    joint_counts: np.ndarray,
+    row_cardinalities: np.ndarray,
+    column_cardinalities: np.ndarray,
+) -> np.ndarray:
+    """Computes the mutual information of every pair of a row variable and a column variable from a rectangular block
+    of the stacked joint counts."""
+    row_offsets = _get_offsets(row_cardinalities)
+    column_offsets = _get_offsets(column_cardinalities)
+    pair_totals = np.add.reduceat(
+        np.add.reduceat(joint_counts, row_offsets, axis=0), column_offsets, axis=1
+    )
+    row_totals = np.repeat(
+        np.add.reduceat(joint_counts, column_offsets, axis=1),
+        column_cardinalities,
+        axis=1,
+    )
+    column_totals = np.repeat(
+        np.add.reduceat(joint_counts, row_offsets, axis=0), row_cardinalities, axis=0
+    )
+    cell_totals = np.repeat(
+        np.repeat(pair_totals, row_cardinalities, axis=0), column_cardinalities, axis=1
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        contributions = np.where(
+            joint_counts > 0,
+            joint_counts
+            * np.log(joint_counts * cell_totals / (row_totals * column_totals))
+            / cell_totals,
+            0.0,
+        )
+    mutual_information = np.add.reduceat(
+        np.add.reduceat(contributions, row_offsets, axis=0), column_offsets, axis=1
+    )
+    return np.clip(mutual_information, 0, None)
+
+
+def get_mutual_information_from_joint_counts(
+    joint_counts: np.ndarray, cardinalities: np.ndarray
+) -> np.ndarray:
+    """Computes the mutual information of every pair of variables from their stacked joint counts, as output by
+    get_joint_counts(). Each pair only uses the rows where both variables are present, as `DataFrame.corr()` does.
+
+    Args:
+        joint_counts (np.ndarray): The stacked joint count matrix.
+        cardinalities (np.ndarray): The number of states of each variable.
+
+    Returns: A square array of the pairwise mutual information, in nats, with a diagonal of ones to match the adjacency
+        matrix produced by `DataFrame.corr(method=mutual_info_score)`.
+
+    """
+    cardinalities = np.asarray(cardinalities, dtype=np.int64)
+    if len(cardinalities) == 0:
+        return np.zeros((0, 0))
+    mutual_information = _get_block_mutual_information(
+        joint_counts, cardinalities, cardinalities
+    )
+    np.fill_diagonal(mutual_information, 1.0)
+    return mutual_information
+
+
+@profiled
+def get_mutual_information_matrix(
+    data: pd.DataFrame, chunk_size: Optional[int] = None, n_jobs: int = 1
+) -> pd.DataFrame:
+    """A batch replacement for `data.corr(method=mutual_info_score)`. Every column is encoded once as integer codes,
+    and all pairwise contingency tables are counted together with blocked matrix products instead of one sklearn call
+    per column pair.
+
+    Args:
+        data (pd.DataFrame): The discretised data, every column is treated as a categorical variable.
+        chunk_size (int, optional): The number of rows to count at once, see get_joint_counts().
+        n_jobs (int): The number of threads to count column blocks over.
+
+    Returns: The pairwise mutual information as an adjacency pd.DataFrame, indexed by column name on both axes.
+
+    """
+    codes, states = encode_data_frame(data)
+    cardinalities = np.array([len(states[column]) for column in data.columns])
+    joint_counts = get_joint_counts(codes, cardinalities, chunk_size, n_jobs)
+    return mutual_information_to_data_frame(
+        get_mutual_information_from_joint_counts(joint_counts, cardinalities),
+        list(data.columns),
+    )
+
+
+def mutual_information_to_data_frame(
+    mutual_information: np.ndarray, columns: List[str]
+) -> pd.DataFrame:
+    """Labels a square mutual information array with its variable names.
+
+    Args:
+        mutual_information (np.ndarray): The pairwise mutual information.
+        columns (List[str]): The variable names, in the order of the array axes.
+
+    Returns: The adjacency pd.DataFrame expected by `nx.from_pandas_adjacency`.
+
+    """
+    return pd.DataFrame(mutual_information, index=columns, columns=columns)
+
+
+@profiled
+def get_top_k_mutual_information(
+    data: pd.DataFrame,
+    k: int = 10,
+    block_size: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds the `k` variables with the highest mutual information with each variable, for data too wide for the full
+    mutual information matrix. The joint counts are built for one block of variables against all of them at a time, so
+    only a block of counts and of mutual information is ever held in memory.
+
+    Args:
+        data (pd.DataFrame): The discretised data, every column is treated as a categorical variable.
+        k (int): The number of neighbours to find for each variable.
+        block_size (int, optional): The number of variables in each block, defaults to a size that keeps the block of
+            counts at around 128MB.
+        chunk_size (int, optional): The number of rows to count at once, see get_joint_counts().
+
+    Returns: A tuple of the neighbours of each variable as column positions, best first, in an array of shape
+        `(len(data.columns), k)`, and the mutual information with each of them in an array of the same shape.
+
+    """
+    codes, states = encode_data_frame(data)
+    cardinalities = np.array([len(states[column]) for column in data.columns])
+    offsets = _get_offsets(cardinalities)
+    n_variables = len(cardinalities)
+    total_states = int(cardinalities.sum())
+    k = max(0, min(k, n_variables - 1))
+    if chunk_size is None:
+        chunk_size = max(1, _MAX_CHUNK_CELLS // max(total_states, 1))
+    if block_size is None:
+        block_size = max(
+            1, _MAX_CHUNK_CELLS // max(total_states * cardinalities.max(initial=1), 1)
+        )
+
+    neighbours = np.empty((n_variables, k), dtype=np.int64)
+    weights = np.empty((n_variables, k))
+    for start in range(0, n_variables, block_size):
+        stop = min(start + block_size, n_variables)
+        first_state = offsets[start]
+        last_state = offsets[stop - 1] + cardinalities[stop - 1]
+        block_counts = np.zeros((last_state - first_state, total_states))
+        for row in range(0, codes.shape[0], chunk_size):
+            one_hot = _one_hot(codes[row : row + chunk_size], offsets, total_states)
+            block_counts += one_hot[:, first_state:last_state].T @ one_hot
+        mutual_information = _get_block_mutual_information(
+            block_counts, cardinalities[start:stop], cardinalities
+        )
+        mutual_information[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+        if k == 0:
+            continue
+        top = np.argpartition(-mutual_information, k - 1, axis=1)[:, :k]
+        top_weights = np.take_along_axis(mutual_information, top, axis=1)
+        best_first = np.argsort(-top_weights, axis=1, kind="stable")
+        neighbours[start:stop] = np.take_along_axis(top, best_first, axis=1)
+        weights[start:stop] = np.take_along_axis(top_weights, best_first, axis=1)
+    return neighbours, weights
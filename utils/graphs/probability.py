@@ -1,12 +1,22 @@
 """
 A module for the generation of probabiltiy distributions
 """
-from itertools import product
-from typing import Dict, List
+from typing import Dict, List, Sequence, Tuple, Union
 
+import numpy as np
 import pandas as pd
 from pomegranate import State, DiscreteDistribution, ConditionalProbabilityTable
 
+from utils.graphs.counting import (
+    get_conditional_probabilities,
+    get_contingency_table,
+    get_dense_conditional_probabilities,
+    get_family_counts,
+)
+from utils.graphs.structuring import get_parents, get_topological_order
+from utils.preprocessing.encoding import encode_data_frame
+from utils.profiling import profiled
+
 
 def get_pd(series: pd.Series, unique_value_limit: int = 15) -> pd.DataFrame:
     """This will get a discrete distribution over the values of the `series`.
@@ -22,7 +32,6 @@ def get_pd(series: pd.Series, unique_value_limit: int = 15) -> pd.DataFrame:
         f"number of unique values in `series` must be less than `unique_value_limit ({unique_value_limit}) for get_pd()"
         " to work"
     )
-    series = series.copy()
     name = series.name
     return (
         (series.value_counts() / series.shape[0])
@@ -36,7 +45,9 @@ def get_pd(series: pd.Series, unique_value_limit: int = 15) -> pd.DataFrame:
 def get_conditional_pd(
     data: pd.DataFrame, target: str, independent_variables: List[str]
 ) -> pd.DataFrame:
-    """Gets conditional probability ovr the states of the target given the states of the independent variables.
+    """Gets conditional probability ovr the states of the target given the states of the independent variables. The
+    variables are encoded as integer codes and counted with a single `np.bincount`, every combination of states is
+    included, with combinations that never occur given a probability of zero.
 
     Args:
         data (pd.DataFrame): The data containing the `target` and `independent_variables`.
@@ -46,26 +57,155 @@ def get_conditional_pd(
     Returns: The conditional distribution of the `target` given the `independent_variables` as a pd.DataFrame.
 
     """
-    data = data.copy()
     all_variables = independent_variables + [target]
-    grouped_df = (
-        data.groupby(all_variables)
-        .count()
-        .iloc[:, 0]
-        .rename("count")
-        .reset_index(drop=False)
-        .set_index(independent_variables)
-        .join(data.groupby(independent_variables).count().iloc[:, 0].rename("total"))
+    codes, states = encode_data_frame(data[all_variables])
+    counts = get_contingency_table(codes, [len(states[v]) for v in all_variables])
+    return get_conditional_pd_from_counts(
+        counts, states, target, independent_variables
     )
-    grouped_df["conditional_probability"] = grouped_df["count"] / grouped_df["total"]
-    grouped_df = grouped_df.reset_index().set_index(all_variables)
-    filler_df = pd.DataFrame(
-        data=list(product(*(sorted(data[v].unique()) for v in all_variables))),
-        columns=all_variables,
-    ).set_index(all_variables)
-    filler_df["count"] = filler_df["total"] = filler_df["conditional_probability"] = 0
-    filler_df.update(grouped_df)
-    return filler_df.reset_index()
+
+
+def get_conditional_pd_from_counts(
+    counts: np.ndarray,
+    states: Dict[str, Sequence],
+    target: str,
+    independent_variables: List[str],
+) -> pd.DataFrame:
+    """Gets the same conditional distribution as get_conditional_pd() from a table of counts instead of the data.
+
+    Args:
+        counts (np.ndarray): The joint counts of the `independent_variables` and the `target`, with one axis per
+            variable in that order.
+        states (Dict[str, Sequence]): The states each axis of `counts` refers to, keyed by variable name.
+        target (str): The target variable.
+        independent_variables (List[str]): The independent variables.
+
+    Returns: The conditional distribution of the `target` given the `independent_variables` as a pd.DataFrame.
+
+    """
+    all_variables = independent_variables + [target]
+    totals = np.broadcast_to(counts.sum(axis=-1, keepdims=True), counts.shape)
+    grids = np.meshgrid(*(np.asarray(states[v]) for v in all_variables), indexing="ij")
+    conditional_pd = pd.DataFrame(
+        {v: grid.ravel() for v, grid in zip(all_variables, grids)}
+    )
+    conditional_pd["count"] = counts.ravel()
+    conditional_pd["total"] = np.where(counts > 0, totals, 0).ravel()
+    conditional_pd["conditional_probability"] = get_conditional_probabilities(
+        counts
+    ).ravel()
+    return conditional_pd
+
+
+def get_pomegranate_cpt_rows(
+    conditional_probabilities: np.ndarray,
+    states: Dict[str, Sequence],
+    all_variables: List[str],
+) -> List[list]:
+    """Lays out an array of conditional probabilities as the rows of a pomegranate `ConditionalProbabilityTable`, one
+    row per combination of states with the states as strings followed by the probability.
+
+    Args:
+        conditional_probabilities (np.ndarray): The conditional probabilities, with one axis per variable in
+            `all_variables`.
+        states (Dict[str, Sequence]): The states each axis refers to, keyed by variable name.
+        all_variables (List[str]): The parents followed by the child.
+
+    Returns: The rows of the table, in the same order as the rows of get_conditional_pd().
+
+    """
+    grids = np.meshgrid(
+        *(
+            np.array([str(state) for state in states[v]], dtype=object)
+            for v in all_variables
+        ),
+        indexing="ij",
+    )
+    columns = [grid.ravel() for grid in grids]
+    columns.append(conditional_probabilities.ravel().astype(object))
+    return np.column_stack(columns).tolist()
+
+
+def convert_counts_to_pomegranate_state(
+    counts: np.ndarray,
+    states: Dict[str, Sequence],
+    target: str,
+    independent_variables: List[str],
+    distribution_dict: dict,
+) -> ConditionalProbabilityTable:
+    """Takes the joint counts of a node and its parents and turns them in to the corresponding `pomegranate.State`,
+    without going through the pd.DataFrame output by get_conditional_pd().
+
+    Args:
+        counts (np.ndarray): The joint counts of the `independent_variables` and the `target`, with one axis per
+            variable in that order.
+        states (Dict[str, Sequence]): The states each axis of `counts` refers to, keyed by variable name.
+        target (str): The target of the probability distribution, this is the child node in the network.
+        independent_variables (List[str]): The independent variables in the probability distribution, these are the
+            parent nodes in the network.
+        distribution_dict (dict): This associates nodes to their distributions and needs to be updated for future
+            construction of the `BayesianNetwork`.
+
+    Returns: A pomegranate `State` holding the `ConditionalProbabilityTable` of the `target`, and the updated
+        `distribution_dict`.
+
+    """
+    return convert_cpt_to_pomegranate_state(
+        get_conditional_probabilities(counts),
+        states,
+        target,
+        independent_variables,
+        distribution_dict,
+    )
+
+
+def convert_cpt_to_pomegranate_state(
+    cpt: Union[np.ndarray, Dict[str, np.ndarray]],
+    states: Dict[str, Sequence],
+    target: str,
+    independent_variables: List[str],
+    distribution_dict: dict,
+) -> ConditionalProbabilityTable:
+    """Takes the conditional probabilities of a node given its parents and turns them in to the corresponding
+    `pomegranate.State`. pomegranate needs a row for every combination of parent states, so a sparse table is laid out
+    in full, with its "default" probabilities for the combinations it doesn't hold.
+
+    Args:
+        cpt (Union[np.ndarray, Dict[str, np.ndarray]]): The conditional probability array, with one axis per variable
+            in the order of the `independent_variables` and then the `target`, or a sparse table as output by
+            `utils.graphs.counting.get_sparse_conditional_probabilities`.
+        states (Dict[str, Sequence]): The states each axis of `cpt` refers to, keyed by variable name.
+        target (str): The target of the probability distribution, this is the child node in the network.
+        independent_variables (List[str]): The independent variables in the probability distribution, these are the
+            parent nodes in the network.
+        distribution_dict (dict): This associates nodes to their distributions and needs to be updated for future
+            construction of the `BayesianNetwork`.
+
+    Returns: A pomegranate `State` holding the `ConditionalProbabilityTable` of the `target`, and the updated
+        `distribution_dict`.
+
+    """
+    all_variables = independent_variables + [target]
+    if isinstance(cpt, dict):
+        cpt = get_dense_conditional_probabilities(
+            cpt, [len(states[v]) for v in all_variables]
+        )
+    if not independent_variables:
+        distribution = DiscreteDistribution(
+            {
+                str(state): float(probability)
+                for state, probability in zip(states[target], cpt)
+            }
+        )
+    else:
+        distribution = ConditionalProbabilityTable(
+            get_pomegranate_cpt_rows(cpt, states, all_variables),
+            [distribution_dict[key] for key in independent_variables],
+        )
+
+    distribution_dict[target] = distribution
+
+    return State(distribution, name=target), distribution_dict
 
 
 def convert_cpdt_to_pomegranate_state(
@@ -115,58 +255,128 @@ def convert_cpdt_to_pomegranate_state(
     return State(cpd, name=target), distribution_dict
 
 
+@profiled
 def get_pomegranate_states_from_directed_edges(
-    data: pd.DataFrame, directed_edge_list: List[List[str]]
+    data: pd.DataFrame, directed_edge_list: List[List[str]], n_jobs: int = 1
 ) -> Dict[str, State]:
     """This will take in `data`, the list of directed edges, and return a dictionary pointing each node, denoted by the
-    name of the node, which corresponds to the name of the column in the `data`.
+    name of the node, which corresponds to the name of the column in the `data`. The node columns are encoded as integer
+    codes once, and each node's distribution is estimated from the counts of its family.
+
+    Args:
+        data (pd.DataFrame): The dataframe containing the columns corresponding to our nodes in our graph.
+        directed_edge_list: The directed edges of our graph, a list of lists with 2 elements, pointing an edge from left
+            to right.
+        n_jobs (int): The number of processes to count the families over, see
+            `utils.graphs.counting.get_family_counts`.
+
+    Returns: A dictionary that links each node's name to its state.
+
+    """
+    family_counts, node_states = get_family_counts_from_directed_edges(
+        data, directed_edge_list, n_jobs
+    )
+    return get_pomegranate_states_from_counts(
+        family_counts, node_states, directed_edge_list
+    )
+
+
+def get_family_counts_from_directed_edges(
+    data: pd.DataFrame, directed_edge_list: List[List[str]], n_jobs: int = 1
+) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Counts the family of every node of the graph in `data`, the first half of
+    get_pomegranate_states_from_directed_edges(), so the counts can be kept and turned in to states later with
+    get_pomegranate_states_from_counts().
 
     Args:
         data (pd.DataFrame): The dataframe containing the columns corresponding to our nodes in our graph.
         directed_edge_list: The directed edges of our graph, a list of lists with 2 elements, pointing an edge from left
             to right.
+        n_jobs (int): The number of processes to count the families over.
+
+    Returns: A tuple of the joint counts of each node's parents and the node, and the states of each node.
+
+    """
+    parents = get_parents(directed_edge_list)
+    nodes = list(parents)
+    codes, node_states = encode_data_frame(data[nodes])
+    position = {node: i for i, node in enumerate(nodes)}
+    family_counts = get_family_counts(
+        codes,
+        [len(node_states[node]) for node in nodes],
+        {
+            node: [position[v] for v in independent_variables + [node]]
+            for node, independent_variables in parents.items()
+        },
+        n_jobs,
+    )
+    return family_counts, node_states
+
+
+@profiled
+def get_pomegranate_states_from_counts(
+    family_counts: Dict[str, np.ndarray],
+    node_states: Dict[str, Sequence],
+    directed_edge_list: List[List[str]],
+) -> Dict[str, State]:
+    """The count table equivalent of get_pomegranate_states_from_directed_edges(), this builds every node's state from
+    the counts of its family rather than from the data, so the data never has to be held in memory.
+
+    Args:
+        family_counts (Dict[str, np.ndarray]): The joint counts of each node's parents and the node, with one axis per
+            variable, parents first in the order given by
+            `utils.graphs.structuring.get_parents` and the node last.
+        node_states (Dict[str, Sequence]): The states each axis of the counts refers to, keyed by node name.
+        directed_edge_list: The directed edges of our graph, a list of lists with 2 elements, pointing an edge from left
+            to right.
 
     Returns: A dictionary that links each node's name to its state.
 
     """
+    parents = get_parents(directed_edge_list)
+    state_dict = dict()
+    distribution_dict = dict()
+    for node in get_topological_order(parents):
+        state_dict[node], distribution_dict = convert_counts_to_pomegranate_state(
+            family_counts[node],
+            node_states,
+            node,
+            parents[node],
+            distribution_dict,
+        )
+
+    return state_dict
+
+
+@profiled
+def get_pomegranate_states_from_cpts(
+    cpts: Dict[str, Union[np.ndarray, Dict[str, np.ndarray]]],
+    node_states: Dict[str, Sequence],
+    directed_edge_list: List[List[str]],
+) -> Dict[str, State]:
+    """Builds every node's state from conditional probabilities that have already been estimated, such as the dense
+    or sparse "cpts" of a fitted pipeline, see `utils.modelling.pipeline.fit_pipeline`.
 
-    directed_edge_df = pd.DataFrame(directed_edge_list, columns=["from", "to"])
-    from_set = set(directed_edge_df["from"])
-    to_set = set(directed_edge_df["to"])
-    broadcast_set = from_set.difference(to_set)
+    Args:
+        cpts (Dict[str, Union[np.ndarray, Dict[str, np.ndarray]]]): The conditional probabilities of each node given
+            its parents, see convert_cpt_to_pomegranate_state().
+        node_states (Dict[str, Sequence]): The states each axis of the probabilities refers to, keyed by node name.
+        directed_edge_list: The directed edges of our graph, a list of lists with 2 elements, pointing an edge from left
+            to right.
+
+    Returns: A dictionary that links each node's name to its state.
+
+    """
+    parents = get_parents(directed_edge_list)
     state_dict = dict()
     distribution_dict = dict()
-    for broadcast_node in broadcast_set:
-        probability_distribution = get_pd(data[broadcast_node])
-        pom_distribution = DiscreteDistribution(
-            {
-                category: probability
-                for category, probability in probability_distribution.values
-            }
+    for node in get_topological_order(parents):
+        state_dict[node], distribution_dict = convert_cpt_to_pomegranate_state(
+            cpts[node],
+            node_states,
+            node,
+            parents[node],
+            distribution_dict,
         )
-        state_dict[broadcast_node] = State(pom_distribution, name=broadcast_node)
-        distribution_dict[broadcast_node] = pom_distribution
-
-    from_nodes = broadcast_set.copy()
-
-    while len(state_dict.keys()) < len(from_set.union(to_set)):
-        nodes = directed_edge_df[directed_edge_df["from"].isin(from_nodes)][
-            "to"
-        ].unique()
-        from_nodes = set()
-        for node in nodes:
-            nodes_edges = directed_edge_df[directed_edge_df["to"] == node]
-            if all([x in state_dict.keys() for x in nodes_edges["from"]]):
-                from_nodes.add(node)
-                independent_variables = list(nodes_edges["from"].values)
-                conditional_probability_distribution = get_conditional_pd(
-                    data, node, independent_variables
-                )
-                state_dict[node], distribution_dict = convert_cpdt_to_pomegranate_state(
-                    conditional_probability_distribution,
-                    node,
-                    independent_variables,
-                    distribution_dict,
-                )
 
     return state_dict
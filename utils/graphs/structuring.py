@@ -1,10 +1,103 @@
-from typing import List
+from collections import deque
+from typing import TYPE_CHECKING, Dict, List, Tuple
 
-import networkx as nx
-import pandas as pd
+import numpy as np
 
+from utils.profiling import profiled
 
-def get_directed_edges(graph: nx.Graph, target: str) -> List[List[str]]:
+if TYPE_CHECKING:
+    import networkx as nx
+
+
+@profiled
+def get_maximum_spanning_tree(weights: np.ndarray, nodes: List[str]) -> "nx.Graph":
+    """Builds the maximum spanning tree of a dense weight matrix, such as the mutual information matrix, with Prim's
+    algorithm vectorised over the nodes, so it takes O(p²) array operations instead of building a networkx graph of all
+    p² edges. Like `tree.maximum_spanning_tree(nx.from_pandas_adjacency(...))`, edges of weight zero don't exist, so
+    where the positive weights don't connect every node the result is a forest.
+
+    Args:
+        weights (np.ndarray): The symmetric weights between every pair of nodes, the diagonal is ignored.
+        nodes (List[str]): The names of the nodes, in the order of the axes of `weights`.
+
+    Returns: The maximum spanning tree as an nx.Graph, with the weight of each edge as its "weight".
+
+    """
+    import networkx as nx
+
+    graph = nx.Graph()
+    graph.add_nodes_from(nodes)
+    if len(nodes) == 0:
+        return graph
+    weights = np.nan_to_num(np.asarray(weights, dtype=np.float64))
+    in_tree = np.zeros(len(nodes), dtype=bool)
+    in_tree[0] = True
+    best_weight = weights[0].copy()
+    best_from = np.zeros(len(nodes), dtype=np.int64)
+    for _ in range(len(nodes) - 1):
+        node = int(np.argmax(np.where(in_tree, -np.inf, best_weight)))
+        # With no positive edge left from the tree the component is finished, and `node` starts a new one
+        if best_weight[node] > 0:
+            graph.add_edge(
+                nodes[best_from[node]], nodes[node], weight=best_weight[node]
+            )
+        in_tree[node] = True
+        better = weights[node] > best_weight
+        best_weight = np.where(better, weights[node], best_weight)
+        best_from = np.where(better, node, best_from)
+    return graph
+
+
+@profiled
+def get_approximate_maximum_spanning_tree(
+    neighbours: np.ndarray, weights: np.ndarray, nodes: List[str]
+) -> "nx.Graph":
+    """Builds the maximum spanning tree, or forest, of only the candidate edges from each node to its best neighbours,
+    as output by `utils.graphs.mutual_information.get_top_k_mutual_information`, with Kruskal's algorithm. The full
+    weight matrix is never needed, and the tree is exact whenever every edge of the true maximum spanning tree is a
+    candidate from at least one of its ends.
+
+    Args:
+        neighbours (np.ndarray): The positions of the candidate neighbours of each node, one row per node.
+        weights (np.ndarray): The weight of the edge to each candidate neighbour, the same shape as `neighbours`.
+        nodes (List[str]): The names of the nodes, in the order of the rows of `neighbours`.
+
+    Returns: The maximum spanning tree as an nx.Graph, with the weight of each edge as its "weight".
+
+    """
+    import networkx as nx
+
+    graph = nx.Graph()
+    graph.add_nodes_from(nodes)
+    from_nodes = np.repeat(np.arange(neighbours.shape[0]), neighbours.shape[1])
+    to_nodes = neighbours.ravel()
+    edge_weights = weights.ravel()
+    candidates = np.flatnonzero(edge_weights > 0)
+    candidates = candidates[np.argsort(-edge_weights[candidates], kind="stable")]
+
+    component = list(range(len(nodes)))
+
+    def find(node: int) -> int:
+        while component[node] != node:
+            component[node] = component[component[node]]
+            node = component[node]
+        return node
+
+    for edge in candidates:
+        from_root, to_root = find(from_nodes[edge]), find(to_nodes[edge])
+        if from_root != to_root:
+            component[from_root] = to_root
+            graph.add_edge(
+                nodes[from_nodes[edge]],
+                nodes[to_nodes[edge]],
+                weight=edge_weights[edge],
+            )
+            if graph.number_of_edges() == len(nodes) - 1:
+                break
+    return graph
+
+
+def get_directed_edges(graph: "nx.Graph", target: str) -> List[List[str]]:
     """This will order the pairs of nodes in the ego graph from left to right based on direction towards the target.
 
     Args:
@@ -12,32 +105,98 @@ def get_directed_edges(graph: nx.Graph, target: str) -> List[List[str]]:
         target (str): Node in the network which we point edges to
 
     Returns: a list of nodes, in pairs, showing their direction from left to right
+    """
+    return orient_graph(graph, target)[0]
+
+
+@profiled
+def orient_graph(
+    graph: "nx.Graph", target: str
+) -> Tuple[List[List[str]], List[str], Dict[str, List[str]]]:
+    """Points every edge of a tree towards the target with one breadth first search over the adjacency lists of the
+    graph, so it takes time linear in the number of nodes and edges. In a forest, the edges of the components without
+    the target point towards the first of their nodes in the order of `graph.nodes`. Graphs with cycles keep only the
+    edges of the search tree.
+
+    Args:
+        graph (nx.Graph): Any NetworkX graph, normally a maximum spanning tree or forest.
+        target (str): Node in the network which we point edges to.
+
+    Returns: A tuple of the directed edge list, a list of lists with 2 elements pointing an edge from left to right in
+        breadth first order from the target, the nodes in topological order, and the parents of every node. Nodes
+        without any edges are in the order and the parents but not in the edge list.
+
     """
     assert (
         target in graph.nodes
     ), "`target` must be in `graph` for get_directed_edges() to work!"
-    edge_list = list(graph.edges())
-    directed_edge_df = pd.DataFrame(edge_list, columns=["from", "to"])
-    directed_edge_df = directed_edge_df.append(
-        directed_edge_df.rename(columns={"from": "to", "to": "from"})
-    )
-
-    directed_edge_list = directed_edge_df[
-        directed_edge_df["to"] == target
-    ].values.tolist()
-    new_node_set = {x[0] for x in directed_edge_list}
-    discovered_nodes = {target}
-    directed_edge_df = directed_edge_df[~(directed_edge_df == target).any(axis=1)]
-    while len(directed_edge_list) < len(graph.edges):
-        new_edge_list = directed_edge_df[
-            directed_edge_df["to"].isin(new_node_set)
-            & (~directed_edge_df["to"].isin(discovered_nodes))
-        ].values.tolist()
-        directed_edge_list += new_edge_list
-        discovered_nodes = discovered_nodes.union(new_node_set)
-        directed_edge_df = directed_edge_df[
-            ~directed_edge_df.isin(new_node_set).any(axis=1)
-        ]
-        new_node_set = {x[0] for x in new_edge_list}
-
-    return directed_edge_list
+    adjacency = graph.adj
+    directed_edge_list = []
+    search_order = []
+    discovered_nodes = set()
+    for root in [target] + list(graph.nodes):
+        if root in discovered_nodes:
+            continue
+        discovered_nodes.add(root)
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            search_order.append(node)
+            for neighbour in adjacency[node]:
+                if neighbour not in discovered_nodes:
+                    discovered_nodes.add(neighbour)
+                    directed_edge_list.append([neighbour, node])
+                    queue.append(neighbour)
+
+    # Every edge points back along the search, so the search order reversed puts parents before their children
+    order = search_order[::-1]
+    parents = {node: [] for node in order}
+    for from_node, to_node in directed_edge_list:
+        parents[to_node].append(from_node)
+    return directed_edge_list, order, parents
+
+
+def get_parents(directed_edge_list: List[List[str]]) -> Dict[str, List[str]]:
+    """Gets the parents of every node in the graph, in the order their edges appear in `directed_edge_list`.
+
+    Args:
+        directed_edge_list: The directed edges of our graph, a list of lists with 2 elements, pointing an edge from left
+            to right.
+
+    Returns: A dictionary that links each node's name to the names of its parents.
+
+    """
+    parents = dict()
+    for from_node, to_node in directed_edge_list:
+        parents.setdefault(from_node, [])
+        parents.setdefault(to_node, []).append(from_node)
+    return parents
+
+
+def get_topological_order(parents: Dict[str, List[str]]) -> List[str]:
+    """Orders the nodes of a graph so every node comes after its parents, so each node's distribution can be built once
+    those of its parents are.
+
+    Args:
+        parents (Dict[str, List[str]]): The parents of each node, as output by get_parents().
+
+    Returns: The nodes in topological order, ties broken by the order of `parents`.
+
+    """
+    children = {node: [] for node in parents}
+    for node, node_parents in parents.items():
+        for parent in node_parents:
+            children.setdefault(parent, []).append(node)
+    remaining = {node: len(parents.get(node, [])) for node in children}
+    ready = deque(node for node, count in remaining.items() if count == 0)
+    order = []
+    while ready:
+        node = ready.popleft()
+        order.append(node)
+        for child in children[node]:
+            remaining[child] -= 1
+            if remaining[child] == 0:
+                ready.append(child)
+    if len(order) < len(children):
+        raise ValueError("the graph contains a cycle, so has no topological order")
+    return order
@@ -1,13 +1,42 @@
 """
-This module is for functions that import data
+This module is for functions that import data. Data can be read with a declared schema, a dictionary linking each column
+to load to its dtype, "category" for categorical columns and a compact numeric dtype for numeric ones, so only the
+columns the model uses are read and they come out in their final types. Parquet and Arrow files are read with pyarrow,
+memory-mapped where the format allows, and a .csv file can be cached as an Arrow file keyed by the hash of its contents,
+so repeat runs skip parsing the text. pyarrow is only imported when a columnar file is read or written.
 """
+import hashlib
+import json
 import os
+from typing import Dict, Iterator, Optional
 
 import pandas as pd
 
+from utils.profiling import profiled
+
 path_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 
+# The columns of the heart disease data and their types, matching
+# `utils.preprocessing.bespoke_preprocessing.convert_columns_to_correct_types`. Only the whole number columns are
+# float32, since fractional values like Oldpeak change in float32 and would move across bin edges fit on float64 data.
+HEART_DISEASE_SCHEMA = {
+    "Age": "float32",
+    "Sex": "category",
+    "ChestPain": "category",
+    "RestBP": "float32",
+    "Chol": "float32",
+    "MaxHR": "float32",
+    "ExAng": "category",
+    "Oldpeak": "float64",
+    "Thal": "category",
+    "AHD": "category",
+}
+
+_PARQUET_SUFFIXES = (".parquet", ".pq")
+_ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+
 
+@profiled
 def import_csv_data(file_location: str = "data/data.csv") -> pd.DataFrame:
     """Reads out a pd.DataFrame from a .csv file.
 
@@ -18,3 +47,142 @@ def import_csv_data(file_location: str = "data/data.csv") -> pd.DataFrame:
         pd.DataFrame: Data ready for further processing.
     """
     return pd.read_csv(file_location)
+
+
+def import_csv_data_in_chunks(
+    file_location: str = "data/data.csv", chunksize: int = 100_000
+) -> Iterator[pd.DataFrame]:
+    """Reads a .csv file as a stream of pd.DataFrames of at most `chunksize` rows, so files larger than memory can be
+    processed a chunk at a time.
+
+    Args:
+        file_location (str, optional): The .csv file location. Defaults to "data/data.csv".
+        chunksize (int, optional): The number of rows in each chunk. Defaults to 100,000.
+
+    Returns:
+        Iterator[pd.DataFrame]: The chunks of the data, in file order.
+    """
+    with pd.read_csv(file_location, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def apply_schema(data: pd.DataFrame, schema: Dict[str, str]) -> pd.DataFrame:
+    """Keeps only the columns of the `schema`, in its order, and gives each its declared dtype. Categorical columns get
+    their values as strings, as they do when a .csv file is read with a "category" dtype, so the same data read from
+    any format has the same categories.
+
+    Args:
+        data (pd.DataFrame): The data.
+        schema (Dict[str, str]): The dtype of each column to keep.
+
+    Returns: The projected and typed data.
+
+    """
+    missing = [column for column in schema if column not in data.columns]
+    if missing:
+        raise ValueError(f"The data has no columns {missing} declared in the schema")
+    data = data[list(schema)].copy()
+    for column, dtype in schema.items():
+        if dtype != "category":
+            data[column] = data[column].astype(dtype)
+            continue
+        values = data[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) and all(
+            isinstance(category, str) for category in values.cat.categories
+        ):
+            continue
+        categorical = values.astype("category")
+        data[column] = categorical.cat.rename_categories(
+            [str(category) for category in categorical.cat.categories]
+        )
+    return data
+
+
+def get_file_hash(file_location: str, block_size: int = 1 << 20) -> str:
+    """Returns: The SHA-256 hash of the contents of a file, read `block_size` bytes at a time."""
+    file_hash = hashlib.sha256()
+    with open(file_location, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def _import_pyarrow():
+    """Imports pyarrow's Arrow and Parquet readers, which are only needed for columnar files."""
+    try:
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError(
+            "Reading and caching columnar files needs pyarrow, install it with `pip install pyarrow`"
+        ) from error
+    return pyarrow
+
+
+def _read_columnar(file_location: str, columns: Optional[list] = None) -> pd.DataFrame:
+    """Reads only `columns` of a Parquet or Arrow file, memory-mapping the file."""
+    pyarrow = _import_pyarrow()
+    if file_location.lower().endswith(_PARQUET_SUFFIXES):
+        table = pyarrow.parquet.read_table(
+            file_location, columns=columns, memory_map=True
+        )
+    else:
+        table = pyarrow.feather.read_table(
+            file_location, columns=columns, memory_map=True
+        )
+    return table.to_pandas()
+
+
+def _read_csv(file_location: str, schema: Optional[Dict[str, str]]) -> pd.DataFrame:
+    """Reads a .csv file, parsing only the columns of the `schema` straight in to their dtypes."""
+    if schema is None:
+        return pd.read_csv(file_location)
+    return pd.read_csv(file_location, usecols=list(schema), dtype=schema)
+
+
+@profiled
+def import_data(
+    file_location: str = "data/data.csv",
+    schema: Optional[Dict[str, str]] = None,
+    cache_dir: Optional[str] = None,
+) -> pd.DataFrame:
+    """Reads out a pd.DataFrame from a .csv, Parquet (.parquet, .pq) or Arrow (.arrow, .feather, .ipc) file, keeping
+    only the columns of the `schema` in their declared dtypes. A .csv file is cached in `cache_dir` as an Arrow file
+    of the typed columns, named by the hash of the file and the schema, and later calls with the same file and schema
+    memory-map the cache instead of parsing the text again. An edited file has a new hash so is parsed again.
+
+    Args:
+        file_location (str, optional): The file location. Defaults to "data/data.csv".
+        schema (Dict[str, str], optional): The dtype of each column to load, such as `HEART_DISEASE_SCHEMA`. Defaults
+            to every column with the dtypes pandas infers.
+        cache_dir (str, optional): The directory to cache .csv files in, none are cached by default.
+
+    Returns:
+        pd.DataFrame: Data ready for further processing.
+    """
+    if file_location.lower().endswith(_PARQUET_SUFFIXES + _ARROW_SUFFIXES):
+        data = _read_columnar(file_location, None if schema is None else list(schema))
+        return data if schema is None else apply_schema(data, schema)
+    if cache_dir is None:
+        data = _read_csv(file_location, schema)
+        return data if schema is None else apply_schema(data, schema)
+
+    key = hashlib.sha256(
+        (get_file_hash(file_location) + json.dumps(schema)).encode("utf-8")
+    ).hexdigest()
+    name = os.path.splitext(os.path.basename(file_location))[0]
+    cache_location = os.path.join(cache_dir, f"{name}-{key[:16]}.arrow")
+    if os.path.exists(cache_location):
+        return _read_columnar(cache_location)
+    data = _read_csv(file_location, schema)
+    if schema is not None:
+        data = apply_schema(data, schema)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write to a temporary file first so a run stopped part way never leaves a broken cache
+    temporary_location = f"{cache_location}.{os.getpid()}.tmp"
+    _import_pyarrow().feather.write_feather(
+        data, temporary_location, compression="uncompressed"
+    )
+    os.replace(temporary_location, cache_location)
+    return data
@@ -0,0 +1,82 @@
+"""
+This module is for generating synthetic data shaped like the heart disease data, for benchmarking at sizes the real data
+doesn't reach. The columns depend on each other along a random tree, so structure learning has something to find.
+"""
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def get_synthetic_heart_disease_data(
+    n_rows: int = 1000,
+    n_numeric: int = 5,
+    n_categorical: int = 2,
+    strength: float = 0.8,
+    missing_fraction: float = 0.01,
+    seed: int = 0,
+) -> Tuple[pd.DataFrame, List[List[str]]]:
+    """Generates data with the columns the runner expects, "Sex", "ExAng" and the target "AHD", plus `n_numeric`
+    continuous columns named "Numeric0", "Numeric1", ... and `n_categorical` string columns named "Categorical0",
+    "Categorical1", ..., with "AHD" last like the real data.
+
+    Every column has a hidden discrete level: 2 for the fixed columns, 5 for the numeric columns and between 3 and 6 for
+    the categorical columns. The columns are joined in a random tree rooted at "AHD", and each column's level copies a
+    random function of its parent's level with probability `strength` and is uniformly random otherwise. Numeric
+    columns are 35 plus ten times their level plus Gaussian noise, so `x // 10 - 3` almost always recovers the level.
+    Categorical columns are their level as a string.
+
+    Args:
+        n_rows (int): The number of rows to generate.
+        n_numeric (int): The number of numeric columns to add.
+        n_categorical (int): The number of categorical columns to add.
+        strength (float): How strongly each column depends on its parent in the tree, between 0 and 1.
+        missing_fraction (float): The fraction of the categorical columns' values to leave missing.
+        seed (int): The seed of the random number generator, so the same arguments always give the same data.
+
+    Returns: A tuple of the data and the planted tree, as a list of [parent, child] edges.
+
+    """
+    rng = np.random.default_rng(seed)
+    columns = ["Sex", "ExAng"]
+    columns += [f"Numeric{i}" for i in range(n_numeric)]
+    columns += [f"Categorical{i}" for i in range(n_categorical)]
+    columns += ["AHD"]
+    nodes = ["AHD"] + [columns[i] for i in rng.permutation(len(columns) - 1)]
+    levels = {node: 2 for node in ["AHD", "Sex", "ExAng"]}
+    levels.update({f"Numeric{i}": 5 for i in range(n_numeric)})
+    levels.update(
+        {f"Categorical{i}": int(rng.integers(3, 7)) for i in range(n_categorical)}
+    )
+
+    edges = []
+    latent = {"AHD": rng.integers(0, 2, size=n_rows)}
+    for i, node in enumerate(nodes[1:], start=1):
+        parent = nodes[int(rng.integers(0, i))]
+        edges.append([parent, node])
+        # A random function from the parent's levels to the node's that is one-to-one or onto, so no edge is lost
+        mapping = rng.permutation(
+            np.arange(max(levels[parent], levels[node])) % levels[node]
+        )[: levels[parent]]
+        latent[node] = np.where(
+            rng.random(n_rows) < strength,
+            mapping[latent[parent]],
+            rng.integers(0, levels[node], size=n_rows),
+        )
+
+    data = dict()
+    for node in columns:
+        if node == "AHD":
+            data[node] = np.array(["No", "Yes"], dtype=object)[latent[node]]
+        elif node in ("Sex", "ExAng"):
+            data[node] = latent[node]
+        elif node.startswith("Numeric"):
+            data[node] = 35 + 10 * latent[node] + rng.normal(0, 2, size=n_rows)
+        else:
+            values = np.array(
+                [f"level{level}" for level in range(levels[node])] + [None],
+                dtype=object,
+            )
+            missing = rng.random(n_rows) < missing_fraction
+            data[node] = values[np.where(missing, levels[node], latent[node])]
+    return pd.DataFrame(data), edges
@@ -3,7 +3,10 @@ from typing import Dict, List
 
 from pomegranate import BayesianNetwork, State
 
+from utils.profiling import profiled
 
+
+@profiled
 def get_bayesian_network(
     state_dict: Dict[str, State], directed_edge_list: List[List[str]]
 ) -> BayesianNetwork:
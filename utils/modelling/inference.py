@@ -0,0 +1,1051 @@
+"""
+Exact inference over the Bayes net. The graphs learned by the runner are trees with every edge pointing towards the
+target, so every node has at most one child and the posterior of every node can be found exactly with one pass of
+messages towards the target and one pass back out, instead of pomegranate's loopy belief propagation. Passing the
+largest term instead of the sum, in log space, and tracing the best states back out gives the most probable explanation,
+the single likeliest assignment of every node, in the same way. Passing the messages back out once for each state of the
+target gives the posterior of the target with any one node set to any one of its states, so a what-if sweep over every
+node and state is a single pass too, and keeping the scale each message is normalised by gives the log-likelihood of
+the evidence.
+"""
+
+import heapq
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from utils.graphs.counting import get_conditional_probabilities
+from utils.graphs.structuring import get_parents, get_topological_order
+from utils.modelling.query_cache import QueryCache
+from utils.profiling import profiled
+
+# The most elements of the intermediate arrays a batch of queries may need at once, a batch is split in to smaller ones
+# so the number of queries times the size of the largest probability table stays below it
+_MAX_BATCH_ELEMENTS = 2**24
+
+
+def _normalise(messages: np.ndarray) -> np.ndarray:
+    """Scales messages to sum to one over their last axis so long chains don't underflow, all-zero messages (evidence
+    with zero probability) are left as zeros."""
+    totals = messages.sum(axis=-1, keepdims=True)
+    return np.divide(
+        messages,
+        totals,
+        out=np.zeros(messages.shape),
+        where=np.broadcast_to(totals > 0, messages.shape),
+    )
+
+
+def _contract(
+    table: Union[np.ndarray, dict], messages: List[Optional[np.ndarray]]
+) -> np.ndarray:
+    """Sums out every axis of `table` but one, weighting each by its message. Messages shared by every query (with a
+    single row) are contracted first, so the per-query work is done on the smallest table possible.
+
+    Args:
+        table (Union[np.ndarray, dict]): The conditional probability array, or a sparse table as compiled by
+            `ExactInferenceEngine`.
+        messages (List[Optional[np.ndarray]]): A message per axis of `table`, each with a row per query or a single
+            row, and None for the axis to keep.
+
+    Returns: The contracted messages over the kept axis, with a row per query.
+
+    """
+    if isinstance(table, dict):
+        return _contract_sparse(table, messages)
+    keep = [message is None for message in messages].index(True)
+    axes = [i for i, message in enumerate(messages) if i != keep]
+    axes.sort(key=lambda i: messages[i].shape[0] > 1)
+    result = table.transpose(axes + [keep])
+    batched = False
+    for i in axes:
+        message, states = messages[i], table.shape[i]
+        if batched:
+            result = np.matmul(
+                message[:, None, :], result.reshape(message.shape[0], states, -1)
+            )[:, 0]
+        elif message.shape[0] > 1:
+            result = message @ result.reshape(states, -1)
+            batched = True
+        else:
+            result = message[0] @ result.reshape(states, -1)
+    return result.reshape(-1, table.shape[keep])
+
+
+def _contract_sparse(table: dict, messages: List[Optional[np.ndarray]]) -> np.ndarray:
+    """Does the same as _contract() for a sparse table, in time proportional to the number of observed combinations of
+    parent states. The weight of every combination that wasn't observed is the total weight of all combinations less
+    that of the observed ones, and they all share the "default" row.
+    """
+    keep = [message is None for message in messages].index(True)
+    parent_codes, probabilities = table["parent_codes"], table["probabilities"]
+    n_parents = parent_codes.shape[1]
+    # The weight of each observed combination and of all combinations, from the messages of the summed out parents
+    weights = np.ones((1, len(parent_codes)))
+    totals = np.ones((1, 1))
+    for i, message in enumerate(messages[:n_parents]):
+        if i != keep:
+            weights = weights * message[:, parent_codes[:, i]]
+            totals = totals * message.sum(axis=1, keepdims=True)
+    if keep == n_parents:
+        unobserved = totals - weights.sum(axis=1, keepdims=True)
+        return weights @ probabilities + unobserved * table["default"]
+    below = messages[-1]
+    indicators = np.eye(table["shape"][keep])[parent_codes[:, keep]]
+    observed = (weights * (below @ probabilities.T)) @ indicators
+    unobserved = totals - weights @ indicators
+    return observed + unobserved * (below @ table["default"])[:, None]
+
+
+def get_log_probabilities(array: np.ndarray) -> np.ndarray:
+    """Takes the log of probabilities without warning about zeros.
+
+    Args:
+        array (np.ndarray): The probabilities, or any non-negative weights.
+
+    Returns: The log of `array`, with zeros as -inf.
+
+    """
+    with np.errstate(divide="ignore"):
+        return np.log(array)
+
+
+def _get_best_unobserved_combination(
+    log_messages: List[np.ndarray], observed: Set[tuple]
+) -> Tuple[float, Optional[tuple]]:
+    """Finds the combination of parent states that isn't in `observed` with the largest sum of log messages. The
+    combinations are visited best first, starting from the best state of every parent and moving one parent at a time
+    to its next best state, so only as many combinations are visited as there are observed ones ahead of the answer.
+
+    Args:
+        log_messages (List[np.ndarray]): The log message of each parent, for a single query.
+        observed (Set[tuple]): The observed combinations of parent states.
+
+    Returns: The sum of the log messages of the best combination and the combination, or -inf and None if every
+        combination is observed.
+
+    """
+    orders = [np.argsort(-message, kind="stable") for message in log_messages]
+    values = [message[order] for message, order in zip(log_messages, orders)]
+    start = (0,) * len(values)
+    heap = [(-sum(value[0] for value in values), start)]
+    visited = {start}
+    while heap:
+        negative_score, ranks = heapq.heappop(heap)
+        combination = tuple(int(order[rank]) for order, rank in zip(orders, ranks))
+        if combination not in observed:
+            return -negative_score, combination
+        for i, rank in enumerate(ranks):
+            if rank + 1 < len(values[i]):
+                successor = ranks[:i] + (rank + 1,) + ranks[i + 1 :]
+                if successor not in visited:
+                    visited.add(successor)
+                    score = sum(value[r] for value, r in zip(values, successor))
+                    heapq.heappush(heap, (-score, successor))
+    return -np.inf, None
+
+
+def _max_contract(
+    log_table: Union[np.ndarray, dict], log_messages: List[np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Maximises the log of a conditional probability table plus the log messages of the parents over the combinations
+    of parent states, for each state of the child, the max-product counterpart of _contract().
+
+    Args:
+        log_table (Union[np.ndarray, dict]): The log conditional probability array, or a sparse table with its
+            "log_probabilities", "log_default" and "observed" combinations, see `ExactInferenceEngine`.
+        log_messages (List[np.ndarray]): The log message of each parent, each with a row per query or a single row.
+
+    Returns: A tuple of the best log score of each state of the child, with a row per query, and the combination of
+        parent states it comes from, with a row per query, a column per state of the child and then the parents.
+
+    """
+    rows = max([message.shape[0] for message in log_messages], default=1)
+    if isinstance(log_table, dict):
+        parent_codes = log_table["parent_codes"]
+        scores = np.zeros((1, len(parent_codes)))
+        for i, message in enumerate(log_messages):
+            scores = scores + message[:, parent_codes[:, i]]
+        scores = scores[:, :, None] + log_table["log_probabilities"][None]
+        best = scores.argmax(axis=1)
+        best_scores = np.take_along_axis(scores, best[:, None, :], axis=1)[:, 0]
+        best_scores = np.broadcast_to(best_scores, (rows, best.shape[1])).copy()
+        combinations = np.broadcast_to(
+            parent_codes[best], (rows,) + best.shape[1:] + parent_codes.shape[1:]
+        ).copy()
+        # Every combination that wasn't observed shares the default probabilities, so only the best of them can win
+        for q in range(rows):
+            unobserved_score, combination = _get_best_unobserved_combination(
+                [message[min(q, len(message) - 1)] for message in log_messages],
+                log_table["observed"],
+            )
+            if combination is None:
+                continue
+            candidate = unobserved_score + log_table["log_default"]
+            better = candidate > best_scores[q]
+            best_scores[q, better] = candidate[better]
+            combinations[q, better] = combination
+        return best_scores, combinations
+
+    return _max_contract_dense(log_table, log_messages, rows)
+
+
+def _max_contract_dense(
+    log_table: np.ndarray, log_messages: List[np.ndarray], rows: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Does _max_contract() for a dense table one parent at a time, like _contract(). Parents whose message is shared by
+    every query are maximised out first, parents held at a single state in every query, as observed nodes are, are then
+    looked up together, and the best state of each parent is recorded at each step to trace the combinations back.
+    """
+    n_parents = log_table.ndim - 1
+    n_states = log_table.shape[-1]
+    current = log_table[None]
+    # The parents whose axes are still in `current`, in order, and the best states recorded at each step
+    axes = list(range(n_parents))
+    records = []
+
+    def maximise(i: int) -> np.ndarray:
+        position = axes.index(i) + 1
+        message = log_messages[i]
+        shape = [message.shape[0]] + [1] * (current.ndim - 1)
+        shape[position] = -1
+        scores = current + message.reshape(shape)
+        best = scores.argmax(axis=position)
+        axes.remove(i)
+        records.append(([i], list(axes), best[..., None]))
+        return np.take_along_axis(
+            scores, np.expand_dims(best, position), axis=position
+        ).squeeze(position)
+
+    batched = [i for i in range(n_parents) if log_messages[i].shape[0] > 1]
+    for i in range(n_parents):
+        if i not in batched:
+            current = maximise(i)
+    held = [i for i in batched if (np.isfinite(log_messages[i]).sum(axis=1) == 1).all()]
+    if held:
+        states = [np.isfinite(log_messages[i]).argmax(axis=1) for i in held]
+        current = np.moveaxis(
+            np.broadcast_to(current, (rows,) + current.shape[1:]),
+            [axes.index(i) + 1 for i in held],
+            list(range(1, len(held) + 1)),
+        )[(np.arange(rows),) + tuple(states)]
+        held_scores = sum(
+            log_messages[i][np.arange(rows), state] for i, state in zip(held, states)
+        )
+        current = current + held_scores.reshape((rows,) + (1,) * (current.ndim - 1))
+        for i in held:
+            axes.remove(i)
+        records.append(
+            (
+                held,
+                list(axes),
+                np.stack(states, axis=-1).reshape(
+                    (rows,) + (1,) * (len(axes) + 1) + (-1,)
+                ),
+            )
+        )
+    for i in batched:
+        if i not in held:
+            current = maximise(i)
+
+    # Trace the best combination back for every query and state of the child, latest step first
+    combinations = np.zeros((rows, n_states, n_parents), dtype=np.intp)
+    query_index, state_index = np.arange(rows)[:, None], np.arange(n_states)[None]
+    for parents, later_axes, record in reversed(records):
+        index = [query_index if record.shape[0] > 1 else 0]
+        for axis, size in zip(later_axes, record.shape[1:-2]):
+            index.append(combinations[:, :, axis] if size > 1 else 0)
+        index.append(state_index if record.shape[-2] > 1 else 0)
+        combinations[:, :, parents] = record[tuple(index)]
+    return np.broadcast_to(current, (rows, n_states)), combinations
+
+
+def _unique_rows(codes: np.ndarray, cardinalities: List[int]):
+    """Finds the distinct rows of `codes`, packing each row in to a single integer first when the number of possible
+    rows fits in an int64, since sorting one integer per row is much faster than sorting rows.
+    """
+    radices = np.asarray(cardinalities, dtype=np.float64) + 1
+    if np.prod(radices) >= 2**62:
+        return np.unique(codes, axis=0, return_inverse=True)
+    multipliers = np.concatenate([np.cumprod(radices[::-1])[-2::-1], [1]])
+    keys = (codes.astype(np.int64) + 1) @ multipliers.astype(np.int64)
+    unique_keys, first, inverse = np.unique(
+        keys, return_index=True, return_inverse=True
+    )
+    return codes[first], inverse
+
+
+class ExactInferenceEngine:
+    """Answers evidence queries over a Bayes net whose nodes each have at most one child, by passing messages along the
+    edges and contracting them in to the conditional probability arrays.
+
+    The network is compiled once: the topological order and the messages without any evidence are worked out up front.
+    The plan for each pattern of observed nodes, which is the set of nodes whose upward messages the evidence changes, is
+    built on first use and reused, and the results of queries are kept in a bounded `QueryCache`, keyed on the evidence
+    in topological order.
+
+    Args:
+        states (Dict[str, Sequence]): The states of each node, in the order of the axes of the arrays.
+        parents (Dict[str, List[str]]): The parents of each node.
+        cpts (Dict[str, Union[np.ndarray, dict]]): The conditional probability array of each node, with one axis per
+            parent, in the order of `parents`, followed by the node's own axis, or a sparse table as output by
+            `utils.graphs.counting.get_sparse_conditional_probabilities`.
+        cache (QueryCache, optional): The cache of query results. A cache shared with an engine compiled before this one
+            is cleared the first time this engine uses it. Defaults to a new least recently used cache of 1024 results.
+    """
+
+    def __init__(
+        self,
+        states: Dict[str, Sequence],
+        parents: Dict[str, List[str]],
+        cpts: Dict[str, Union[np.ndarray, dict]],
+        cache: Optional[QueryCache] = None,
+    ):
+        self.states = {node: [str(state) for state in states[node]] for node in states}
+        self.nodes = list(self.states)
+        self.parents = {node: list(parents.get(node, [])) for node in self.states}
+        self.cpts = dict()
+        for node in self.states:
+            if isinstance(cpts[node], dict):
+                family = self.parents[node] + [node]
+                self.cpts[node] = {
+                    "parent_codes": np.asarray(cpts[node]["parent_codes"]).astype(
+                        np.intp
+                    ),
+                    "probabilities": np.asarray(
+                        cpts[node]["probabilities"], dtype=np.float64
+                    ),
+                    "default": np.asarray(cpts[node]["default"], dtype=np.float64),
+                    "shape": [len(self.states[v]) for v in family],
+                }
+            else:
+                self.cpts[node] = np.asarray(cpts[node], dtype=np.float64)
+        self.state_index = {
+            node: {state: i for i, state in enumerate(node_states)}
+            for node, node_states in self.states.items()
+        }
+        self.child = dict()
+        for node, node_parents in self.parents.items():
+            for parent in node_parents:
+                if parent in self.child:
+                    raise ValueError(
+                        f"`{parent}` has more than one child, ExactInferenceEngine only supports graphs where every "
+                        "node has at most one child"
+                    )
+                self.child[parent] = node
+        self.order = get_topological_order(self.parents)
+        self._prior_upward = self._upward(
+            {node: np.ones((1, len(self.states[node]))) for node in self.order},
+            self.order,
+            dict(),
+        )
+        self._plans = dict()
+        self._log_cpts = None
+        self.cache = QueryCache() if cache is None else cache
+
+    def _get_plan(self, observed: frozenset) -> List[str]:
+        """Gets the nodes, in topological order, whose upward message depends on the `observed` nodes: the observed
+        nodes and everything downstream of them. Every other node keeps its message from the compiled prior.
+        """
+        if observed not in self._plans:
+            affected = set()
+            for node in observed:
+                while node is not None and node not in affected:
+                    affected.add(node)
+                    node = self.child.get(node)
+            self._plans[observed] = [node for node in self.order if node in affected]
+        return self._plans[observed]
+
+    def _upward(
+        self,
+        likelihoods: Dict[str, np.ndarray],
+        nodes: List[str],
+        upward: Dict[str, np.ndarray],
+        log_scales: Optional[Dict[str, np.ndarray]] = None,
+    ) -> Dict[str, np.ndarray]:
+        """Passes messages from the roots towards the target, the message of a node is proportional to the probability
+        of its states jointly with the evidence on it and its ancestors. If `log_scales` is given, the log of the
+        probability of the evidence on each node and its ancestors, which the normalising takes out, is added to it.
+        """
+        upward = dict(upward)
+        for node in nodes:
+            message = likelihoods[node] * _contract(
+                self.cpts[node],
+                [upward[parent] for parent in self.parents[node]] + [None],
+            )
+            if log_scales is not None:
+                log_scales[node] = get_log_probabilities(message.sum(axis=-1)) + sum(
+                    log_scales[parent] for parent in self.parents[node]
+                )
+            upward[node] = _normalise(message)
+        return upward
+
+    def _downward(
+        self, likelihoods: Dict[str, np.ndarray], upward: Dict[str, np.ndarray]
+    ) -> Dict[str, np.ndarray]:
+        """Passes messages from the target back out to the roots, the message of a node is proportional to the
+        probability of the evidence on the rest of the graph given each of its states.
+        """
+        downward = dict()
+        for node in reversed(self.order):
+            if node not in self.child:
+                downward[node] = np.ones_like(upward[node])
+            node_parents = self.parents[node]
+            below = likelihoods[node] * downward[node]
+            for i, parent in enumerate(node_parents):
+                messages = [upward[p] for p in node_parents] + [below]
+                messages[i] = None
+                downward[parent] = _normalise(_contract(self.cpts[node], messages))
+        return downward
+
+    def _get_likelihoods(self, query: dict) -> Dict[str, np.ndarray]:
+        """Turns a query into an indicator array over the states of each node, observed nodes have a one at the state
+        they are held at and unobserved nodes are all ones."""
+        likelihoods = dict()
+        for node in self.order:
+            likelihood = np.ones((1, len(self.states[node])))
+            value = query.get(node)
+            if value is not None:
+                if str(value) not in self.state_index[node]:
+                    raise ValueError(
+                        f"`{value}` is not a state of `{node}`, expected one of {self.states[node]}"
+                    )
+                likelihood[:] = 0
+                likelihood[0, self.state_index[node][str(value)]] = 1
+            likelihoods[node] = likelihood
+        return likelihoods
+
+    def get_posteriors(
+        self, likelihoods: Dict[str, np.ndarray]
+    ) -> Dict[str, np.ndarray]:
+        """Gets the posterior distribution of every node given the evidence in `likelihoods`.
+
+        Args:
+            likelihoods (Dict[str, np.ndarray]): An array for each node with a row per query and a column per state,
+                holding one for every state consistent with the evidence and zero otherwise.
+
+        Returns: The posterior probability of each state of each node, with a row per query.
+
+        """
+        observed = frozenset(
+            name
+            for name, likelihood in likelihoods.items()
+            if not np.all(likelihood == 1)
+        )
+        upward = self._upward(likelihoods, self._get_plan(observed), self._prior_upward)
+        downward = self._downward(likelihoods, upward)
+        return {node: _normalise(upward[node] * downward[node]) for node in self.order}
+
+    def get_posterior(
+        self, likelihoods: Dict[str, np.ndarray], node: str
+    ) -> np.ndarray:
+        """Gets the posterior distribution of a single node given the evidence in `likelihoods`. When the node is the
+        target the graph points towards, only the upward pass is needed.
+
+        Args:
+            likelihoods (Dict[str, np.ndarray]): An array for each node with a row per query and a column per state,
+                holding one for every state consistent with the evidence and zero otherwise.
+            node (str): The node to get the posterior of.
+
+        Returns: The posterior probability of each state of `node`, with a row per query.
+
+        """
+        observed = frozenset(
+            name
+            for name, likelihood in likelihoods.items()
+            if not np.all(likelihood == 1)
+        )
+        upward = self._upward(likelihoods, self._get_plan(observed), self._prior_upward)
+        rows = max(likelihood.shape[0] for likelihood in likelihoods.values())
+        if node in self.child:
+            upward[node] = upward[node] * self._downward(likelihoods, upward)[node]
+        return np.broadcast_to(_normalise(upward[node]), (rows, len(self.states[node])))
+
+    def get_log_evidence(
+        self, likelihoods: Dict[str, np.ndarray], node: Optional[str] = None
+    ) -> np.ndarray:
+        """Gets the log probability of the evidence in `likelihoods`, the likelihood of each query under the network,
+        from one pass of messages towards the target that keeps the scale the normalising takes out. Given a `node`
+        without a child, it gives the log probability of the evidence jointly with each state of the node from the same
+        pass, so the posterior of the node and the likelihood of any of its states come together.
+
+        Args:
+            likelihoods (Dict[str, np.ndarray]): An array for each node with a row per query and a column per state,
+                holding one for every state consistent with the evidence and zero otherwise.
+            node (str, optional): The node, which must not have a child, to give the joint log probability of each of
+                its states with the evidence.
+
+        Returns: The log probability of the evidence of each query, minus infinity for impossible evidence, or with a
+            `node` a row per query and a column per state of the node.
+
+        """
+        if node in self.child:
+            raise ValueError(
+                f"`{node}` has a child, get_log_evidence() only gives the states of nodes without one"
+            )
+        log_scales = dict()
+        upward = self._upward(likelihoods, self.order, dict(), log_scales)
+        rows = max(likelihood.shape[0] for likelihood in likelihoods.values())
+        log_evidence = sum(
+            log_scales[sink] for sink in self.order if sink not in self.child
+        )
+        if node is None:
+            return np.broadcast_to(log_evidence, (rows,))
+        # The message of a node without a child is the distribution of its states given the evidence on its ancestors
+        return np.broadcast_to(
+            log_evidence[:, None] + get_log_probabilities(upward[node]),
+            (rows, len(self.states[node])),
+        )
+
+    def _get_log_cpts(self) -> Dict[str, Union[np.ndarray, dict]]:
+        """The log of every conditional probability table, worked out on first use."""
+        if self._log_cpts is None:
+            self._log_cpts = dict()
+            for node, cpt in self.cpts.items():
+                if isinstance(cpt, dict):
+                    self._log_cpts[node] = {
+                        "parent_codes": cpt["parent_codes"],
+                        "log_probabilities": get_log_probabilities(
+                            cpt["probabilities"]
+                        ),
+                        "log_default": get_log_probabilities(cpt["default"]),
+                        "observed": set(map(tuple, cpt["parent_codes"].tolist())),
+                    }
+                else:
+                    self._log_cpts[node] = get_log_probabilities(cpt)
+        return self._log_cpts
+
+    def get_explanations(
+        self, likelihoods: Dict[str, np.ndarray]
+    ) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray], np.ndarray]:
+        """Gets the posterior distribution of every node and the most probable explanation, the likeliest joint
+        assignment of every node, given the evidence in `likelihoods`. The posteriors come from one pass of summed
+        messages towards the target and one back out, and the explanation from one pass of maximised log messages
+        towards the target and tracing the best states back out, so neither repeats work per node or enumerates the
+        joint states.
+
+        Args:
+            likelihoods (Dict[str, np.ndarray]): An array for each node with a row per query and a column per state,
+                holding one for every state consistent with the evidence and zero otherwise.
+
+        Returns: A tuple of the posterior probability of each state of each node, with a row per query, the position of
+            the state of each node in the explanation, with observed nodes at their evidence, and the probability of
+            the explanation given the evidence, zero for impossible evidence.
+
+        """
+        rows = max(likelihood.shape[0] for likelihood in likelihoods.values())
+        log_scales = dict()
+        upward = self._upward(likelihoods, self.order, dict(), log_scales)
+        downward = self._downward(likelihoods, upward)
+        posteriors = {
+            node: np.broadcast_to(
+                _normalise(upward[node] * downward[node]),
+                (rows, len(self.states[node])),
+            )
+            for node in self.order
+        }
+
+        log_cpts = self._get_log_cpts()
+        max_upward, combinations = dict(), dict()
+        for node in self.order:
+            scores, combinations[node] = _max_contract(
+                log_cpts[node], [max_upward[parent] for parent in self.parents[node]]
+            )
+            max_upward[node] = get_log_probabilities(likelihoods[node]) + scores
+        explanation = dict()
+        log_probability = np.zeros(rows)
+        log_evidence = np.zeros(rows)
+        for node in reversed(self.order):
+            if node not in self.child:
+                message = np.broadcast_to(
+                    max_upward[node], (rows, len(self.states[node]))
+                )
+                explanation[node] = message.argmax(axis=1)
+                log_probability = log_probability + message.max(axis=1)
+                log_evidence = log_evidence + log_scales[node]
+            node_combinations = np.broadcast_to(
+                combinations[node], (rows,) + combinations[node].shape[1:]
+            )
+            chosen = node_combinations[np.arange(rows), explanation[node]]
+            for i, parent in enumerate(self.parents[node]):
+                explanation[parent] = chosen[:, i]
+        with np.errstate(invalid="ignore"):
+            probability = np.exp(log_probability - log_evidence)
+        return (
+            posteriors,
+            {node: explanation[node] for node in self.order},
+            np.where(np.isfinite(log_evidence), probability, 0.0),
+        )
+
+    def get_sweep(
+        self, likelihoods: Dict[str, np.ndarray], target: str
+    ) -> Dict[str, np.ndarray]:
+        """Gets the posterior distribution of the `target` with each other node set to each of its states in turn, the
+        rest of the evidence held as it is. Setting a node replaces any evidence on it. The messages towards the target
+        are passed once, and the messages back out are passed once with the target held at each of its states, each
+        group of messages scaled by a common factor so the states of the target stay comparable. The probability of a
+        node's state jointly with the rest of the evidence and each state of the target then comes from the message in
+        to the node from its parents and the message back out to it.
+
+        Args:
+            likelihoods (Dict[str, np.ndarray]): An array for each node with a row per query and a column per state,
+                holding one for every state consistent with the evidence and zero otherwise. Any evidence on the
+                `target` itself is ignored.
+            target (str): The node to get the posterior of, which must not have a child.
+
+        Returns: For each node other than the `target`, the posterior probability of each state of the `target` with a
+            row per query, a column per state of the node and the states of the `target` on the last axis, nan where
+            the node's state is impossible given the rest of the evidence.
+
+        """
+        if target in self.child:
+            raise ValueError(
+                f"`{target}` has a child, ExactInferenceEngine can only sweep a target without one"
+            )
+        rows = max(likelihood.shape[0] for likelihood in likelihoods.values())
+        n_targets = len(self.states[target])
+        likelihoods = dict(likelihoods)
+        likelihoods[target] = np.ones((1, n_targets))
+        observed = frozenset(
+            name
+            for name, likelihood in likelihoods.items()
+            if not np.all(likelihood == 1)
+        )
+        upward = self._upward(likelihoods, self._get_plan(observed), self._prior_upward)
+        baseline = np.broadcast_to(_normalise(upward[target]), (rows, n_targets))
+
+        def repeat(messages: np.ndarray) -> np.ndarray:
+            """Repeats a message for each state of the target, the queries for the first state first."""
+            return np.tile(
+                np.broadcast_to(messages, (rows, messages.shape[-1])), (n_targets, 1)
+            )
+
+        def normalise(messages: np.ndarray) -> np.ndarray:
+            """Scales the messages of each query for every state of the target by the same factor."""
+            grouped = messages.reshape(n_targets, rows, -1)
+            totals = grouped.sum(axis=(0, 2), keepdims=True)
+            return np.divide(
+                grouped,
+                totals,
+                out=np.zeros(grouped.shape),
+                where=np.broadcast_to(totals > 0, grouped.shape),
+            ).reshape(messages.shape)
+
+        downward = dict()
+        for node in reversed(self.order):
+            n_states = len(self.states[node])
+            if node == target:
+                downward[node] = np.repeat(np.eye(n_targets), rows, axis=0)
+            elif node not in self.child:
+                # Nodes in a separate tree don't affect the target, so they leave it at its posterior
+                downward[node] = np.broadcast_to(
+                    baseline.T.reshape(-1, 1), (n_targets * rows, n_states)
+                )
+            node_parents = self.parents[node]
+            below = repeat(likelihoods[node]) * downward[node]
+            for i, parent in enumerate(node_parents):
+                messages = [repeat(upward[p]) for p in node_parents] + [below]
+                messages[i] = None
+                downward[parent] = normalise(_contract(self.cpts[node], messages))
+
+        sweep = dict()
+        for node in self.order:
+            if node == target:
+                continue
+            prior = _contract(
+                self.cpts[node], [upward[p] for p in self.parents[node]] + [None]
+            )
+            joint = downward[node].reshape(n_targets, rows, -1) * prior[None]
+            joint = np.moveaxis(joint, 0, -1)
+            totals = joint.sum(axis=-1, keepdims=True)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                sweep[node] = np.where(totals > 0, joint / totals, np.nan)
+        return sweep
+
+    def encode(self, data: pd.DataFrame) -> np.ndarray:
+        """Encodes a table of evidence as the position of each value in the states of its node, with -1 for missing
+        values and for nodes that are not columns of `data`.
+
+        Args:
+            data (pd.DataFrame): The evidence, with a column per observed node and missing values for unobserved nodes.
+
+        Returns: The codes as a 2-d array with a column per node, in the order of `nodes`.
+
+        """
+        codes = np.full((data.shape[0], len(self.nodes)), -1, dtype=np.int16)
+        for i, node in enumerate(self.nodes):
+            if node not in data.columns:
+                continue
+            column = data[node]
+            categories = self.states[node]
+            if isinstance(column.dtype, pd.CategoricalDtype):
+                # Look up each category once and index the lookup with the codes
+                lookup = pd.Index(categories).get_indexer(
+                    [str(category) for category in column.cat.categories]
+                )
+                column_codes = column.cat.codes.to_numpy()
+                codes[:, i] = np.where(column_codes >= 0, lookup[column_codes], -1)
+                unknown = (codes[:, i] == -1) & (column_codes >= 0)
+                if unknown.any():
+                    raise ValueError(
+                        f"`{node}` has values {sorted(set(column[unknown].astype(str)))} that are not states of the "
+                        f"node, expected one of {self.states[node]}"
+                    )
+                continue
+            if is_numeric_dtype(column):
+                try:
+                    categories = [float(state) for state in categories]
+                    column = column.astype(np.float64)
+                except ValueError:
+                    column = column.astype("string")
+            else:
+                column = column.astype("string")
+            codes[:, i] = pd.Index(categories).get_indexer(column)
+            unknown = (codes[:, i] == -1) & column.notna().to_numpy()
+            if unknown.any():
+                raise ValueError(
+                    f"`{node}` has values {sorted(set(column[unknown]))} that are not states of the node, expected "
+                    f"one of {self.states[node]}"
+                )
+        return codes
+
+    def score(self, data: Union[pd.DataFrame, np.ndarray], target: str) -> pd.DataFrame:
+        """Scores a whole table of patients at once, giving the posterior distribution of the `target` for every row.
+        Rows are grouped by which nodes they observe and each group goes through the message passing as one batch of
+        arrays, with duplicate rows only computed once.
+
+        Args:
+            data (Union[pd.DataFrame, np.ndarray]): The evidence, either as a pd.DataFrame with a column per observed
+                node and missing values for unobserved nodes, or as codes from encode(). Any evidence on the `target`
+                itself is ignored.
+            target (str): The node to get the posterior of.
+
+        Returns: A pd.DataFrame with a column per state of the `target` and a row per row of `data`, with the same
+            index when `data` is a pd.DataFrame.
+
+        """
+        codes, index = self._get_codes(data)
+        codes[:, self.nodes.index(target)] = -1
+        inverse, n_unique, batches = self._get_batches(codes)
+        unique_posteriors = np.empty((n_unique, len(self.states[target])))
+        for rows, likelihoods in batches:
+            unique_posteriors[rows] = self.get_posterior(likelihoods, target)
+        return pd.DataFrame(
+            unique_posteriors[inverse],
+            index=index,
+            columns=self.states[target],
+        )
+
+    def log_likelihood(
+        self, data: Union[pd.DataFrame, np.ndarray], target: Optional[str] = None
+    ) -> Union[pd.Series, pd.DataFrame]:
+        """Gets the log probability of every row of a table of patients under the network, marginalising out the
+        missing values, grouping the rows the same way as score().
+
+        Args:
+            data (Union[pd.DataFrame, np.ndarray]): The evidence, either as a pd.DataFrame with a column per observed
+                node and missing values for unobserved nodes, or as codes from encode().
+            target (str, optional): A node without a child to give the log probability of each row jointly with each
+                of its states, in the same pass that gives the log probability of the rest of the row. Any evidence on
+                the `target` itself is ignored.
+
+        Returns: The log probability of each row as a pd.Series, or with a `target` a pd.DataFrame with a column per
+            state of the `target`, with the same index as `data` when it is a pd.DataFrame.
+
+        """
+        codes, index = self._get_codes(data)
+        if target is not None:
+            codes[:, self.nodes.index(target)] = -1
+        inverse, n_unique, batches = self._get_batches(codes)
+        log_evidence = np.empty(
+            (n_unique,) if target is None else (n_unique, len(self.states[target]))
+        )
+        for rows, likelihoods in batches:
+            log_evidence[rows] = self.get_log_evidence(likelihoods, target)
+        if target is None:
+            return pd.Series(log_evidence[inverse], index=index)
+        return pd.DataFrame(
+            log_evidence[inverse], index=index, columns=self.states[target]
+        )
+
+    def explain(self, data: Union[pd.DataFrame, np.ndarray]) -> dict:
+        """Gets the posterior distribution of every node and the most probable explanation for a whole table of
+        patients at once, grouping the rows the same way as score().
+
+        Args:
+            data (Union[pd.DataFrame, np.ndarray]): The evidence, either as a pd.DataFrame with a column per observed
+                node and missing values for unobserved nodes, or as codes from encode().
+
+        Returns: A dictionary of the "marginals", a pd.DataFrame for each node with a column per state and a row per row
+            of `data`, the "explanation", a pd.DataFrame with the state of every node in the likeliest assignment, the
+            observed nodes at their evidence, and the "probability" of each explanation given the evidence, all with the
+            same index as `data` when it is a pd.DataFrame.
+
+        """
+        codes, index = self._get_codes(data)
+        inverse, n_unique, batches = self._get_batches(codes)
+        marginals = {
+            node: np.empty((n_unique, len(self.states[node]))) for node in self.nodes
+        }
+        explanation = np.empty((n_unique, len(self.nodes)), dtype=np.int64)
+        probability = np.empty(n_unique)
+        for rows, likelihoods in batches:
+            posteriors, states, batch_probability = self.get_explanations(likelihoods)
+            probability[rows] = batch_probability
+            for j, node in enumerate(self.nodes):
+                marginals[node][rows] = posteriors[node]
+                explanation[rows, j] = states[node]
+        return {
+            "marginals": {
+                node: pd.DataFrame(
+                    marginals[node][inverse], index=index, columns=self.states[node]
+                )
+                for node in self.nodes
+            },
+            "explanation": pd.DataFrame(
+                {
+                    node: np.asarray(self.states[node], dtype=object)[
+                        explanation[inverse, j]
+                    ]
+                    for j, node in enumerate(self.nodes)
+                },
+                index=index,
+            ),
+            "probability": pd.Series(probability[inverse], index=index),
+        }
+
+    def query_explanation(self, query: dict) -> dict:
+        """Answers a single query with the posterior distribution of every node and the most probable explanation of
+        the nodes not held in evidence, "the likeliest configuration of what wasn't measured given what was".
+
+        Args:
+            query (dict): The query, where the keys are the names of the nodes and the value is the value you want to
+                set that node to, or None for nodes not held in evidence.
+
+        Returns: A dictionary of the "marginals", the posterior distribution of every node as a dictionary of state to
+            probability, the "explanation", the likeliest state of every node not held in evidence, and its
+            "probability" given the evidence.
+
+        """
+        posteriors, explanation, probability = self.get_explanations(
+            self._get_likelihoods(query)
+        )
+        return {
+            "marginals": {
+                node: dict(zip(self.states[node], posteriors[node][0].tolist()))
+                for node in self.order
+            },
+            "explanation": {
+                node: self.states[node][explanation[node][0]]
+                for node in self.order
+                if query.get(node) is None
+            },
+            "probability": float(probability[0]),
+        }
+
+    def sweep(
+        self,
+        data: Union[pd.DataFrame, np.ndarray, dict],
+        target: str,
+        target_state: Optional[str] = None,
+    ) -> pd.DataFrame:
+        """Asks "what would happen to the target if this node was set to this state" for every node and state at once,
+        for a single query or a whole table of patients, grouping the rows the same way as score().
+
+        Args:
+            data (Union[pd.DataFrame, np.ndarray, dict]): The evidence, either as a query, where the keys are the names
+                of the nodes and the value is the value you want to set that node to, or None for nodes not held in
+                evidence, as a pd.DataFrame with a column per observed node and missing values for unobserved nodes,
+                or as codes from encode(). Any evidence on the `target` itself is ignored.
+            target (str): The node to get the posterior of, which must not have a child.
+            target_state (str, optional): The state of the `target` to give the probability of, defaults to its last
+                state, the positive state of a binary target.
+
+        Returns: A tidy pd.DataFrame with a row per patient, node and state, the "patient" being the index of `data`,
+            or 0 for a query, and the "variable" and "state" set, with the "probability" of the `target_state` and its
+            "delta" from the probability given the evidence alone.
+
+        """
+        if isinstance(data, dict):
+            data = pd.DataFrame(
+                [{node: value for node, value in data.items() if value is not None}],
+                columns=self.nodes,
+            )
+        if target_state is None:
+            target_state = self.states[target][-1]
+        position = self.state_index[target][str(target_state)]
+        codes, index = self._get_codes(data)
+        codes[:, self.nodes.index(target)] = -1
+        inverse, n_unique, batches = self._get_batches(codes)
+        variables = [node for node in self.nodes if node != target]
+        sizes = [len(self.states[node]) for node in variables]
+        probabilities = np.empty((n_unique, sum(sizes)))
+        baseline = np.empty(n_unique)
+        for rows, likelihoods in batches:
+            sweep = self.get_sweep(likelihoods, target)
+            probabilities[rows] = np.concatenate(
+                [sweep[node][:, :, position] for node in variables], axis=1
+            )
+            baseline[rows] = self.get_posterior(likelihoods, target)[:, position]
+        probabilities = probabilities[inverse]
+        return pd.DataFrame(
+            {
+                "patient": np.repeat(index, sum(sizes)),
+                "variable": np.tile(np.repeat(variables, sizes), len(index)),
+                "state": np.tile(
+                    np.concatenate([self.states[node] for node in variables]),
+                    len(index),
+                ),
+                "probability": probabilities.ravel(),
+                "delta": (probabilities - baseline[inverse, None]).ravel(),
+            }
+        )
+
+    def _get_codes(self, data: Union[pd.DataFrame, np.ndarray]):
+        """Encodes evidence given as a pd.DataFrame, or copies evidence given as codes, and gives its index."""
+        if isinstance(data, pd.DataFrame):
+            return self.encode(data), data.index
+        return np.array(data), pd.RangeIndex(len(data))
+
+    def _get_batches(
+        self, codes: np.ndarray
+    ) -> Tuple[np.ndarray, int, List[Tuple[np.ndarray, Dict[str, np.ndarray]]]]:
+        """Groups the distinct rows of `codes` by which nodes they observe, so each group goes through the message
+        passing as one batch of arrays, split so no batch needs more than `_MAX_BATCH_ELEMENTS` elements at once.
+
+        Returns: The position of each row of `codes` among the distinct rows, the number of distinct rows, and for each
+            group the positions of its distinct rows and their likelihoods.
+
+        """
+        unique_codes, inverse = _unique_rows(
+            codes, [len(self.states[node]) for node in self.nodes]
+        )
+        patterns, pattern_inverse = _unique_rows(
+            (unique_codes >= 0).astype(np.int8), [2] * len(self.nodes)
+        )
+        largest_table = max(
+            cpt["probabilities"].size if isinstance(cpt, dict) else cpt.size
+            for cpt in self.cpts.values()
+        )
+        batch_size = max(1, _MAX_BATCH_ELEMENTS // largest_table)
+        batches = []
+        for i, pattern in enumerate(patterns):
+            pattern_rows = np.flatnonzero(pattern_inverse.ravel() == i)
+            for start in range(0, len(pattern_rows), batch_size):
+                rows = pattern_rows[start : start + batch_size]
+                likelihoods = dict()
+                for j, node in enumerate(self.nodes):
+                    states = len(self.states[node])
+                    if pattern[j]:
+                        likelihoods[node] = np.eye(states)[unique_codes[rows, j]]
+                    else:
+                        likelihoods[node] = np.ones((1, states))
+                batches.append((rows, likelihoods))
+        return inverse.ravel(), len(unique_codes), batches
+
+    def query(self, query: dict) -> dict:
+        """Runs the same query as `utils.evaluation.query_bayesian_network`, giving the exact posterior distribution of
+        every node not held in evidence.
+
+        Args:
+            query (dict): The query, where the keys are the names of the nodes and the value is the value you want to
+                set that node to, or None for nodes not held in evidence.
+
+        Returns: The posterior distribution of each node not held in evidence, as a dictionary of state to probability.
+
+        """
+        key = tuple(
+            None if query.get(node) is None else str(query[node]) for node in self.order
+        )
+        self.cache.validate(self)
+        results = self.cache.get_or_compute(key, lambda: self._query(query, key))
+        return {node: dict(states) for node, states in results.items()}
+
+    def _query(self, query: dict, key: tuple) -> dict:
+        posteriors = self.get_posteriors(self._get_likelihoods(query))
+        return {
+            node: dict(zip(self.states[node], posteriors[node][0].tolist()))
+            for node, value in zip(self.order, key)
+            if value is None
+        }
+
+    def warm_cache(self, queries: List[dict]) -> None:
+        """Runs `queries` so their results are in the cache before the first real query comes in, see
+        `utils.modelling.query_cache.get_frequent_queries`.
+
+        Args:
+            queries (List[dict]): The queries to run, most important first, so they are the last to be evicted.
+
+        """
+        for query in reversed(queries):
+            self.query(query)
+
+
+def get_inference_engine_from_counts(
+    family_counts: Dict[str, np.ndarray],
+    node_states: Dict[str, Sequence],
+    directed_edge_list: List[List[str]],
+) -> ExactInferenceEngine:
+    """Compiles an `ExactInferenceEngine` straight from the count tables the pomegranate states are built from, see
+    `utils.graphs.probability.get_pomegranate_states_from_counts`.
+
+    Args:
+        family_counts (Dict[str, np.ndarray]): The joint counts of each node's parents and the node.
+        node_states (Dict[str, Sequence]): The states each axis of the counts refers to, keyed by node name.
+        directed_edge_list: The directed edges of our graph, a list of lists with 2 elements, pointing an edge from left
+            to right.
+
+    Returns: The compiled inference engine.
+
+    """
+    parents = get_parents(directed_edge_list)
+    return ExactInferenceEngine(
+        {node: node_states[node] for node in parents},
+        parents,
+        {node: get_conditional_probabilities(family_counts[node]) for node in parents},
+    )
+
+
+@profiled
+def compile_bayesian_network(model) -> ExactInferenceEngine:
+    """Compiles a baked pomegranate `BayesianNetwork` in to an `ExactInferenceEngine`, reading the probability tables
+    out of its states.
+
+    Args:
+        model: A trained pomegranate `BayesianNetwork`, as output by `utils.modelling.bayes_model.get_bayesian_network`.
+
+    Returns: The compiled inference engine.
+
+    """
+    from pomegranate import ConditionalProbabilityTable
+
+    names = {id(state.distribution): state.name for state in model.states}
+    states, parents, tables = dict(), dict(), dict()
+    for state in model.states:
+        distribution = state.distribution
+        if isinstance(distribution, ConditionalProbabilityTable):
+            rows = distribution.parameters[0]
+            parents[state.name] = [
+                names[id(parent)] for parent in distribution.parameters[1]
+            ]
+            states[state.name] = list(dict.fromkeys(str(row[-2]) for row in rows))
+            tables[state.name] = rows
+        else:
+            parents[state.name] = []
+            states[state.name] = [str(key) for key in distribution.parameters[0]]
+            tables[state.name] = distribution.parameters[0]
+
+    cpts = dict()
+    for node, table in tables.items():
+        if not parents[node]:
+            cpts[node] = np.array([table[state] for state in table], dtype=np.float64)
+            continue
+        family = parents[node] + [node]
+        index = {v: {s: i for i, s in enumerate(states[v])} for v in family}
+        cpt = np.zeros([len(states[v]) for v in family])
+        for row in table:
+            cpt[tuple(index[v][str(s)] for v, s in zip(family, row[:-1]))] = row[-1]
+        cpts[node] = cpt
+    return ExactInferenceEngine(states, parents, cpts)
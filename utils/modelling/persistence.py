@@ -0,0 +1,123 @@
+"""
+This module is for saving and loading fitted pipelines, see `utils.modelling.pipeline`. A pipeline file is a short magic
+string and format version, the length of a JSON header, the JSON header itself, and then every array of the pipeline
+packed back to back as float64. The header holds everything that isn't an array along with the name, shape and position
+of each array, so loading is one small JSON parse plus one read of the array block, or no read at all when the block is
+memory-mapped. Sparse tables, dictionaries of arrays, are stored as the position of each of their arrays.
+"""
+import json
+from typing import Tuple
+
+import numpy as np
+
+MAGIC = b"BAYESNET"
+FORMAT_VERSION = 1
+# The array block starts on a multiple of this many bytes, so memory-mapped arrays are aligned.
+_ALIGNMENT = 64
+# The keys of the pipeline holding dictionaries of arrays, any other arrays in the pipeline are stored on their own
+_ARRAY_KEYS = ("bin_edges", "cpts", "family_counts")
+
+
+def _pack_arrays(pipeline: dict) -> Tuple[dict, np.ndarray]:
+    """Splits the arrays out of the pipeline in to one flat block, recording where each one lives in the header."""
+    header = {
+        key: value
+        for key, value in pipeline.items()
+        if key not in _ARRAY_KEYS and not isinstance(value, np.ndarray)
+    }
+    header["arrays"] = dict()
+    blocks, offset = [], 0
+
+    def pack(array: np.ndarray) -> dict:
+        nonlocal offset
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        entry = {"offset": offset, "shape": list(array.shape)}
+        blocks.append(array.ravel())
+        offset += array.size
+        return entry
+
+    for key, value in pipeline.items():
+        if key in _ARRAY_KEYS:
+            header["arrays"][key] = {
+                name: (
+                    {part: pack(part_array) for part, part_array in array.items()}
+                    if isinstance(array, dict)
+                    else pack(array)
+                )
+                for name, array in value.items()
+            }
+        elif isinstance(value, np.ndarray):
+            header["arrays"][key] = pack(value)
+    return header, np.concatenate(blocks) if blocks else np.zeros(0)
+
+
+def save_pipeline(pipeline: dict, file_location: str) -> None:
+    """Saves a fitted pipeline to a single file.
+
+    Args:
+        pipeline (dict): The fitted pipeline, as output by `utils.modelling.pipeline.fit_pipeline`.
+        file_location (str): Where to write the file.
+
+    """
+    header, data = _pack_arrays(pipeline)
+    header_bytes = json.dumps(header).encode("utf-8")
+    prefix_length = len(MAGIC) + 8 + 8 + len(header_bytes)
+    padding = -prefix_length % _ALIGNMENT
+    with open(file_location, "wb") as file:
+        file.write(MAGIC)
+        file.write(np.uint64(FORMAT_VERSION).tobytes())
+        file.write(np.uint64(len(header_bytes) + padding).tobytes())
+        file.write(header_bytes + b" " * padding)
+        file.write(data.astype("<f8").tobytes())
+
+
+def load_pipeline(file_location: str, mmap: bool = False) -> dict:
+    """Loads a fitted pipeline saved by save_pipeline().
+
+    Args:
+        file_location (str): The pipeline file location.
+        mmap (bool): Memory-map the arrays rather than reading them, so they are only paged in from disk when used.
+
+    Returns: The fitted pipeline.
+
+    """
+    with open(file_location, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{file_location} is not a pipeline file")
+        version = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                f"{file_location} is pipeline format version {version}, only version {FORMAT_VERSION} can be loaded"
+            )
+        header_length = int(np.frombuffer(file.read(8), dtype="<u8")[0])
+        header = json.loads(file.read(header_length).decode("utf-8"))
+        data_offset = len(MAGIC) + 16 + header_length
+        if mmap:
+            data = np.memmap(file_location, dtype="<f8", mode="r", offset=data_offset)
+        else:
+            data = np.fromfile(file, dtype="<f8")
+
+    arrays = header.pop("arrays")
+    pipeline = dict(header)
+    for key, entry in arrays.items():
+        if key in _ARRAY_KEYS:
+            pipeline[key] = {
+                name: (
+                    _unpack_array(array_entry, data)
+                    if "offset" in array_entry
+                    else {
+                        part: _unpack_array(part_entry, data)
+                        for part, part_entry in array_entry.items()
+                    }
+                )
+                for name, array_entry in entry.items()
+            }
+        else:
+            pipeline[key] = _unpack_array(entry, data)
+    return pipeline
+
+
+def _unpack_array(entry: dict, data: np.ndarray) -> np.ndarray:
+    """Cuts an array back out of the flat block as a view."""
+    size = int(np.prod(entry["shape"], dtype=np.int64))
+    return data[entry["offset"] : entry["offset"] + size].reshape(entry["shape"])
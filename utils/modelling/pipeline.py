@@ -0,0 +1,595 @@
+"""
+This module is for fitting the whole runner pipeline once and keeping everything needed to score new patients: the bin
+edges, the category coding, the learned edges and the probability arrays. A fitted pipeline is a plain dictionary, so it
+can be saved and loaded with `utils.modelling.persistence` and scored without retraining or pomegranate. The pipeline
+also keeps the counts its probabilities and mutual information were estimated from, so new batches of patients can be
+added to it with update_pipeline() without going back to the old data.
+"""
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from utils.graphs.counting import (
+    get_conditional_probabilities,
+    get_family_counts,
+    get_sparse_conditional_probabilities,
+    merge_sparse_contingency_tables,
+)
+from utils.graphs.mutual_information import (
+    get_joint_counts,
+    get_mutual_information_from_joint_counts,
+)
+from utils.graphs.structuring import (
+    get_maximum_spanning_tree,
+    get_parents,
+    orient_graph,
+)
+from utils.modelling.inference import ExactInferenceEngine
+from utils.modelling.query_cache import QueryCache, get_frequent_queries
+from utils.preprocessing.bespoke_preprocessing import convert_columns_to_correct_types
+from utils.preprocessing.binning import fit_bin_edges
+from utils.preprocessing.encoding import (
+    encode_categorical_columns,
+    encode_data_frame,
+)
+from utils.preprocessing.generic_preprocessing import (
+    bin_numeric_data,
+    reduce_data_frame_to_categorical_columns,
+    reduce_data_frame_to_numeric_columns,
+)
+from utils.profiling import profiled
+
+
+@profiled
+def fit_pipeline(
+    data_frame: pd.DataFrame,
+    target: str,
+    bins: int = 5,
+    unique_value_limit: int = 15,
+    n_jobs: int = 1,
+    binning: str = "uniform",
+    sparse: bool = False,
+    smoothing: Union[float, Dict[str, float]] = 0.0,
+) -> dict:
+    """Runs the same steps as the runner, binning, coding, structure learning and probability estimation, but keeps
+    what each step learned instead of throwing it away.
+
+    Args:
+        data_frame (pd.DataFrame): The raw training data.
+        target (str): Node in the network which we point edges to.
+        bins (int): The number of bins to use for numeric columns.
+        unique_value_limit (int): Maximum number of categories in categorical variables.
+        n_jobs (int): The number of threads to count the mutual information over and of processes to count the
+            families of the nodes over.
+        binning (str): How to fit the bin edges, "uniform", "quantile" or "supervised" against the `target`, see
+            `utils.preprocessing.binning.fit_bin_edges`.
+        sparse (bool): Whether to keep the counts and probabilities of each node only for the combinations of parent
+            states seen in the data, see `utils.graphs.counting.get_sparse_contingency_table`, so the pipeline grows
+            with the data rather than the number of combinations of states. Every combination that wasn't seen gets the
+            smoothed marginal distribution of the node.
+        smoothing (Union[float, Dict[str, float]]): The pseudo-count of the Dirichlet prior each node's probabilities
+            are smoothed with, see `utils.graphs.counting.get_conditional_probabilities`, either one for every node or
+            a dictionary of node to pseudo-count, where nodes left out aren't smoothed.
+
+    Returns: The fitted pipeline, a dictionary with the "target", "bins", "binning", "bin_edges" and "categories"
+        used to preprocess the data, the "directed_edge_list" of the network, the "node_states" of each node and the
+        "cpts", the conditional probability array of each node with one axis per parent followed by the node's own axis,
+        or its sparse table when "sparse" is set, smoothed by "smoothing".
+        The counts behind them are kept as "family_counts", the counts the "cpts" are normalised from, and
+        "joint_counts", the stacked joint counts of every pair of nodes in the order of "node_states" that the structure
+        was learned from.
+        The "version" counts the updates made with update_pipeline(), so stale inference engines can be spotted.
+
+    """
+    codes, pipeline = encode_training_data(
+        data_frame, target, bins, unique_value_limit, binning
+    )
+    pipeline.update(sparse=sparse, smoothing=smoothing)
+    return fit_pipeline_from_codes(codes, pipeline, n_jobs)
+
+
+def encode_training_data(
+    data_frame: pd.DataFrame,
+    target: str,
+    bins: int = 5,
+    unique_value_limit: int = 15,
+    binning: str = "uniform",
+    bin_edges: Optional[Dict[str, np.ndarray]] = None,
+) -> Tuple[np.ndarray, dict]:
+    """Runs the preprocessing of fit_pipeline(), binning and coding the data, and encodes the result as the codes the
+    counts are taken from.
+
+    Args:
+        data_frame (pd.DataFrame): The raw training data.
+        target (str): Node in the network which we point edges to.
+        bins (int): The number of bins to use for numeric columns.
+        unique_value_limit (int): Maximum number of categories in categorical variables.
+        binning (str): How to fit the bin edges, see fit_pipeline().
+        bin_edges (Dict[str, np.ndarray], optional): Fixed bin edges for each numeric column to use instead of fitting
+            them with `binning`.
+
+    Returns: A tuple of the codes, with a column per node and -1 for missing values, and the pipeline so far, with the
+        "target", "bins", "binning", "bin_edges", "categories" and the "node_states" each column of codes refers to.
+
+    """
+    heart_disease_df = convert_columns_to_correct_types(data_frame)
+    numeric_df = reduce_data_frame_to_numeric_columns(heart_disease_df)
+    if bin_edges is None:
+        bin_edges = fit_bin_edges(numeric_df, bins, binning, heart_disease_df[target])
+    numeric_df = bin_numeric_data(numeric_df, bins, bin_edges)
+    categorical_df, categories = encode_categorical_columns(
+        heart_disease_df, list(numeric_df.columns), unique_value_limit
+    )
+    training_df = numeric_df.join(categorical_df)
+    del categorical_df
+    del numeric_df
+    codes, node_states = encode_data_frame(training_df)
+    return codes, {
+        "target": target,
+        "bins": bins,
+        "binning": binning,
+        "bin_edges": bin_edges,
+        "categories": categories,
+        "node_states": {
+            node: [str(state) for state in states]
+            for node, states in node_states.items()
+        },
+    }
+
+
+def fit_pipeline_from_codes(codes: np.ndarray, pipeline: dict, n_jobs: int = 1) -> dict:
+    """Learns the structure and probabilities of a pipeline from encoded data, so the data can be preprocessed once and
+    refit many times, on resamples or folds of its rows.
+
+    Args:
+        codes (np.ndarray): The codes, as output by encode_training_data().
+        pipeline (dict): The pipeline so far, as output by encode_training_data(), which isn't changed. The "sparse" and
+            "smoothing" options of fit_pipeline() are read from it when present.
+        n_jobs (int): The number of threads to count the mutual information over and of processes to count the
+            families of the nodes over.
+
+    Returns: The fitted pipeline, see fit_pipeline().
+
+    """
+    node_states = pipeline["node_states"]
+    joint_counts = get_joint_counts(
+        codes, get_cardinalities(node_states), n_jobs=n_jobs
+    )
+    graph = get_spanning_tree(joint_counts, node_states)
+    directed_edge_list, _, parents = orient_graph(graph, pipeline["target"])
+    pipeline = {"sparse": False, "smoothing": 0.0, **pipeline}
+    family_counts = _get_pipeline_family_counts(
+        codes, node_states, parents, n_jobs, pipeline["sparse"]
+    )
+    return {
+        **pipeline,
+        "node_states": {node: list(states) for node, states in node_states.items()},
+        "directed_edge_list": directed_edge_list,
+        "cpts": {
+            node: _get_cpt(counts, pipeline, node)
+            for node, counts in family_counts.items()
+        },
+        "family_counts": family_counts,
+        "joint_counts": joint_counts,
+        "version": 0,
+    }
+
+
+def get_cardinalities(node_states: Dict[str, List[str]]) -> np.ndarray:
+    """Returns: The number of states of each node, in the order of `node_states`."""
+    return np.array([len(states) for states in node_states.values()])
+
+
+def get_spanning_tree(joint_counts: np.ndarray, node_states: Dict[str, List[str]]):
+    """Gets the maximum spanning tree of the mutual information between the nodes.
+
+    Args:
+        joint_counts (np.ndarray): The stacked joint counts of every pair of nodes, as output by
+            `utils.graphs.mutual_information.get_joint_counts`.
+        node_states (Dict[str, List[str]]): The states of each node, in the order of the codes counted.
+
+    Returns: The maximum spanning tree as an nx.Graph, see `utils.graphs.structuring.get_maximum_spanning_tree`.
+
+    """
+    return get_maximum_spanning_tree(
+        get_mutual_information_from_joint_counts(
+            joint_counts, get_cardinalities(node_states)
+        ),
+        list(node_states),
+    )
+
+
+def _get_pipeline_family_counts(
+    codes: np.ndarray,
+    node_states: Dict[str, List[str]],
+    parents: Dict[str, List[str]],
+    n_jobs: int = 1,
+    sparse: bool = False,
+) -> Dict[str, Union[np.ndarray, Dict[str, np.ndarray]]]:
+    """Counts the family of every node, with the columns of `codes` in the order of `node_states`."""
+    position = {node: i for i, node in enumerate(node_states)}
+    return get_family_counts(
+        codes,
+        get_cardinalities(node_states),
+        {
+            node: [position[v] for v in independent_variables + [node]]
+            for node, independent_variables in parents.items()
+        },
+        n_jobs,
+        sparse,
+    )
+
+
+def _get_cpt(
+    counts: Union[np.ndarray, Dict[str, np.ndarray]], pipeline: dict, node: str
+) -> Union[np.ndarray, Dict[str, np.ndarray]]:
+    """Normalises the family counts of a node, dense or sparse, with the node's smoothing."""
+    smoothing = pipeline.get("smoothing", 0.0)
+    if isinstance(smoothing, dict):
+        smoothing = smoothing.get(node, 0.0)
+    if isinstance(counts, dict):
+        return get_sparse_conditional_probabilities(counts, smoothing)
+    return get_conditional_probabilities(counts, smoothing)
+
+
+@profiled
+def transform_data(
+    data_frame: pd.DataFrame, pipeline: dict, unknown_values: str = "raise"
+) -> pd.DataFrame:
+    """Preprocesses data the way the pipeline was trained, binning with the stored bin edges and coding with the stored
+    categories. Columns the pipeline uses that are missing from `data_frame` are left out.
+
+    Args:
+        data_frame (pd.DataFrame): The raw data.
+        pipeline (dict): The fitted pipeline, or any dictionary with its "bins", "bin_edges" and "categories".
+        unknown_values (str): What to do with values the pipeline can't code, categories it has never seen and numbers
+            outside of its bin edges: "raise" a ValueError naming them, or leave them "missing", as NaN, which is not
+            the same as the code of a missing category, so they are left out of the evidence and the counts.
+
+    Returns: The data as training data, with one column per node.
+
+    """
+    if unknown_values not in ("raise", "missing"):
+        raise ValueError(
+            f'`unknown_values` must be "raise" or "missing", not "{unknown_values}"'
+        )
+    data_frame = convert_columns_to_correct_types(data_frame.copy(deep=False))
+    bin_edges = {
+        column: edges
+        for column, edges in pipeline["bin_edges"].items()
+        if column in data_frame.columns
+    }
+    numeric_df = bin_numeric_data(
+        data_frame[list(bin_edges)], pipeline["bins"], bin_edges
+    )
+    categories = {
+        column: column_categories
+        for column, column_categories in pipeline["categories"].items()
+        if column in data_frame.columns
+    }
+    categorical_df = reduce_data_frame_to_categorical_columns(
+        data_frame, [], categories=categories
+    )
+
+    # Values that are present but got no bin or no category, which the binning and coding leave as missing or -1
+    unknown = dict()
+    for column, edges in bin_edges.items():
+        node = f"{column}_{pipeline['bins']}bin"
+        rows = (
+            numeric_df[node].isna().to_numpy() & data_frame[column].notna().to_numpy()
+        )
+        if rows.any():
+            unknown[column] = (
+                rows,
+                f"outside of the bin edges of the pipeline, from {edges[0]} to {edges[-1]}",
+            )
+    for column, column_categories in categories.items():
+        rows = (categorical_df[column] == -1).to_numpy() & data_frame[
+            column
+        ].notna().to_numpy()
+        if rows.any():
+            unknown[column] = (
+                rows,
+                f"that are not categories of the pipeline, expected one of {column_categories}",
+            )
+    if unknown and unknown_values == "raise":
+        raise ValueError(
+            "; ".join(
+                f"`{column}` has values {sorted(set(data_frame[column][rows].astype(str)))} {reason}"
+                for column, (rows, reason) in unknown.items()
+            )
+        )
+    for column, (rows, _) in unknown.items():
+        if column in categorical_df.columns:
+            categorical_df[column] = categorical_df[column].where(~rows)
+    return numeric_df.join(categorical_df)
+
+
+def get_pipeline_inference_engine(
+    pipeline: dict, cache: Optional[QueryCache] = None
+) -> ExactInferenceEngine:
+    """Compiles the probability arrays of a fitted pipeline in to an `ExactInferenceEngine`, recording the version of
+    the pipeline it was compiled from as its `pipeline_version`.
+
+    Args:
+        pipeline (dict): The fitted pipeline.
+        cache (QueryCache, optional): The cache of query results, which is cleared if it holds results of another
+            engine, such as one compiled before the pipeline was updated.
+
+    Returns: The compiled inference engine.
+
+    """
+    engine = ExactInferenceEngine(
+        pipeline["node_states"],
+        get_parents(pipeline["directed_edge_list"]),
+        pipeline["cpts"],
+        cache,
+    )
+    engine.pipeline_version = pipeline.get("version", 0)
+    return engine
+
+
+def warm_pipeline_cache(
+    engine: ExactInferenceEngine,
+    data_frame: pd.DataFrame,
+    pipeline: dict,
+    n_queries: int = 100,
+) -> None:
+    """Fills the query cache of a pipeline's engine with the most frequent evidence patterns of some raw data, usually
+    the training data, so the most common queries are answered from the cache from the start.
+
+    Args:
+        engine (ExactInferenceEngine): The pipeline's compiled engine.
+        data_frame (pd.DataFrame): The raw patient data.
+        pipeline (dict): The fitted pipeline.
+        n_queries (int): The number of evidence patterns to run.
+
+    """
+    training_df = transform_data(data_frame, pipeline)
+    engine.warm_cache(get_frequent_queries(training_df, pipeline["target"], n_queries))
+
+
+@profiled
+def score_data(
+    data_frame: pd.DataFrame,
+    pipeline: dict,
+    engine: Optional[ExactInferenceEngine] = None,
+) -> pd.DataFrame:
+    """Scores raw patient data with a fitted pipeline, giving the posterior distribution of the target for every row.
+    Missing values are treated as nodes not held in evidence, and values the pipeline can't code, categories it has
+    never seen and numbers outside of its bin edges, raise a ValueError naming them.
+
+    Args:
+        data_frame (pd.DataFrame): The raw patient data.
+        pipeline (dict): The fitted pipeline.
+        engine (ExactInferenceEngine, optional): The pipeline's compiled engine, to avoid compiling it on every call. An
+            engine compiled before the pipeline was last updated is ignored and a new one compiled.
+
+    Returns: A pd.DataFrame with a column per state of the target, aligned to the index of `data_frame`, with NaN for
+        rows whose evidence has zero probability under the pipeline.
+
+    """
+    engine, evidence = _get_evidence(data_frame, pipeline, engine)
+    return _mark_impossible(engine.score(evidence, pipeline["target"]))
+
+
+@profiled
+def explain_data(
+    data_frame: pd.DataFrame,
+    pipeline: dict,
+    engine: Optional[ExactInferenceEngine] = None,
+) -> dict:
+    """Gets the posterior distribution of every node and the most probable explanation, the likeliest states of the
+    nodes that weren't measured, for every row of raw patient data. Missing values are treated as nodes not held in
+    evidence, and values the pipeline can't code raise a ValueError, see score_data().
+
+    Args:
+        data_frame (pd.DataFrame): The raw patient data.
+        pipeline (dict): The fitted pipeline.
+        engine (ExactInferenceEngine, optional): The pipeline's compiled engine, see score_data().
+
+    Returns: The "marginals", "explanation" and "probability" of each row, aligned to the index of `data_frame`, see
+        `utils.modelling.inference.ExactInferenceEngine.explain`, with NaN marginals for rows whose evidence has zero
+        probability under the pipeline.
+
+    """
+    engine, evidence = _get_evidence(data_frame, pipeline, engine)
+    explanation = engine.explain(evidence)
+    explanation["marginals"] = {
+        node: _mark_impossible(marginals)
+        for node, marginals in explanation["marginals"].items()
+    }
+    return explanation
+
+
+@profiled
+def sweep_data(
+    data_frame: pd.DataFrame,
+    pipeline: dict,
+    engine: Optional[ExactInferenceEngine] = None,
+) -> pd.DataFrame:
+    """Gets the probability of the positive state of the target, its last state, for every row of raw patient data
+    with each node set to each of its states in turn, for per patient sensitivity reports. Missing values are treated
+    as nodes not held in evidence, and values the pipeline can't code raise a ValueError, see score_data().
+
+    Args:
+        data_frame (pd.DataFrame): The raw patient data.
+        pipeline (dict): The fitted pipeline.
+        engine (ExactInferenceEngine, optional): The pipeline's compiled engine, see score_data().
+
+    Returns: A tidy pd.DataFrame of the "patient", the index of `data_frame`, the "variable" and "state" set, the
+        "probability" of the target and its "delta", see `utils.modelling.inference.ExactInferenceEngine.sweep`.
+
+    """
+    engine, evidence = _get_evidence(data_frame, pipeline, engine)
+    return engine.sweep(evidence, pipeline["target"])
+
+
+def _mark_impossible(posteriors: pd.DataFrame) -> pd.DataFrame:
+    """Turns the all-zero posteriors the engine gives for evidence with zero probability in to NaN, so they can't be
+    mistaken for a distribution."""
+    return posteriors.where(posteriors.sum(axis=1) > 0, np.nan, axis=0)
+
+
+def _get_evidence(
+    data_frame: pd.DataFrame,
+    pipeline: dict,
+    engine: Optional[ExactInferenceEngine] = None,
+) -> Tuple[ExactInferenceEngine, pd.DataFrame]:
+    """Compiles the pipeline's engine unless an up to date one is given, and preprocesses raw data as its evidence,
+    with missing categorical values left missing rather than coded as a category, raising a ValueError for values the
+    pipeline can't code."""
+    if engine is None or getattr(engine, "pipeline_version", None) != pipeline.get(
+        "version", 0
+    ):
+        engine = get_pipeline_inference_engine(pipeline)
+    missing = data_frame.isna()
+    evidence = transform_data(data_frame, pipeline)
+    for column in pipeline["categories"]:
+        if column in evidence.columns:
+            evidence[column] = evidence[column].where(~missing[column])
+    return engine, evidence
+
+
+def _encode_node_states(
+    training_df: pd.DataFrame, node_states: Dict[str, List[str]]
+) -> np.ndarray:
+    """Encodes preprocessed data as the position of each value in the states of its node, -1 for missing values."""
+    codes = np.full(
+        (training_df.shape[0], len(node_states)), -1, dtype=np.int16, order="F"
+    )
+    for i, (node, states) in enumerate(node_states.items()):
+        if node in training_df.columns:
+            codes[:, i] = pd.Index([float(state) for state in states]).get_indexer(
+                training_df[node].astype(np.float64)
+            )
+    return codes
+
+
+def _add_new_categories(data_frame: pd.DataFrame, pipeline: dict) -> None:
+    """Adds raw values of the categorical columns of `data_frame` that the pipeline has never seen to the end of their
+    categories, so they get codes of their own instead of the code of a missing value.
+    """
+    data_frame = convert_columns_to_correct_types(data_frame.copy(deep=False))
+    for column, categories in pipeline["categories"].items():
+        if column not in data_frame.columns:
+            continue
+        values = pd.Index(data_frame[column].dropna().unique())
+        new_values = values[pd.Index(categories).get_indexer(values) == -1]
+        categories.extend(sorted(new_values.tolist()))
+
+
+def _add_new_states(training_df: pd.DataFrame, pipeline: dict) -> None:
+    """Adds values of `training_df` that the pipeline has never seen to the end of the states of their nodes, padding
+    the counts with zeros to match."""
+    node_states = pipeline["node_states"]
+    old_cardinalities = get_cardinalities(node_states)
+    for node, states in node_states.items():
+        if node not in training_df.columns:
+            continue
+        known = {float(state) for state in states}
+        integer_states = all(
+            float(state).is_integer() and "." not in state for state in states
+        )
+        for value in sorted(training_df[node].dropna().unique()):
+            if float(value) not in known:
+                states.append(str(int(value)) if integer_states else str(float(value)))
+    cardinalities = get_cardinalities(node_states)
+    if np.array_equal(cardinalities, old_cardinalities):
+        return
+
+    parents = get_parents(pipeline["directed_edge_list"])
+    for node, counts in pipeline["family_counts"].items():
+        if isinstance(counts, dict):
+            # Sparse counts only need room for the node's own new states, its parents' codes don't change
+            pipeline["family_counts"][node] = {
+                "parent_codes": counts["parent_codes"],
+                "counts": np.pad(
+                    counts["counts"],
+                    [(0, 0), (0, len(node_states[node]) - counts["counts"].shape[1])],
+                ),
+            }
+            continue
+        family = parents.get(node, []) + [node]
+        pipeline["family_counts"][node] = np.pad(
+            counts,
+            [(0, len(node_states[v]) - size) for v, size in zip(family, counts.shape)],
+        )
+    old_offsets = np.concatenate([[0], np.cumsum(old_cardinalities)[:-1]])
+    new_offsets = np.concatenate([[0], np.cumsum(cardinalities)[:-1]])
+    old_positions = np.concatenate(
+        [
+            np.arange(new_offset, new_offset + cardinality)
+            for new_offset, cardinality in zip(new_offsets, old_cardinalities)
+        ]
+    )
+    joint_counts = np.zeros((cardinalities.sum(), cardinalities.sum()))
+    joint_counts[np.ix_(old_positions, old_positions)] = pipeline["joint_counts"]
+    pipeline["joint_counts"] = joint_counts
+
+
+@profiled
+def update_pipeline(
+    pipeline: dict,
+    data_frame: pd.DataFrame,
+    check_structure: bool = True,
+    n_jobs: int = 1,
+) -> bool:
+    """Adds a new batch of patients to a fitted pipeline in place. The batch is preprocessed with the pipeline's bin
+    edges and categories, its counts are added to the pipeline's counts, and the CPTs are normalised again from the
+    sums. Categories never seen before are added to the pipeline's categories, and they and bins no patient fell in
+    before become new states of their nodes. Numbers outside of the pipeline's bin edges are left out of the counts,
+    as missing values are, since the edges are fixed at fitting. The work grows with the size of the batch and the
+    number of states, never with the number of patients already in the pipeline.
+
+    The structure isn't changed, since the counts of the new families would need the old data, but the updated mutual
+    information can be checked against it. The "version" of the pipeline goes up by one, so engines compiled before the
+    update are no longer used by score_data(). Rebuild the inference engine, passing on its cache to have the cache
+    cleared, or the pomegranate states with `utils.graphs.probability.get_pomegranate_states_from_cpts` and the
+    "cpts", after updating.
+
+    Args:
+        pipeline (dict): The fitted pipeline, as output by fit_pipeline().
+        data_frame (pd.DataFrame): The raw data of the new patients.
+        check_structure (bool): Whether to check if the maximum spanning tree of the updated mutual information is
+            still the pipeline's tree.
+        n_jobs (int): The number of threads to count the mutual information over and of processes to count the
+            families of the nodes over.
+
+    Returns: True if `check_structure` is set and the maximum spanning tree has changed, so the pipeline should be
+        refit on all of the data, otherwise False.
+
+    """
+    _add_new_categories(data_frame, pipeline)
+    training_df = transform_data(data_frame, pipeline, unknown_values="missing")
+    _add_new_states(training_df, pipeline)
+    node_states = pipeline["node_states"]
+    codes = _encode_node_states(training_df, node_states)
+
+    parents = get_parents(pipeline["directed_edge_list"])
+    parents.update({node: [] for node in node_states if node not in parents})
+    family_counts = _get_pipeline_family_counts(
+        codes, node_states, parents, n_jobs, pipeline.get("sparse", False)
+    )
+    for node, counts in family_counts.items():
+        if isinstance(counts, dict):
+            pipeline["family_counts"][node] = merge_sparse_contingency_tables(
+                pipeline["family_counts"][node], counts
+            )
+        else:
+            pipeline["family_counts"][node] = pipeline["family_counts"][node] + counts
+        pipeline["cpts"][node] = _get_cpt(
+            pipeline["family_counts"][node], pipeline, node
+        )
+    pipeline["joint_counts"] = pipeline["joint_counts"] + get_joint_counts(
+        codes, get_cardinalities(node_states), n_jobs=n_jobs
+    )
+    pipeline["version"] = pipeline.get("version", 0) + 1
+
+    if not check_structure:
+        return False
+    graph = get_spanning_tree(pipeline["joint_counts"], node_states)
+    return {frozenset(edge) for edge in graph.edges} != {
+        frozenset(edge) for edge in pipeline["directed_edge_list"]
+    }
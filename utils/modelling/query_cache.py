@@ -0,0 +1,186 @@
+"""
+This module is for caching the answers to queries. Every node is binned in to a handful of states, so most scoring
+requests repeat a small number of evidence patterns, and a bounded cache in front of querying answers them without
+running inference again.
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List
+
+import pandas as pd
+
+_MISSING = object()
+
+
+class QueryCache:
+    """A bounded cache of query results, evicting the least recently used ("lru") or least frequently used ("lfu")
+    result when full, and counting its hits, misses, evictions and invalidations.
+
+    The cache is tied to the model its results came from through validate(): passing a different model, or a
+    different version of the same model, clears it.
+
+    Args:
+        maxsize (int): The most results to keep.
+        policy (str): Which result to evict when full, "lru" or "lfu". Ties in "lfu" evict the least recently used.
+    """
+
+    def __init__(self, maxsize: int = 1024, policy: str = "lru"):
+        if policy not in ("lru", "lfu"):
+            raise ValueError(f'`policy` must be "lru" or "lfu", not "{policy}"')
+        self.maxsize = maxsize
+        self.policy = policy
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._model = None
+        self._results = OrderedDict()
+        # For "lfu", the use count of every key and the keys with each use count, least recently used first
+        self._counts = dict()
+        self._keys_by_count = dict()
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._results
+
+    def validate(self, model: Any) -> None:
+        """Clears the cache if its results came from a model other than `model`.
+
+        Args:
+            model: The model, or a token identifying the model and its version, that results are now coming from.
+
+        """
+        if self._model is not None and self._model != model:
+            self.clear()
+            self.invalidations += 1
+        self._model = model
+
+    def clear(self) -> None:
+        """Throws away every result, keeping the counters."""
+        self._results.clear()
+        self._counts.clear()
+        self._keys_by_count.clear()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Gets the result of a query, counting a hit or a miss.
+
+        Args:
+            key (Hashable): The normalised evidence of the query.
+            default: What to return if the result isn't in the cache.
+
+        Returns: The cached result, or `default`.
+
+        """
+        result = self._results.get(key, _MISSING)
+        if result is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._use(key)
+        return result
+
+    def put(self, key: Hashable, result: Any) -> None:
+        """Caches the result of a query, evicting another result if the cache is full.
+
+        Args:
+            key (Hashable): The normalised evidence of the query.
+            result: The result of the query.
+
+        """
+        if self.maxsize <= 0:
+            return
+        if key in self._results:
+            self._results[key] = result
+            self._use(key)
+            return
+        if len(self._results) >= self.maxsize:
+            self._evict()
+        self._results[key] = result
+        if self.policy == "lfu":
+            self._counts[key] = 1
+            self._keys_by_count.setdefault(1, OrderedDict())[key] = None
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Gets the result of a query from the cache, or computes and caches it on a miss.
+
+        Args:
+            key (Hashable): The normalised evidence of the query.
+            compute (Callable): Computes the result of the query.
+
+        Returns: The result of the query.
+
+        """
+        result = self.get(key, _MISSING)
+        if result is _MISSING:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns: The counters of the cache, with its current and maximum size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self._results),
+            "maxsize": self.maxsize,
+        }
+
+    def _use(self, key: Hashable) -> None:
+        if self.policy == "lru":
+            self._results.move_to_end(key)
+            return
+        count = self._counts[key]
+        del self._keys_by_count[count][key]
+        if not self._keys_by_count[count]:
+            del self._keys_by_count[count]
+        self._counts[key] = count + 1
+        self._keys_by_count.setdefault(count + 1, OrderedDict())[key] = None
+
+    def _evict(self) -> None:
+        if self.policy == "lru":
+            self._results.popitem(last=False)
+        else:
+            lowest_count = min(self._keys_by_count)
+            key, _ = self._keys_by_count[lowest_count].popitem(last=False)
+            if not self._keys_by_count[lowest_count]:
+                del self._keys_by_count[lowest_count]
+            del self._counts[key]
+            del self._results[key]
+        self.evictions += 1
+
+
+def get_frequent_queries(
+    data: pd.DataFrame, target: str, n_queries: int = 100
+) -> List[dict]:
+    """Finds the most frequent evidence patterns in the training data, for warming a cache with the queries most likely
+    to come in.
+
+    Args:
+        data (pd.DataFrame): The training data, with a column per node.
+        target (str): The node being predicted, which is left out of the evidence.
+        n_queries (int): The number of patterns to return.
+
+    Returns: The queries, most frequent first, with the value of every node as a string, None for missing values and
+        the target.
+
+    """
+    evidence = data.drop(columns=target)
+    # Going through object keeps the integer states of categorical columns from becoming "0.0"
+    patterns = (
+        evidence.astype(object)
+        .astype("string")
+        .value_counts(dropna=False)
+        .head(n_queries)
+    )
+    queries = []
+    for pattern in patterns.index:
+        query = {
+            node: None if pd.isna(value) else str(value)
+            for node, value in zip(evidence.columns, pattern)
+        }
+        query[target] = None
+        queries.append(query)
+    return queries
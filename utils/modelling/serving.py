@@ -0,0 +1,457 @@
+"""
+This module is for serving a fitted pipeline to other services. The server is a small HTTP/1.1 server on asyncio, over
+TCP or a Unix socket, that loads the pipeline once and answers `POST /score` with the posterior of the target for each
+patient sent. Requests that arrive close together are coalesced in to micro-batches, each scored with one vectorised
+call to the inference engine in a worker thread, so the event loop keeps accepting requests while inference runs.
+`GET /stats` reports the latency percentiles and throughput of the server, and `GET /health` that it is up.
+"""
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import json
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.modelling.pipeline import get_pipeline_inference_engine
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+def get_pipeline_columns(pipeline: dict) -> List[str]:
+    """Returns: The raw columns a pipeline scores from, the numeric columns it bins and the categorical columns it
+    codes, without the target."""
+    columns = list(pipeline["bin_edges"]) + list(pipeline["categories"])
+    return [column for column in columns if column != pipeline["target"]]
+
+
+def get_rows_encoder(
+    pipeline: dict, nodes: Optional[List[str]] = None
+) -> Callable[[List[dict]], np.ndarray]:
+    """Precompiles the lookups from the raw values of each column the pipeline scores from to the states of its node,
+    the bin edges of the numeric columns and the state of every category, and gives a function that codes patients
+    sent as JSON objects straight in to evidence for `utils.modelling.inference.ExactInferenceEngine.score`, without
+    building a pd.DataFrame. Numeric values that aren't numbers or are outside of the pipeline's bin edges, and
+    categories the pipeline has never seen, raise a ValueError naming the column and the values, so a request with them
+    is answered with a 400 rather than scored as if they were missing.
+
+    Args:
+        pipeline (dict): The fitted pipeline.
+        nodes (List[str], optional): The order of the nodes in the codes, the `nodes` of the pipeline's engine.
+            Defaults to the order of the pipeline's "node_states".
+
+    Returns: A function from a list of patients, each a dictionary of raw column to value with nulls or missing keys
+        for unknown values, to their codes as a 2-d array with a column per node and -1 for unobserved nodes.
+
+    """
+    nodes = list(pipeline["node_states"]) if nodes is None else list(nodes)
+    target = pipeline["target"]
+    numeric_lookups = []
+    for column, edges in pipeline["bin_edges"].items():
+        node = f"{column}_{pipeline['bins']}bin"
+        if column == target or node not in nodes:
+            continue
+        # The state of each bin, -1 for bins no patient fell in when the pipeline was fit
+        bin_states = pd.Index(pipeline["node_states"][node]).get_indexer(
+            [str(i) for i in range(len(edges) - 1)]
+        )
+        numeric_lookups.append(
+            (column, nodes.index(node), np.asarray(edges, dtype=np.float64), bin_states)
+        )
+    categorical_lookups = []
+    for column, categories in pipeline["categories"].items():
+        if column == target or column not in nodes:
+            continue
+        category_states = pd.Index(pipeline["node_states"][column]).get_indexer(
+            [str(i) for i in range(len(categories))]
+        )
+        lookup = {
+            str(category): state
+            for category, state in zip(categories, category_states)
+            if state >= 0
+        }
+        categorical_lookups.append((column, nodes.index(column), lookup))
+
+    def encode_rows(rows: List[dict]) -> np.ndarray:
+        codes = np.full((len(rows), len(nodes)), -1, dtype=np.int16)
+        errors = []
+        for column, j, edges, bin_states in numeric_lookups:
+            values = np.full(len(rows), np.nan)
+            not_numbers = set()
+            for i, row in enumerate(rows):
+                value = row.get(column)
+                if value is None:
+                    continue
+                try:
+                    values[i] = float(value)
+                except (TypeError, ValueError):
+                    not_numbers.add(str(value))
+            if not_numbers:
+                errors.append(
+                    f"`{column}` has values {sorted(not_numbers)} that are not numbers"
+                )
+            present = ~np.isnan(values)
+            # Every bin is closed on the right, as in `utils.preprocessing.generic_preprocessing.get_bin_codes`
+            bins = np.searchsorted(edges, values, side="left") - 1
+            outside = present & ((bins < 0) | (bins >= len(bin_states)))
+            if outside.any():
+                errors.append(
+                    f"`{column}` has values {sorted(set(map(str, values[outside])))} outside of the bin edges of the "
+                    f"pipeline, from {edges[0]} to {edges[-1]}"
+                )
+            inside = present & ~outside
+            states = bin_states[bins[inside]]
+            if (states < 0).any():
+                errors.append(
+                    f"`{column}` has values {sorted(set(map(str, values[inside][states < 0])))} in bins no patient "
+                    "fell in when the pipeline was fit"
+                )
+            codes[inside, j] = states
+        for column, j, lookup in categorical_lookups:
+            unknown = set()
+            for i, row in enumerate(rows):
+                value = row.get(column)
+                if value is None or (isinstance(value, float) and np.isnan(value)):
+                    continue
+                state = lookup.get(str(value))
+                if state is None:
+                    unknown.add(str(value))
+                else:
+                    codes[i, j] = state
+            if unknown:
+                errors.append(
+                    f"`{column}` has values {sorted(unknown)} that are not categories of the pipeline, expected one "
+                    f"of {list(lookup)}"
+                )
+        if errors:
+            raise ValueError("; ".join(errors))
+        return codes
+
+    return encode_rows
+
+
+def rows_to_data_frame(rows: List[dict], pipeline: dict) -> pd.DataFrame:
+    """Turns patients sent as JSON objects in to raw data the pipeline can score. Columns the pipeline uses that none of
+    the patients have are added as missing, and the numeric columns are made numeric, so patients sent with nulls
+    don't turn a column in to objects. Values the pipeline can't score raise a ValueError, see get_rows_encoder().
+
+    Args:
+        rows (List[dict]): The patients, each a dictionary of raw column to value, with nulls or missing keys for
+            unknown values.
+        pipeline (dict): The fitted pipeline.
+
+    Returns: The patients as a pd.DataFrame with a row per patient.
+
+    """
+    get_rows_encoder(pipeline)(rows)
+    data_frame = pd.DataFrame.from_records(rows, columns=get_pipeline_columns(pipeline))
+    for column in pipeline["bin_edges"]:
+        if column in data_frame.columns:
+            data_frame[column] = pd.to_numeric(data_frame[column], errors="coerce")
+    return data_frame
+
+
+class MicroBatcher:
+    """Coalesces concurrent scoring requests in to micro-batches. A batch is sent for scoring when it holds
+    `max_batch_size` rows or `max_latency` seconds after its first request arrived, whichever comes first, and is scored
+    in a worker thread. If a batch fails, its requests are scored one at a time so only the bad requests fail.
+
+    Args:
+        score_batch (Callable[[List[dict]], List[dict]]): Scores a list of rows, giving a result per row.
+        max_batch_size (int): The most rows to score at once.
+        max_latency (float): The longest time in seconds a request waits for others to join its batch.
+        n_workers (int): The number of threads to score batches in.
+        window (int): The number of recent requests to work out the latency percentiles from.
+    """
+
+    def __init__(
+        self,
+        score_batch: Callable[[List[dict]], List[dict]],
+        max_batch_size: int = 64,
+        max_latency: float = 0.005,
+        n_workers: int = 1,
+        window: int = 10_000,
+    ):
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency
+        self.n_workers = n_workers
+        self._executor = ThreadPoolExecutor(n_workers)
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._latencies = deque(maxlen=window)
+        self._requests = 0
+        self._rows = 0
+        self._batches = 0
+        self._errors = 0
+        self._start = time.perf_counter()
+
+    async def start(self) -> None:
+        """Starts collecting batches, must be called from the event loop that requests come in on."""
+        self._queue = asyncio.Queue()
+        self._start = time.perf_counter()
+        # One collector per worker, so a batch can be collected while another is being scored
+        self._tasks = [
+            asyncio.ensure_future(self._collect()) for _ in range(self.n_workers)
+        ]
+
+    async def stop(self) -> None:
+        """Stops collecting batches and shuts down the worker threads."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._executor.shutdown(wait=True)
+
+    async def score(self, rows: List[dict]) -> List[dict]:
+        """Scores some rows as part of the next batch.
+
+        Args:
+            rows (List[dict]): The rows to score.
+
+        Returns: The result of each row.
+
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((rows, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            n_rows = len(batch[0][0])
+            deadline = loop.time() + self.max_latency
+            while n_rows < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(request)
+                n_rows += len(request[0])
+            await self._run(batch)
+
+    async def _run(self, batch: List[Tuple[List[dict], asyncio.Future, float]]) -> None:
+        loop = asyncio.get_running_loop()
+        rows = [row for request_rows, _, _ in batch for row in request_rows]
+        try:
+            results = await loop.run_in_executor(self._executor, self.score_batch, rows)
+            outcomes = []
+            start = 0
+            for request_rows, _, _ in batch:
+                outcomes.append(results[start : start + len(request_rows)])
+                start += len(request_rows)
+        except Exception as error:
+            if len(batch) == 1:
+                outcomes = [error]
+            else:
+                outcomes = []
+            for request_rows, _, _ in batch[len(outcomes) :]:
+                try:
+                    outcomes.append(
+                        await loop.run_in_executor(
+                            self._executor, self.score_batch, request_rows
+                        )
+                    )
+                except Exception as request_error:
+                    outcomes.append(request_error)
+        self._batches += 1
+        finished = time.perf_counter()
+        for (request_rows, future, arrived), outcome in zip(batch, outcomes):
+            self._requests += 1
+            self._rows += len(request_rows)
+            self._latencies.append(finished - arrived)
+            if future.cancelled():
+                continue
+            if isinstance(outcome, Exception):
+                self._errors += 1
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    def get_stats(self) -> Dict[str, float]:
+        """Returns: The number of requests, rows, batches and errors so far, the mean rows per batch, the 50th and 99th
+        percentile latency in milliseconds of recent requests and the throughput in requests and rows per second since
+        the batcher started."""
+        elapsed = time.perf_counter() - self._start
+        latencies = np.array(self._latencies) * 1000
+        return {
+            "requests": self._requests,
+            "rows": self._rows,
+            "batches": self._batches,
+            "errors": self._errors,
+            "mean_batch_rows": self._rows / self._batches if self._batches else 0.0,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else 0.0,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else 0.0,
+            "requests_per_second": self._requests / elapsed if elapsed > 0 else 0.0,
+            "rows_per_second": self._rows / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+def get_pipeline_batch_scorer(pipeline: dict) -> Callable[[List[dict]], List[dict]]:
+    """Compiles a pipeline's inference engine and the lookups of get_rows_encoder() once, and gives a function that
+    scores a batch of patients with them, coding the patients straight in to evidence for the engine.
+
+    Args:
+        pipeline (dict): The fitted pipeline.
+
+    Returns: A function from a list of patients, as JSON objects, to the posterior of the target of each, as a
+        dictionary of state to probability, with nulls for patients whose evidence has zero probability. States of a
+        categorical target are given as their original categories.
+
+    """
+    engine = get_pipeline_inference_engine(pipeline)
+    encode_rows = get_rows_encoder(pipeline, engine.nodes)
+    target = pipeline["target"]
+    categories = pipeline["categories"].get(target, [])
+    labels = [
+        str(categories[int(state)]) if 0 <= int(state) < len(categories) else state
+        for state in engine.states[target]
+    ]
+
+    def score_batch(rows: List[dict]) -> List[dict]:
+        posteriors = engine.score(encode_rows(rows), target).to_numpy()
+        # NaN isn't valid JSON, so rows whose evidence has zero probability get nulls
+        possible = posteriors.sum(axis=1) > 0
+        return [
+            dict(zip(labels, row)) if row_possible else dict.fromkeys(labels)
+            for row, row_possible in zip(posteriors.tolist(), possible)
+        ]
+
+    return score_batch
+
+
+async def _read_request(
+    reader: asyncio.StreamReader,
+) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    """Reads one HTTP request, giving None when the client has closed the connection."""
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode("latin-1").split(" ", 2)
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    return method, path, headers, body
+
+
+def _write_response(writer: asyncio.StreamWriter, status: int, payload) -> None:
+    body = json.dumps(payload).encode("utf-8")
+    writer.write(
+        f"HTTP/1.1 {status} {_REASONS[status]}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n".encode("latin-1") + body
+    )
+
+
+async def _handle_connection(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, batcher: MicroBatcher
+) -> None:
+    """Answers the requests of one keep-alive connection in turn."""
+    try:
+        while True:
+            try:
+                request = await _read_request(reader)
+            except (ValueError, asyncio.IncompleteReadError):
+                _write_response(writer, 400, {"error": "malformed request"})
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            status, payload = await _route(method, path, body, batcher)
+            _write_response(writer, status, payload)
+            await writer.drain()
+            if headers.get("connection", "").lower() == "close":
+                break
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def _route(
+    method: str, path: str, body: bytes, batcher: MicroBatcher
+) -> Tuple[int, object]:
+    if path == "/health":
+        return 200, {"status": "ok"}
+    if path == "/stats":
+        return 200, batcher.get_stats()
+    if path != "/score":
+        return 404, {"error": f"no route {path}"}
+    if method != "POST":
+        return 405, {"error": "use POST to score"}
+    try:
+        request = json.loads(body)
+    except ValueError:
+        return 400, {"error": "the body must be JSON"}
+    single = isinstance(request, dict) and "rows" not in request
+    if single:
+        rows = [request]
+    elif isinstance(request, dict):
+        rows = request["rows"]
+    else:
+        rows = request
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        return 400, {"error": 'send a patient, a list of patients or {"rows": [...]}'}
+    if not rows:
+        return 200, {"scores": []}
+    try:
+        scores = await batcher.score(rows)
+    except (KeyError, TypeError, ValueError) as error:
+        return 400, {"error": str(error)}
+    except Exception as error:
+        return 500, {"error": repr(error)}
+    return 200, scores[0] if single else {"scores": scores}
+
+
+async def start_scoring_server(
+    pipeline: dict,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    unix_socket: Optional[str] = None,
+    max_batch_size: int = 64,
+    max_latency: float = 0.005,
+    n_workers: int = 1,
+) -> Tuple[asyncio.AbstractServer, MicroBatcher]:
+    """Starts serving a fitted pipeline on the running event loop.
+
+    Args:
+        pipeline (dict): The fitted pipeline, see `utils.modelling.pipeline.fit_pipeline`.
+        host (str): The address to listen on.
+        port (int): The port to listen on, 0 for any free port.
+        unix_socket (str, optional): Listen on this Unix socket instead of `host` and `port`.
+        max_batch_size (int): The most rows to score at once.
+        max_latency (float): The longest time in seconds a request waits for others to join its batch.
+        n_workers (int): The number of threads to score batches in.
+
+    Returns: A tuple of the server and its micro-batcher, stop the batcher after closing the server.
+
+    """
+    batcher = MicroBatcher(
+        get_pipeline_batch_scorer(pipeline), max_batch_size, max_latency, n_workers
+    )
+    await batcher.start()
+
+    async def handle(reader, writer):
+        await _handle_connection(reader, writer, batcher)
+
+    if unix_socket is not None:
+        server = await asyncio.start_unix_server(handle, unix_socket)
+    else:
+        server = await asyncio.start_server(handle, host, port)
+    return server, batcher
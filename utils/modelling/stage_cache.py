@@ -0,0 +1,305 @@
+"""
+This module is for caching the outputs of the stages of the runner on disk, so a rerun that only changes a later stage,
+such as the target or the query, reloads the binned data, mutual information, tree and counts instead of working them
+out again. Every output is stored under the fingerprint of everything it was computed from: the data, the parameters of
+its stage and the fingerprint of the stage before it. Changing any of them gives a new fingerprint, so a stale output is
+never read back, and old outputs are evicted least recently used first once the cache is over its size limit.
+
+An output is stored as an uncompressed .npz file, one array per array, DataFrame column or categorical's codes in its
+own dtype, with a JSON header holding everything else and where each array goes, so nothing is pickled.
+"""
+import hashlib
+import json
+import os
+import time
+import zipfile
+from typing import Any, Callable, Dict, List, Union
+
+import numpy as np
+import pandas as pd
+
+_MISSING = object()
+_HEADER = "header"
+_SUFFIX = ".npz"
+
+
+def _update_column_fingerprint(file_hash, values: Union[pd.Series, pd.Index]) -> None:
+    """Feeds a column in to the hash: the bytes of a numpy column, the codes and categories of a categorical, and the
+    codes and distinct values, in order of appearance, of any other column, which is much faster than hashing every
+    string."""
+    file_hash.update(f"column{values.dtype}{len(values)}".encode("utf-8"))
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        _update_fingerprint(file_hash, values.cat.codes.to_numpy())
+        _update_fingerprint(file_hash, list(values.cat.categories))
+    elif isinstance(values.dtype, np.dtype) and values.dtype.kind in "biufcmM":
+        _update_fingerprint(file_hash, values.to_numpy())
+    else:
+        codes, uniques = pd.factorize(values)
+        _update_fingerprint(file_hash, codes)
+        _update_fingerprint(file_hash, list(uniques))
+
+
+def _update_fingerprint(file_hash, value: Any) -> None:
+    """Feeds `value` in to the hash, tagging each kind of value so different values never give the same bytes."""
+    if isinstance(value, pd.DataFrame):
+        file_hash.update(b"frame")
+        _update_fingerprint(file_hash, [str(column) for column in value.columns])
+        if isinstance(value.index, pd.RangeIndex):
+            _update_fingerprint(file_hash, value.index)
+        else:
+            _update_column_fingerprint(file_hash, value.index)
+        for column in value.columns:
+            _update_column_fingerprint(file_hash, value[column])
+    elif isinstance(value, pd.Series):
+        _update_fingerprint(file_hash, value.to_frame())
+    elif isinstance(value, np.ndarray):
+        file_hash.update(f"array{value.dtype.str}{value.shape}".encode("utf-8"))
+        file_hash.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        file_hash.update(f"dict{len(value)}".encode("utf-8"))
+        for key, item in value.items():
+            _update_fingerprint(file_hash, key)
+            _update_fingerprint(file_hash, item)
+    elif isinstance(value, (list, tuple)):
+        file_hash.update(f"list{len(value)}".encode("utf-8"))
+        for item in value:
+            _update_fingerprint(file_hash, item)
+    else:
+        file_hash.update(f"{type(value).__name__}:{value!r};".encode("utf-8"))
+
+
+def get_fingerprint(*inputs: Any) -> str:
+    """Gets the fingerprint of the inputs of a stage, the SHA-256 of their contents, so the same inputs always give the
+    same fingerprint and any change to them gives a new one.
+
+    Args:
+        *inputs: The stage's name, its data, its parameters and the fingerprints of the stages it depends on. Data can
+            be pd.DataFrames, pd.Series or np.ndarrays, and parameters dictionaries, lists or plain values.
+
+    Returns: The fingerprint as a hex string.
+
+    """
+    file_hash = hashlib.sha256()
+    _update_fingerprint(file_hash, list(inputs))
+    return file_hash.hexdigest()
+
+
+def _pack(value: Any, arrays: List[np.ndarray]) -> Any:
+    """Turns `value` in to something JSON can hold, moving its arrays in to `arrays` and recording their positions."""
+    if isinstance(value, pd.DataFrame):
+        index = value.index
+        return {
+            "__frame__": {
+                "columns": [_pack(column, arrays) for column in value.columns],
+                "data": [_pack(value[column], arrays) for column in value.columns],
+                "index": (
+                    {"__range__": [index.start, index.stop, index.step]}
+                    if isinstance(index, pd.RangeIndex)
+                    else _pack(index.to_numpy(), arrays)
+                ),
+            }
+        }
+    if isinstance(value, pd.Series):
+        if isinstance(value.dtype, pd.CategoricalDtype):
+            return {
+                "__categorical__": {
+                    "codes": _pack(value.cat.codes.to_numpy(), arrays),
+                    "categories": _pack(list(value.cat.categories), arrays),
+                }
+            }
+        return _pack(value.to_numpy(), arrays)
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return {"__list__": _pack(value.tolist(), arrays)}
+        arrays.append(value)
+        return {"__array__": len(arrays) - 1}
+    if isinstance(value, dict):
+        return {
+            "__dict__": [
+                [_pack(key, arrays), _pack(item, arrays)] for key, item in value.items()
+            ]
+        }
+    if isinstance(value, (list, tuple)):
+        return [_pack(item, arrays) for item in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _unpack(value: Any, arrays: Dict[str, np.ndarray]) -> Any:
+    """Rebuilds a value packed by _pack() from its JSON and its arrays."""
+    if isinstance(value, list):
+        return [_unpack(item, arrays) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if "__array__" in value:
+        return arrays[f"array_{value['__array__']}"]
+    if "__list__" in value:
+        return np.array(_unpack(value["__list__"], arrays), dtype=object)
+    if "__dict__" in value:
+        return {
+            _unpack(key, arrays): _unpack(item, arrays)
+            for key, item in value["__dict__"]
+        }
+    if "__categorical__" in value:
+        return pd.Categorical.from_codes(
+            _unpack(value["__categorical__"]["codes"], arrays),
+            categories=_unpack(value["__categorical__"]["categories"], arrays),
+        )
+    frame = value["__frame__"]
+    index = frame["index"]
+    return pd.DataFrame(
+        {
+            column: _unpack(data, arrays)
+            for column, data in zip(_unpack(frame["columns"], arrays), frame["data"])
+        },
+        index=(
+            pd.RangeIndex(*index["__range__"])
+            if isinstance(index, dict) and "__range__" in index
+            else _unpack(index, arrays)
+        ),
+    )
+
+
+class StageCache:
+    """A cache of stage outputs in a directory on disk, holding at most `max_bytes` of them and evicting the least
+    recently used output first, and counting its hits, misses and evictions. The directory can be shared by any number
+    of runs, since outputs are only ever read back under the fingerprint of the inputs they came from.
+
+    Args:
+        directory (str): The directory to keep the outputs in, made if it doesn't exist.
+        max_bytes (int): The most bytes of outputs to keep. Defaults to 1 GiB.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def __contains__(self, key: str) -> bool:
+        return os.path.exists(self._get_location(key))
+
+    def _get_location(self, key: str) -> str:
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Loads the output stored under a fingerprint, counting a hit or a miss, and marks it as recently used. A file
+        that can't be read back, truncated or not written by a StageCache, is removed and counted as a miss.
+
+        Args:
+            key (str): The fingerprint of the stage's inputs, see get_fingerprint().
+            default: What to return if the output isn't in the cache.
+
+        Returns: The output, or `default`.
+
+        """
+        location = self._get_location(key)
+        try:
+            with np.load(location, allow_pickle=False) as file:
+                arrays = {name: file[name] for name in file.files}
+            header = json.loads(arrays.pop(_HEADER).tobytes().decode("utf-8"))
+            output = _unpack(header, arrays)
+        except FileNotFoundError:
+            self.misses += 1
+            return default
+        except (zipfile.BadZipFile, EOFError, ValueError, KeyError):
+            try:
+                os.remove(location)
+            except FileNotFoundError:
+                pass
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._touch(location)
+        return output
+
+    def put(self, key: str, output: Any) -> None:
+        """Stores the output of a stage under the fingerprint of its inputs, evicting the least recently used outputs
+        if the cache goes over its size limit.
+
+        Args:
+            key (str): The fingerprint of the stage's inputs, see get_fingerprint().
+            output: The output, made of pd.DataFrames, np.ndarrays, dictionaries, lists and plain values.
+
+        """
+        arrays = []
+        header = json.dumps(_pack(output, arrays)).encode("utf-8")
+        location = self._get_location(key)
+        # Write to a temporary file first, so another run never reads a half written output
+        temporary_location = f"{location}.{os.getpid()}.tmp{_SUFFIX}"
+        np.savez(
+            temporary_location,
+            **{_HEADER: np.frombuffer(header, dtype=np.uint8)},
+            **{f"array_{i}": array for i, array in enumerate(arrays)},
+        )
+        os.replace(temporary_location, location)
+        self._touch(location)
+        self._evict(keep=location)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Loads the output of a stage from the cache, or computes and caches it on a miss.
+
+        Args:
+            key (str): The fingerprint of the stage's inputs, see get_fingerprint().
+            compute (Callable): Computes the output of the stage.
+
+        Returns: The output of the stage.
+
+        """
+        output = self.get(key, _MISSING)
+        if output is _MISSING:
+            output = compute()
+            self.put(key, output)
+        return output
+
+    def get_stats(self) -> Dict[str, int]:
+        """Returns: The counters of the cache, with the number and total bytes of the outputs it holds."""
+        files = self._get_files()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(files),
+            "bytes": sum(size for _, size, _ in files),
+            "max_bytes": self.max_bytes,
+        }
+
+    @staticmethod
+    def _touch(location: str) -> None:
+        """Marks an output as just used, to the nanosecond, since file times are otherwise only as fine as the clock
+        tick of the file system."""
+        now = time.time_ns()
+        os.utime(location, ns=(now, now))
+
+    def _get_files(self) -> List[tuple]:
+        """The location, size and last use of every stored output, least recently used first."""
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(_SUFFIX) or ".tmp" in name:
+                continue
+            location = os.path.join(self.directory, name)
+            try:
+                status = os.stat(location)
+            except FileNotFoundError:
+                continue
+            files.append((location, status.st_size, status.st_mtime_ns))
+        return sorted(files, key=lambda file: file[2])
+
+    def _evict(self, keep: str) -> None:
+        """Deletes the least recently used outputs until the cache is within its size limit, never deleting `keep`."""
+        files = self._get_files()
+        total = sum(size for _, size, _ in files)
+        for location, size, _ in files:
+            if total <= self.max_bytes:
+                break
+            if location == keep:
+                continue
+            try:
+                os.remove(location)
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
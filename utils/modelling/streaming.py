@@ -0,0 +1,292 @@
+"""
+This module is for training the Bayes net from a .csv file a chunk at a time. Only count tables are held in memory, so
+the size of the data is bounded by disk rather than memory. The file is read three times: once to fix the bin edges and
+categories, once to count the pairs of variables for the mutual information matrix, and once to count the family of
+each node in the learned graph for its probability distribution.
+"""
+from typing import Dict, List, Optional, Tuple
+
+import networkx as nx
+from networkx.algorithms import tree
+import numpy as np
+import pandas as pd
+
+from utils.graphs.mutual_information import (
+    get_joint_counts,
+    get_mutual_information_from_joint_counts,
+    mutual_information_to_data_frame,
+)
+from utils.graphs.counting import get_contingency_table
+from utils.graphs.probability import get_pomegranate_states_from_counts
+from utils.graphs.structuring import get_directed_edges, get_parents
+from utils.load.data_importing import import_csv_data_in_chunks
+from utils.modelling.pipeline import transform_data
+from utils.preprocessing.bespoke_preprocessing import convert_columns_to_correct_types
+from utils.preprocessing.binning import (
+    get_quantile_sketch,
+    get_sketch_bin_edges,
+    merge_quantile_sketches,
+)
+from utils.preprocessing.generic_preprocessing import (
+    get_bin_edges,
+    reduce_data_frame_to_numeric_columns,
+)
+from utils.profiling import profiled
+
+
+@profiled
+def get_streaming_schema(
+    file_location: str,
+    bins: int = 5,
+    unique_value_limit: int = 15,
+    chunksize: int = 100_000,
+    bin_edges: Optional[Dict[str, np.ndarray]] = None,
+    binning: str = "uniform",
+) -> dict:
+    """Makes a first pass over the .csv file to fix everything the in-memory preprocessing would take from the whole
+    data: the bin edges of the numeric columns, which columns are categorical and the categories of each.
+
+    Args:
+        file_location (str): The .csv file location.
+        bins (int): The number of bins to use for numeric columns.
+        unique_value_limit (int): Maximum number of categories in categorical variables.
+        chunksize (int): The number of rows to read at once.
+        bin_edges (Dict[str, np.ndarray], optional): Bin edges to use for numeric columns instead of the ones found
+            from their range.
+        binning (str): "uniform" for equal width bins or "quantile" for approximately equal frequency bins, found from
+            a quantile sketch of each chunk, see `utils.preprocessing.binning`.
+
+    Returns: The schema as a dictionary with keys "bins", "bin_edges", "categories" and "node_values", where
+        "node_values" gives the values each node of the training data can take, in code order.
+
+    """
+    if binning not in ("uniform", "quantile"):
+        raise ValueError(
+            f'`binning` must be "uniform" or "quantile" when streaming, not "{binning}"'
+        )
+    columns = None
+    numeric_columns = None
+    minimums, maximums = dict(), dict()
+    sketches = dict()
+    uniques = dict()
+    for chunk in import_csv_data_in_chunks(file_location, chunksize):
+        chunk = convert_columns_to_correct_types(chunk)
+        if columns is None:
+            columns = list(chunk.columns)
+            uniques = {column: set() for column in columns}
+        chunk_numeric_columns = list(
+            reduce_data_frame_to_numeric_columns(chunk).columns
+        )
+        numeric_columns = (
+            set(chunk_numeric_columns)
+            if numeric_columns is None
+            else numeric_columns.intersection(chunk_numeric_columns)
+        )
+        for column in chunk_numeric_columns:
+            minimums[column] = min(minimums.get(column, np.inf), chunk[column].min())
+            maximums[column] = max(maximums.get(column, -np.inf), chunk[column].max())
+            if binning == "quantile" and bin_edges is None:
+                sketch = get_quantile_sketch(chunk[column])
+                sketches[column] = (
+                    sketch
+                    if column not in sketches
+                    else merge_quantile_sketches(sketches[column], sketch)
+                )
+        for column in columns:
+            if uniques[column] is not None:
+                uniques[column].update(chunk[column].dropna().unique())
+                if len(uniques[column]) >= unique_value_limit:
+                    uniques[column] = None
+
+    numeric_columns = [column for column in columns if column in numeric_columns]
+    if bin_edges is None and binning == "quantile":
+        bin_edges = {
+            column: get_sketch_bin_edges(sketches[column], bins)
+            for column in numeric_columns
+        }
+    elif bin_edges is None:
+        bin_edges = {
+            column: get_bin_edges(minimums[column], maximums[column], bins)
+            for column in numeric_columns
+        }
+    binned_columns = [f"{column}_{bins}bin" for column in numeric_columns]
+    categories = {
+        column: sorted(uniques[column])
+        for column in columns
+        if uniques[column] is not None
+        and len(uniques[column]) > 1
+        and column not in binned_columns
+    }
+    node_values = {
+        f"{column}_{bins}bin": np.arange(len(bin_edges[column]) - 1)
+        for column in numeric_columns
+    }
+    node_values.update(
+        {column: np.arange(-1, len(values)) for column, values in categories.items()}
+    )
+    return {
+        "bins": bins,
+        "bin_edges": {column: bin_edges[column] for column in numeric_columns},
+        "categories": categories,
+        "node_values": node_values,
+    }
+
+
+def transform_chunk(chunk: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Applies the preprocessing of the runner to a chunk of the data, using the bin edges and categories fixed in the
+    `schema` so every chunk is binned and coded the same way.
+
+    Args:
+        chunk (pd.DataFrame): A chunk of the raw data.
+        schema (dict): The schema output by get_streaming_schema().
+
+    Returns: The chunk as training data, with one column per node.
+
+    """
+    return transform_data(chunk, schema)
+
+
+def encode_chunk(
+    training_df: pd.DataFrame, node_values: Dict[str, np.ndarray]
+) -> np.ndarray:
+    """Encodes the training data of a chunk as the position of each value in `node_values`, so codes agree across
+    chunks. Missing values and values not in `node_values` are encoded as -1.
+
+    Args:
+        training_df (pd.DataFrame): The chunk as training data, as output by transform_chunk().
+        node_values (Dict[str, np.ndarray]): The sorted values each node can take.
+
+    Returns: The codes as a 2-d array with one column per node, in the order of `node_values`.
+
+    """
+    codes = np.empty(
+        (training_df.shape[0], len(node_values)), dtype=np.int16, order="F"
+    )
+    for i, (node, values) in enumerate(node_values.items()):
+        column = training_df[node].to_numpy(dtype=np.float64, na_value=np.nan)
+        positions = np.clip(np.searchsorted(values, column), 0, len(values) - 1)
+        codes[:, i] = np.where(values[positions] == column, positions, -1)
+    return codes
+
+
+@profiled
+def get_streaming_joint_counts(
+    file_location: str, schema: dict, chunksize: int = 100_000, n_jobs: int = 1
+) -> np.ndarray:
+    """Makes a pass over the .csv file summing the stacked joint counts of every pair of nodes, see
+    `utils.graphs.mutual_information.get_joint_counts`.
+
+    Args:
+        file_location (str): The .csv file location.
+        schema (dict): The schema output by get_streaming_schema().
+        chunksize (int): The number of rows to read at once.
+        n_jobs (int): The number of threads to count column blocks over.
+
+    Returns: The stacked joint count matrix of the nodes, in the order of `schema["node_values"]`.
+
+    """
+    node_values = schema["node_values"]
+    cardinalities = np.array([len(values) for values in node_values.values()])
+    joint_counts = 0
+    for chunk in import_csv_data_in_chunks(file_location, chunksize):
+        codes = encode_chunk(transform_chunk(chunk, schema), node_values)
+        joint_counts = joint_counts + get_joint_counts(
+            codes, cardinalities, n_jobs=n_jobs
+        )
+    return joint_counts
+
+
+@profiled
+def get_streaming_family_counts(
+    file_location: str,
+    schema: dict,
+    directed_edge_list: List[List[str]],
+    chunksize: int = 100_000,
+) -> Dict[str, np.ndarray]:
+    """Makes a pass over the .csv file summing the contingency table of each node and its parents.
+
+    Args:
+        file_location (str): The .csv file location.
+        schema (dict): The schema output by get_streaming_schema().
+        directed_edge_list: The directed edges of our graph, a list of lists with 2 elements, pointing an edge from left
+            to right.
+        chunksize (int): The number of rows to read at once.
+
+    Returns: The counts of each node's family, with axes ordered as `utils.graphs.structuring.get_parents` then the
+        node itself.
+
+    """
+    node_values = schema["node_values"]
+    node_position = {node: i for i, node in enumerate(node_values)}
+    families = {
+        node: node_parents + [node]
+        for node, node_parents in get_parents(directed_edge_list).items()
+    }
+    family_counts = {
+        node: np.zeros([len(node_values[v]) for v in family], dtype=np.int64)
+        for node, family in families.items()
+    }
+    for chunk in import_csv_data_in_chunks(file_location, chunksize):
+        codes = encode_chunk(transform_chunk(chunk, schema), node_values)
+        for node, family in families.items():
+            family_counts[node] += get_contingency_table(
+                codes[:, [node_position[v] for v in family]],
+                family_counts[node].shape,
+            )
+    return family_counts
+
+
+@profiled
+def fit_streaming_states(
+    file_location: str,
+    target: str,
+    bins: int = 5,
+    unique_value_limit: int = 15,
+    chunksize: int = 100_000,
+    bin_edges: Optional[Dict[str, np.ndarray]] = None,
+    binning: str = "uniform",
+) -> Tuple[dict, List[List[str]]]:
+    """Learns the structure and probability distributions of the Bayes net from a .csv file with bounded memory, giving
+    the same result as the in-memory runner.
+
+    Args:
+        file_location (str): The .csv file location.
+        target (str): Node in the network which we point edges to.
+        bins (int): The number of bins to use for numeric columns.
+        unique_value_limit (int): Maximum number of categories in categorical variables.
+        chunksize (int): The number of rows to read at once.
+        bin_edges (Dict[str, np.ndarray], optional): Bin edges to use for numeric columns instead of the ones found
+            from their range.
+        binning (str): How to find the bin edges, "uniform" or "quantile", see get_streaming_schema().
+
+    Returns: A tuple of the dictionary linking each node's name to its pomegranate state, and the directed edge list,
+        ready for `utils.modelling.bayes_model.get_bayesian_network`.
+
+    """
+    schema = get_streaming_schema(
+        file_location, bins, unique_value_limit, chunksize, bin_edges, binning
+    )
+    node_values = schema["node_values"]
+    cardinalities = np.array([len(values) for values in node_values.values()])
+    joint_counts = get_streaming_joint_counts(file_location, schema, chunksize)
+    correlation_matrix = mutual_information_to_data_frame(
+        get_mutual_information_from_joint_counts(joint_counts, cardinalities),
+        list(node_values),
+    )
+    graph = tree.maximum_spanning_tree(nx.from_pandas_adjacency(correlation_matrix))
+    directed_edge_list = get_directed_edges(graph, target)
+
+    family_counts = get_streaming_family_counts(
+        file_location, schema, directed_edge_list, chunksize
+    )
+    node_counts = np.split(np.diag(joint_counts), np.cumsum(cardinalities)[:-1])
+    observed = {node: node_counts[i] > 0 for i, node in enumerate(node_values)}
+    node_states = {node: node_values[node][observed[node]] for node in node_values}
+    for node, node_parents in get_parents(directed_edge_list).items():
+        family_counts[node] = family_counts[node][
+            np.ix_(*[observed[v] for v in node_parents + [node]])
+        ]
+    state_dict = get_pomegranate_states_from_counts(
+        family_counts, node_states, directed_edge_list
+    )
+    return state_dict, directed_edge_list
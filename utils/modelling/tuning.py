@@ -0,0 +1,330 @@
+"""
+This module is for choosing how to bin the numeric columns, sweeping the number of bins and the binning strategy under
+k-fold cross validation and reporting the held out log-likelihood and predictions of the target for every candidate.
+
+Refitting the pipeline for every candidate would bin, encode and count the rows again each time. Instead the numeric
+columns are encoded once, in to fine bins whose edges are every edge any candidate can have: the equal width and
+quantile edges of every bin count, fixed on all of the data as `utils.modelling.validation.evaluate_pipeline` does, and
+the quantile candidates that supervised bins are merged from. Every candidate bin is then a run of fine bins, so the
+rows of each fold are counted once at the fine resolution and each candidate's joint counts, and so its mutual
+information and tree, come from adding up blocks of the fine counts. Its family counts come from the distinct fine rows
+of the fold, weighted by how often they occur, and supervised bins are merged from the fine counts against the target of
+the training rows alone, so they don't see the held out rows and can be swept, unlike in evaluate_pipeline().
+"""
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.graphs.counting import get_conditional_probabilities, get_contingency_table
+from utils.graphs.mutual_information import get_joint_counts
+from utils.graphs.structuring import orient_graph
+from utils.modelling.inference import ExactInferenceEngine, get_log_probabilities
+from utils.modelling.pipeline import (
+    encode_training_data,
+    get_cardinalities,
+    get_spanning_tree,
+)
+from utils.modelling.validation import get_cross_validation_report, get_folds
+from utils.preprocessing.bespoke_preprocessing import convert_columns_to_correct_types
+from utils.preprocessing.binning import (
+    BINNING_STRATEGIES,
+    fit_bin_edges,
+    get_supervised_boundaries,
+)
+from utils.preprocessing.generic_preprocessing import (
+    reduce_data_frame_to_numeric_columns,
+)
+from utils.profiling import profiled
+
+
+def get_bin_mapping(fine_edges: np.ndarray, bin_edges: np.ndarray) -> np.ndarray:
+    """Maps fine bins on to coarser bins whose edges are all fine edges, so the coarse bin of a value is the coarse bin
+    of its fine bin, and any table of fine counts can be coarsened by adding up its rows.
+
+    Args:
+        fine_edges (np.ndarray): The edges of the fine bins.
+        bin_edges (np.ndarray): The edges of the coarse bins, each of which must be one of the `fine_edges`.
+
+    Returns: The coarse bin of each fine bin, -1 for fine bins outside of the coarse edges.
+
+    """
+    # A fine bin is closed on the right, so it falls in the coarse bin its right edge does
+    mapping = np.searchsorted(bin_edges, fine_edges[1:], side="left") - 1
+    mapping[mapping >= len(bin_edges) - 1] = -1
+    return mapping
+
+
+def _get_code_mapping(
+    fine_states: List[str], fine_edges: np.ndarray, bin_edges: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Maps the codes of a column encoded in to fine bins on to the codes of its coarse bins, which are coded the way
+    `utils.preprocessing.encoding.encode_data_frame` codes them, as positions among the bins that hold any rows.
+
+    Returns: A tuple of the coarse code of each fine code and the coarse bin each coarse code refers to.
+
+    """
+    bins = get_bin_mapping(fine_edges, bin_edges)[
+        np.asarray(fine_states, dtype=np.int64)
+    ]
+    observed = np.unique(bins[bins >= 0])
+    return np.where(bins >= 0, np.searchsorted(observed, bins), -1), observed
+
+
+def _coarsen_codes(codes: np.ndarray, mappings: Dict[int, np.ndarray]) -> np.ndarray:
+    """Maps the fine codes of the columns in `mappings` on to their coarse codes, leaving the other columns as they are."""
+    codes = codes.copy()
+    for column, mapping in mappings.items():
+        fine_codes = codes[:, column]
+        codes[:, column] = np.where(fine_codes >= 0, mapping[fine_codes], -1)
+    return codes
+
+
+def _coarsen_joint_counts(
+    joint_counts: np.ndarray,
+    cardinalities: np.ndarray,
+    coarse_cardinalities: np.ndarray,
+    mappings: Dict[int, np.ndarray],
+) -> np.ndarray:
+    """Adds up the stacked joint counts of the fine codes, see `utils.graphs.mutual_information.get_joint_counts`, in
+    to the stacked joint counts of the coarse codes, with one product with a matrix of which coarse state each fine
+    state falls in on each side."""
+    offsets = np.concatenate([[0], np.cumsum(coarse_cardinalities)[:-1]])
+    coarse_states = np.concatenate(
+        [
+            np.where(mapping >= 0, mapping + offset, -1)
+            for mapping, offset in zip(
+                [
+                    mappings.get(column, np.arange(cardinality))
+                    for column, cardinality in enumerate(cardinalities)
+                ],
+                offsets,
+            )
+        ]
+    )
+    kept = np.flatnonzero(coarse_states >= 0)
+    aggregation = np.zeros((len(coarse_states), int(coarse_cardinalities.sum())))
+    aggregation[kept, coarse_states[kept]] = 1
+    return aggregation.T @ joint_counts @ aggregation
+
+
+def _fit_candidate(
+    fine_joint_counts: np.ndarray,
+    unique_codes: np.ndarray,
+    weights: np.ndarray,
+    fine_cardinalities: np.ndarray,
+    states: Dict[str, List[str]],
+    mappings: Dict[int, np.ndarray],
+    target: str,
+    smoothing: float,
+) -> ExactInferenceEngine:
+    """Learns the structure and probabilities of one candidate binning, with the coarse `states` of every node, from
+    the fine counts and distinct fine rows of the training rows."""
+    cardinalities = get_cardinalities(states)
+    joint_counts = _coarsen_joint_counts(
+        fine_joint_counts, fine_cardinalities, cardinalities, mappings
+    )
+    _, _, parents = orient_graph(get_spanning_tree(joint_counts, states), target)
+    codes = _coarsen_codes(unique_codes, mappings)
+    nodes = list(states)
+    cpts = dict()
+    for node, node_parents in parents.items():
+        family = [nodes.index(v) for v in node_parents + [node]]
+        cpts[node] = get_conditional_probabilities(
+            get_contingency_table(codes[:, family], cardinalities[family], weights),
+            smoothing,
+        )
+    return ExactInferenceEngine(states, parents, cpts)
+
+
+@profiled
+def sweep_bin_counts(
+    data_frame: pd.DataFrame,
+    target: str,
+    bin_counts: Sequence[int] = tuple(range(2, 11)),
+    strategies: Sequence[str] = BINNING_STRATEGIES,
+    k: int = 5,
+    seed: int = 0,
+    unique_value_limit: int = 15,
+    smoothing: float = 1.0,
+    candidates: int = 64,
+    n_jobs: int = 1,
+) -> pd.DataFrame:
+    """Cross validates the pipeline with every number of bins and binning strategy, refitting each candidate from
+    coarsened counts rather than from the rows.
+
+    Args:
+        data_frame (pd.DataFrame): The raw data.
+        target (str): Node in the network which we point edges to and predict.
+        bin_counts (Sequence[int]): The numbers of bins to try for the numeric columns.
+        strategies (Sequence[str]): The binning strategies to try each number of bins with, see
+            `utils.preprocessing.binning.fit_bin_edges`.
+        k (int): The number of folds.
+        seed (int): The seed of the folds, so the same arguments always give the same report.
+        unique_value_limit (int): Maximum number of categories in categorical variables.
+        smoothing (float): The pseudo-count every node's probabilities are smoothed with, so a held out value in a bin
+            no training row fell in doesn't give a log-likelihood of minus infinity.
+        candidates (int): The number of quantile bins that supervised bins are merged from.
+        n_jobs (int): The number of threads to count the joint counts of each fold over.
+
+    Returns: A pd.DataFrame with a row per candidate, its "strategy" and number of "bins", and the "log_likelihood",
+        the mean log density of the held out rows, with each numeric value's bin probability spread over the width of
+        its bin so candidates with different bins can be compared, alongside the "log_loss", "accuracy" and, for a
+        target with two states, "auc" of the held out predictions of the target, as in
+        `utils.modelling.validation.evaluate_pipeline`.
+
+    """
+    for strategy in strategies:
+        if strategy not in BINNING_STRATEGIES:
+            raise ValueError(
+                f'`strategies` must be from {BINNING_STRATEGIES}, not "{strategy}"'
+            )
+    numeric_df = reduce_data_frame_to_numeric_columns(
+        convert_columns_to_correct_types(data_frame)
+    )
+    bin_edges = {
+        (strategy, bins): fit_bin_edges(numeric_df, bins, strategy)
+        for strategy in strategies
+        if strategy != "supervised"
+        for bins in bin_counts
+    }
+    candidate_edges = (
+        fit_bin_edges(numeric_df, candidates, "quantile")
+        if "supervised" in strategies
+        else dict()
+    )
+    fine_edges = {
+        column: np.unique(
+            np.concatenate(
+                [
+                    edges[column]
+                    for edges in [*bin_edges.values(), candidate_edges]
+                    if column in edges
+                ]
+            )
+        )
+        for column in numeric_df.columns
+    }
+    del numeric_df
+    codes, pipeline = encode_training_data(
+        data_frame, target, unique_value_limit=unique_value_limit, bin_edges=fine_edges
+    )
+    node_states = pipeline["node_states"]
+    nodes = list(node_states)
+    cardinalities = get_cardinalities(node_states)
+    columns = {
+        nodes.index(f"{column}_{pipeline['bins']}bin"): column for column in fine_edges
+    }
+    target_column = nodes.index(target)
+    offsets = np.concatenate([[0], np.cumsum(cardinalities)[:-1]])
+    # The quantile candidate of each fine code, for supervised bins
+    candidate_mappings = {
+        column: get_bin_mapping(fine_edges[name], candidate_edges[name])[
+            np.asarray(node_states[nodes[column]], dtype=np.int64)
+        ]
+        for column, name in columns.items()
+        if name in candidate_edges
+    }
+
+    candidate_list = [
+        (strategy, bins) for strategy in strategies for bins in bin_counts
+    ]
+    results = {candidate: [] for candidate in candidate_list}
+    log_likelihoods = {candidate: [] for candidate in candidate_list}
+    folds = get_folds(len(codes), k, seed)
+    for fold in range(k):
+        training_codes = codes[folds != fold]
+        held_out_codes = codes[folds == fold]
+        fine_joint_counts = get_joint_counts(
+            training_codes, cardinalities, n_jobs=n_jobs
+        )
+        unique_codes, weights = np.unique(training_codes, axis=0, return_counts=True)
+        weights = weights.astype(np.float64)
+        target_states = slice(
+            offsets[target_column],
+            offsets[target_column] + cardinalities[target_column],
+        )
+
+        for strategy, bins in candidate_list:
+            states = dict(node_states)
+            mappings, log_widths = dict(), dict()
+            for column, name in columns.items():
+                if strategy == "supervised":
+                    # The counts of each quantile candidate against the target, from a block of the fine counts
+                    block = fine_joint_counts[
+                        offsets[column] : offsets[column] + cardinalities[column],
+                        target_states,
+                    ]
+                    mapping = candidate_mappings[column]
+                    counts = np.zeros((len(candidate_edges[name]) - 1, block.shape[1]))
+                    np.add.at(counts, mapping[mapping >= 0], block[mapping >= 0])
+                    column_edges = candidate_edges[name][
+                        get_supervised_boundaries(counts, bins)
+                    ]
+                else:
+                    column_edges = bin_edges[strategy, bins][name]
+                mappings[column], observed = _get_code_mapping(
+                    node_states[nodes[column]], fine_edges[name], column_edges
+                )
+                states[nodes[column]] = [str(state) for state in observed]
+                log_widths[column] = np.log(np.diff(column_edges))[observed]
+            engine = _fit_candidate(
+                fine_joint_counts,
+                unique_codes,
+                weights,
+                cardinalities,
+                states,
+                mappings,
+                target,
+                smoothing,
+            )
+            coarse_codes = _coarsen_codes(held_out_codes, mappings)
+            truth = coarse_codes[:, target_column].astype(np.int64)
+            # One pass gives the log probability of each held out row jointly with every state of the target, which
+            # holds both the posterior of the target and the likelihood of the whole row
+            joint = engine.log_likelihood(coarse_codes, target).to_numpy()
+            largest = joint.max(axis=1, keepdims=True)
+            largest[~np.isfinite(largest)] = 0
+            probabilities = np.exp(joint - largest)
+            totals = probabilities.sum(axis=1, keepdims=True)
+            log_likelihood = np.where(
+                truth >= 0,
+                joint[np.arange(len(truth)), truth],
+                get_log_probabilities(totals[:, 0]) + largest[:, 0],
+            )
+            for column, column_log_widths in log_widths.items():
+                observed = coarse_codes[:, column] >= 0
+                log_likelihood[observed] -= column_log_widths[
+                    coarse_codes[observed, column]
+                ]
+            log_likelihoods[strategy, bins].append(log_likelihood)
+            results[strategy, bins].append(
+                {
+                    "truth": truth,
+                    "probabilities": np.divide(
+                        probabilities,
+                        totals,
+                        out=np.zeros_like(probabilities),
+                        where=totals > 0,
+                    ),
+                }
+            )
+
+    report = []
+    for strategy, bins in candidate_list:
+        metrics = get_cross_validation_report(results[strategy, bins], pipeline)
+        report.append(
+            {
+                "strategy": strategy,
+                "bins": bins,
+                "log_likelihood": float(
+                    np.concatenate(log_likelihoods[strategy, bins]).mean()
+                ),
+                **{
+                    metric: metrics[metric]
+                    for metric in ("log_loss", "accuracy", "auc")
+                    if metric in metrics
+                },
+            }
+        )
+    return pd.DataFrame(report)
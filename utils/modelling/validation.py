@@ -0,0 +1,278 @@
+"""
+This module is for evaluating the fitted pipeline: how well it predicts the target under k-fold cross validation, and
+how stable its learned tree is under bootstrap resampling. The data is preprocessed and encoded once, and every fold and
+resample is refit from the counts of its rows of the codes with `utils.modelling.pipeline.fit_pipeline_from_codes`.
+The refits are independent, so they run over a pool of processes that share one memory-mapped copy of the codes.
+
+The bin edges and categories are fixed once on all of the data, which lets every refit share the same codes. With the
+default equal width bins this only uses the range of the held out rows, but "supervised" binning looks at their
+target, so it is refused for cross validation. `utils.modelling.tuning.sweep_bin_counts` fits the supervised edges of
+each fold on its training rows alone.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from utils.modelling.pipeline import (
+    encode_training_data,
+    fit_pipeline_from_codes,
+    get_pipeline_inference_engine,
+)
+from utils.profiling import profiled
+
+# The codes and pipeline shared with a worker process by evaluate_pipeline(), the codes memory-mapped so every worker
+# reads the same pages.
+_worker_codes: Optional[np.ndarray] = None
+_worker_pipeline: Optional[dict] = None
+
+
+def get_auc(truth: np.ndarray, scores: np.ndarray) -> float:
+    """Gets the area under the ROC curve from the ranks of the scores, the probability that a random positive is
+    scored above a random negative, counting ties as a half. The scores are rounded to 12 decimal places first, so
+    posteriors that should tie but differ in the last bit of their floats are ranked as ties.
+
+    Args:
+        truth (np.ndarray): Whether each row is positive.
+        scores (np.ndarray): The score of each row.
+
+    Returns: The area under the curve, nan if there are no positives or no negatives.
+
+    """
+    truth = np.asarray(truth, dtype=bool)
+    n_positive, n_negative = truth.sum(), (~truth).sum()
+    if n_positive == 0 or n_negative == 0:
+        return float("nan")
+    ranks = pd.Series(np.round(scores, 12)).rank(method="average").to_numpy()
+    return float(
+        (ranks[truth].sum() - n_positive * (n_positive + 1) / 2)
+        / (n_positive * n_negative)
+    )
+
+
+def get_log_loss(
+    truth: np.ndarray, probabilities: np.ndarray, eps: float = 1e-15
+) -> float:
+    """Gets the mean negative log probability given to the true state of each row.
+
+    Args:
+        truth (np.ndarray): The code of the true state of each row.
+        probabilities (np.ndarray): The probability of every state for every row, with a column per state.
+        eps (float): The smallest probability, so a zero probability for the true state doesn't give an infinite loss.
+
+    Returns: The log loss.
+
+    """
+    probabilities = np.clip(probabilities, eps, 1)
+    probabilities = probabilities / probabilities.sum(axis=1, keepdims=True)
+    return float(-np.log(probabilities[np.arange(len(truth)), truth]).mean())
+
+
+def _attach_data(file_location: Optional[str], pipeline: dict, codes=None) -> None:
+    """Gives a worker process the codes, memory-mapped from the file written by evaluate_pipeline(), and the pipeline
+    they were encoded with."""
+    global _worker_codes, _worker_pipeline
+    _worker_codes = (
+        codes if file_location is None else np.load(file_location, mmap_mode="r")
+    )
+    _worker_pipeline = pipeline
+
+
+def get_folds(n_rows: int, k: int, seed: int) -> np.ndarray:
+    """Returns: The fold of each row, the rows shuffled with `seed` and dealt in to `k` folds of nearly equal size."""
+    folds = np.empty(n_rows, dtype=np.int64)
+    folds[np.random.default_rng(seed).permutation(n_rows)] = np.arange(n_rows) % k
+    return folds
+
+
+def _refit(task: Tuple[str, int, int, int]) -> dict:
+    """Refits the pipeline in a worker process on one fold or resample of the shared codes.
+
+    Args:
+        task (Tuple[str, int, int, int]): The kind of refit, "fold" or "bootstrap", the seed, the fold to hold out and
+            the number of folds.
+
+    Returns: The undirected edges of the refit, and for a fold the held out rows, the code of their target and the
+        posterior of every state of the target for each of them.
+
+    """
+    kind, seed, fold, k = task
+    codes = _worker_codes
+    target = _worker_pipeline["target"]
+    if kind == "bootstrap":
+        rows = np.random.default_rng(seed).integers(0, len(codes), len(codes))
+        pipeline = fit_pipeline_from_codes(
+            np.asarray(codes[np.sort(rows)]), _worker_pipeline
+        )
+        return {"edges": [sorted(edge) for edge in pipeline["directed_edge_list"]]}
+
+    folds = get_folds(len(codes), k, seed)
+    pipeline = fit_pipeline_from_codes(
+        np.asarray(codes[folds != fold]), _worker_pipeline
+    )
+    held_out = np.flatnonzero(folds == fold)
+    held_out_codes = np.asarray(codes[held_out])
+    truth = held_out_codes[:, list(pipeline["node_states"]).index(target)].astype(
+        np.int64
+    )
+    scores = get_pipeline_inference_engine(pipeline).score(held_out_codes, target)
+    return {
+        "edges": [sorted(edge) for edge in pipeline["directed_edge_list"]],
+        "rows": held_out,
+        "truth": truth,
+        "probabilities": scores.to_numpy(),
+    }
+
+
+def get_cross_validation_report(results: List[dict], pipeline: dict) -> dict:
+    """Pools the held out predictions of every fold in to the cross validation metrics. Rows without a target are left
+    out.
+
+    Args:
+        results (List[dict]): The "truth", the code of the target, and the "probabilities" of every state of the target
+            of the held out rows of each fold.
+        pipeline (dict): The pipeline the folds were refit from, for its "target" and "node_states".
+
+    Returns: The number of "folds" and "rows" scored, and the "log_loss", "accuracy" and, for a target with two states,
+        "auc" of every fold pooled together, with the metrics of each fold as "fold_log_loss" and so on.
+
+    """
+    positive = len(pipeline["node_states"][pipeline["target"]]) - 1
+    truth = np.concatenate([result["truth"] for result in results])
+    probabilities = np.concatenate([result["probabilities"] for result in results])
+    folds = np.concatenate(
+        [np.full(len(result["truth"]), i) for i, result in enumerate(results)]
+    )
+    # Rows without a target can't be scored against it
+    known = truth >= 0
+    truth, probabilities, folds = truth[known], probabilities[known], folds[known]
+
+    def get_metrics(rows: np.ndarray) -> Dict[str, float]:
+        metrics = {
+            "log_loss": get_log_loss(truth[rows], probabilities[rows]),
+            "accuracy": float(
+                (probabilities[rows].argmax(axis=1) == truth[rows]).mean()
+            ),
+        }
+        if probabilities.shape[1] == 2:
+            metrics["auc"] = get_auc(
+                truth[rows] == positive, probabilities[rows, positive]
+            )
+        return metrics
+
+    report = {"folds": len(results), "rows": int(known.sum())}
+    report.update(get_metrics(np.arange(len(truth))))
+    fold_metrics = [get_metrics(folds == i) for i in range(len(results))]
+    for metric in fold_metrics[0]:
+        report[f"fold_{metric}"] = [metrics[metric] for metrics in fold_metrics]
+    return report
+
+
+def get_edge_frequencies(edge_lists: List[List[List[str]]]) -> Dict[str, float]:
+    """Counts how often each undirected edge appears in a list of learned trees.
+
+    Args:
+        edge_lists (List[List[List[str]]]): The edges of each tree.
+
+    Returns: A dictionary linking each edge, as "node -- node" with the nodes sorted, to the fraction of trees it is in,
+        most frequent first.
+
+    """
+    counts = dict()
+    for edges in edge_lists:
+        for edge in {tuple(sorted(edge)) for edge in edges}:
+            counts[edge] = counts.get(edge, 0) + 1
+    return {
+        f"{edge[0]} -- {edge[1]}": count / len(edge_lists)
+        for edge, count in sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    }
+
+
+@profiled
+def evaluate_pipeline(
+    data_frame: pd.DataFrame,
+    target: str,
+    k: int = 5,
+    n_resamples: int = 100,
+    seed: int = 0,
+    n_jobs: int = 1,
+    bins: int = 5,
+    unique_value_limit: int = 15,
+    binning: str = "uniform",
+    sparse: bool = False,
+    smoothing: Union[float, Dict[str, float]] = 1.0,
+) -> dict:
+    """Evaluates the pipeline fit by `utils.modelling.pipeline.fit_pipeline` on `data_frame` with k-fold cross
+    validation of its predictions of the `target` and bootstrap resampling of its learned tree.
+
+    Args:
+        data_frame (pd.DataFrame): The raw data.
+        target (str): Node in the network which we point edges to and predict.
+        k (int): The number of folds, 0 to skip cross validation.
+        n_resamples (int): The number of bootstrap resamples, 0 to skip them.
+        seed (int): The seed of the folds and resamples, so the same arguments always give the same report.
+        n_jobs (int): The number of processes to refit over.
+        bins (int): The number of bins to use for numeric columns.
+        unique_value_limit (int): Maximum number of categories in categorical variables.
+        binning (str): How to fit the bin edges, see `utils.modelling.pipeline.fit_pipeline`. "supervised" binning
+            raises a ValueError unless `k` is 0, since its edges would be fit on the target of the held out rows.
+        sparse (bool): Whether to refit with sparse probability tables, see `utils.modelling.pipeline.fit_pipeline`.
+        smoothing (Union[float, Dict[str, float]]): The pseudo-count the refit probabilities are smoothed with, 1 by
+            default as in `utils.modelling.tuning.sweep_bin_counts`, so a held out row with a combination of states no
+            training row had doesn't get zero probability and a log loss set by the clipping of `get_log_loss`.
+
+    Returns: A report with the "cross_validation" metrics, the "log_loss", "accuracy" and, for a target with two
+        states, "auc" of the held out predictions of every fold pooled together and of each fold, and the "bootstrap"
+        "edge_frequencies", the fraction of resamples whose tree has each edge, alongside the "seconds" it took.
+
+    """
+    if binning == "supervised" and k > 0:
+        raise ValueError(
+            '"supervised" binning fits the bin edges on the target of the held out rows, so it can\'t be cross '
+            "validated, use utils.modelling.tuning.sweep_bin_counts() or `k` 0"
+        )
+    start = time.perf_counter()
+    codes, pipeline = encode_training_data(
+        data_frame, target, bins, unique_value_limit, binning
+    )
+    pipeline.update(sparse=sparse, smoothing=smoothing)
+    tasks = [("fold", seed, fold, k) for fold in range(k)]
+    tasks += [("bootstrap", seed + 1 + i, 0, 0) for i in range(n_resamples)]
+
+    if n_jobs <= 1:
+        _attach_data(None, pipeline, codes)
+        results = [_refit(task) for task in tasks]
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            file_location = os.path.join(directory, "codes.npy")
+            np.save(file_location, codes)
+            with ProcessPoolExecutor(
+                max_workers=n_jobs,
+                initializer=_attach_data,
+                initargs=(file_location, pipeline),
+            ) as executor:
+                results = list(
+                    executor.map(
+                        _refit, tasks, chunksize=max(1, len(tasks) // (4 * n_jobs))
+                    )
+                )
+
+    report = {"rows": len(codes), "seconds": None}
+    if k > 0:
+        report["cross_validation"] = get_cross_validation_report(results[:k], pipeline)
+        report["cross_validation"]["edge_frequencies"] = get_edge_frequencies(
+            [result["edges"] for result in results[:k]]
+        )
+    if n_resamples > 0:
+        report["bootstrap"] = {
+            "resamples": n_resamples,
+            "edge_frequencies": get_edge_frequencies(
+                [result["edges"] for result in results[k:]]
+            ),
+        }
+    report["seconds"] = time.perf_counter() - start
+    return report
@@ -1,8 +1,13 @@
 import pandas as pd
 
+from utils.profiling import profiled
 
+
+@profiled
 def convert_columns_to_correct_types(df: pd.DataFrame) -> pd.DataFrame:
-    """Takes a dataframe and returns the same dataframe with columns in their correct dtype.
+    """Takes a dataframe and returns the same dataframe with columns in their correct dtype. `Sex` and `ExAng` become
+    categorical, with their values as strings in one vocabulary per column and a small integer code per row, so no
+    string is made per row.
 
     Args:
         df (pd.DataFrame): The dataframe to convert columns to correct type.
@@ -10,7 +15,10 @@ def convert_columns_to_correct_types(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         pd.DataFrame: `data` with correct column types.
     """
-    df["Sex"] = df["Sex"].astype("str")
-    df["ExAng"] = df["ExAng"].astype("str")
+    for column in ("Sex", "ExAng"):
+        categorical = df[column].astype("category")
+        df[column] = categorical.cat.rename_categories(
+            [str(category) for category in categorical.cat.categories]
+        )
 
     return df
@@ -0,0 +1,229 @@
+"""
+This module is for fitting the bin edges of numeric columns. A fitted binner is just its bin edges, one array per
+column, so the edges found on the training data can be kept in a pipeline and applied to new rows with
+`utils.preprocessing.generic_preprocessing.bin_numeric_data`, which bins with a single `np.searchsorted` per column.
+Equal width bins follow `pd.cut`; quantile bins put roughly the same number of rows in every bin, so outliers don't
+leave most of the bins empty; and supervised bins are the contiguous bins that keep the most mutual information with
+the target.
+"""
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from utils.preprocessing.generic_preprocessing import get_bin_codes, get_bin_edges
+from utils.profiling import profiled
+
+BINNING_STRATEGIES = ("uniform", "quantile", "supervised")
+
+
+def _get_edges_from_cut_points(
+    cut_points: np.ndarray, minimum: float, maximum: float, bins: int
+) -> np.ndarray:
+    """Turns sorted cut points between the minimum and maximum in to bin edges, with the lowest edge just below the
+    minimum as get_bin_edges() does since the bins are closed on the right. A column with a single value gets the equal
+    width edges of get_bin_edges()."""
+    if minimum == maximum:
+        return get_bin_edges(minimum, maximum, bins)
+    inner = np.unique(cut_points[(cut_points > minimum) & (cut_points < maximum)])
+    bin_edges = np.concatenate([[minimum], inner, [maximum]]).astype(np.float64)
+    bin_edges[0] -= (maximum - minimum) * 0.001
+    return bin_edges
+
+
+def get_quantile_bin_edges(values: pd.Series, bins: int) -> np.ndarray:
+    """Gets the edges of `bins` bins holding roughly the same number of values each. Quantiles that fall on the same
+    value, as they do for columns with a few very common values, are merged, so there may be fewer than `bins` bins.
+
+    Args:
+        values (pd.Series): The numeric values to bin, missing values are ignored.
+        bins (int): The number of bins to use.
+
+    Returns: The bin edges, for get_bin_codes().
+
+    """
+    values = values.to_numpy(dtype=np.float64, na_value=np.nan)
+    values = values[~np.isnan(values)]
+    quantiles = np.quantile(values, np.linspace(0, 1, bins + 1))
+    return _get_edges_from_cut_points(quantiles[1:-1], values.min(), values.max(), bins)
+
+
+def get_quantile_sketch(
+    values: pd.Series, size: int = 1000
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Summarises `values` for approximate quantiles, as `size` evenly spaced order statistics each standing in for its
+    share of the values. Sketches of separate chunks of a column can be merged with merge_quantile_sketches(), so the
+    quantiles of a column too big for memory can be found in one pass.
+
+    Args:
+        values (pd.Series): The numeric values to summarise, missing values are ignored.
+        size (int): The number of points to keep, the quantiles are accurate to about one part in `size`.
+
+    Returns: A tuple of the sorted points and the number of values each point stands for.
+
+    """
+    values = np.sort(values.to_numpy(dtype=np.float64, na_value=np.nan))
+    values = values[: np.searchsorted(values, np.nan)]
+    if len(values) <= size:
+        return values, np.ones(len(values))
+    positions = np.linspace(0, len(values) - 1, size).round().astype(np.int64)
+    return values[positions], np.full(size, len(values) / size)
+
+
+def merge_quantile_sketches(
+    sketch: Tuple[np.ndarray, np.ndarray],
+    other_sketch: Tuple[np.ndarray, np.ndarray],
+    size: int = 1000,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Merges two sketches output by get_quantile_sketch(), compressing the result back to `size` points if it is
+    bigger, the smallest and largest values are always kept.
+
+    Args:
+        sketch (Tuple[np.ndarray, np.ndarray]): A sketch of some values.
+        other_sketch (Tuple[np.ndarray, np.ndarray]): A sketch of some other values.
+        size (int): The number of points to keep.
+
+    Returns: The sketch of all of the values.
+
+    """
+    points = np.concatenate([sketch[0], other_sketch[0]])
+    weights = np.concatenate([sketch[1], other_sketch[1]])
+    order = np.argsort(points, kind="stable")
+    points, weights = points[order], weights[order]
+    if len(points) <= size:
+        return points, weights
+    total = weights.sum()
+    # The centre of each point's share of the values, and the ranks of `size` evenly spaced order statistics
+    centres = np.cumsum(weights) - weights / 2
+    ranks = np.linspace(centres[0], centres[-1], size)
+    positions = np.searchsorted(centres, ranks).clip(0, len(points) - 1)
+    return points[positions], np.full(size, total / size)
+
+
+def get_sketch_bin_edges(
+    sketch: Tuple[np.ndarray, np.ndarray], bins: int
+) -> np.ndarray:
+    """Gets the edges of approximate quantile bins, as get_quantile_bin_edges() does, from a sketch of the values.
+
+    Args:
+        sketch (Tuple[np.ndarray, np.ndarray]): The sketch, as output by get_quantile_sketch().
+        bins (int): The number of bins to use.
+
+    Returns: The bin edges, for get_bin_codes().
+
+    """
+    points, weights = sketch
+    centres = (np.cumsum(weights) - weights / 2) / weights.sum()
+    quantiles = np.interp(np.linspace(0, 1, bins + 1)[1:-1], centres, points)
+    return _get_edges_from_cut_points(quantiles, points[0], points[-1], bins)
+
+
+def get_supervised_boundaries(counts: np.ndarray, bins: int) -> np.ndarray:
+    """Finds the best way to merge neighbouring bins in to `bins` contiguous bins, keeping the most mutual information
+    with the target. Since mutual information is a sum over the bins, the best merge is found exactly by dynamic
+    programming over the counts alone.
+
+    Args:
+        counts (np.ndarray): The number of rows of each class of the target in each bin, with a row per bin.
+        bins (int): The number of bins to merge them in to.
+
+    Returns: The boundaries of the merged bins as positions among the edges of the bins, from 0 to `len(counts)`.
+
+    """
+    n_candidates, n_classes = counts.shape
+    if n_candidates <= bins:
+        return np.arange(n_candidates + 1)
+
+    # The mutual information each run of candidates i..j-1 adds as a single bin, for every i < j
+    cumulative = np.concatenate([np.zeros((1, n_classes)), np.cumsum(counts, axis=0)])
+    total = cumulative[-1].sum()
+    class_totals = cumulative[-1]
+    joint = cumulative[None, :, :] - cumulative[:, None, :]
+    bin_totals = joint.sum(axis=-1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = joint / total * np.log(joint * total / (bin_totals * class_totals))
+    gain = np.nansum(np.where(joint > 0, terms, 0), axis=-1)
+    gain[np.tril_indices(n_candidates + 1)] = -np.inf
+
+    # best[j] is the most information from splitting candidates 0..j-1 in to the current number of bins
+    best = gain[0].copy()
+    choices = []
+    for _ in range(bins - 1):
+        options = best[:, None] + gain
+        choices.append(options.argmax(axis=0))
+        best = options.max(axis=0)
+    boundaries = [n_candidates]
+    for choice in reversed(choices):
+        boundaries.append(choice[boundaries[-1]])
+    return np.array([0] + sorted(boundaries))
+
+
+def get_supervised_bin_edges(
+    values: pd.Series, target: pd.Series, bins: int, candidates: int = 64
+) -> np.ndarray:
+    """Gets the edges of the `bins` contiguous bins whose codes have the most mutual information with the `target`. The
+    values are first cut in to `candidates` quantile bins, which are then merged by get_supervised_boundaries().
+
+    Args:
+        values (pd.Series): The numeric values to bin.
+        target (pd.Series): The target, aligned to `values`. Rows where either is missing are ignored.
+        bins (int): The number of bins to use.
+        candidates (int): The number of quantile bins to merge, the more there are the finer the cut points can be.
+
+    Returns: The bin edges, for get_bin_codes().
+
+    """
+    candidate_edges = get_quantile_bin_edges(values, candidates)
+    value_codes = np.asarray(get_bin_codes(values, candidate_edges).codes)
+    target_codes, _ = pd.factorize(target)
+    present = (value_codes >= 0) & (target_codes >= 0)
+    n_candidates = len(candidate_edges) - 1
+    if n_candidates <= bins:
+        return candidate_edges
+    n_classes = target_codes.max() + 1
+    counts = np.bincount(
+        value_codes[present].astype(np.int64) * n_classes + target_codes[present],
+        minlength=n_candidates * n_classes,
+    ).reshape(n_candidates, n_classes)
+    return candidate_edges[get_supervised_boundaries(counts, bins)]
+
+
+@profiled
+def fit_bin_edges(
+    numeric_data: pd.DataFrame,
+    bins: int,
+    strategy: str = "uniform",
+    target: Optional[pd.Series] = None,
+) -> Dict[str, np.ndarray]:
+    """Fits the bin edges of every column of `numeric_data`, to pass to
+    `utils.preprocessing.generic_preprocessing.bin_numeric_data` for the training data and any new data.
+
+    Args:
+        numeric_data (pd.DataFrame): The numeric columns to bin.
+        bins (int): The number of bins to use.
+        strategy (str): "uniform" for equal width bins, "quantile" for equal frequency bins or "supervised" for the bins
+            with the most mutual information with the `target`.
+        target (pd.Series, optional): The target, aligned to `numeric_data`, needed for "supervised" binning.
+
+    Returns: A dictionary linking each column to its bin edges.
+
+    """
+    if strategy not in BINNING_STRATEGIES:
+        raise ValueError(
+            f'`strategy` must be one of {BINNING_STRATEGIES}, not "{strategy}"'
+        )
+    if strategy == "supervised" and target is None:
+        raise ValueError('`target` must be given for "supervised" binning')
+    bin_edges = dict()
+    for column in numeric_data.columns:
+        if strategy == "uniform":
+            bin_edges[column] = get_bin_edges(
+                numeric_data[column].min(), numeric_data[column].max(), bins
+            )
+        elif strategy == "quantile":
+            bin_edges[column] = get_quantile_bin_edges(numeric_data[column], bins)
+        else:
+            bin_edges[column] = get_supervised_bin_edges(
+                numeric_data[column], target, bins
+            )
+    return bin_edges
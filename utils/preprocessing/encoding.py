@@ -0,0 +1,136 @@
+"""
+This module is for functions that turn discretised columns in to compact integer codes
+"""
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from utils.profiling import profiled
+
+
+def get_code_dtype(cardinality: int) -> np.dtype:
+    """Gets the smallest signed integer dtype that can hold the codes of a variable with `cardinality` states, leaving
+    room for the -1 missing value code.
+
+    Args:
+        cardinality (int): The number of states of the variable.
+
+    Returns: The numpy dtype to store the codes in.
+
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if cardinality <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+@profiled
+def encode_data_frame(data: pd.DataFrame) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """Encodes every column of `data` as dense integer codes `0..k-1`, with the codes following the sorted order of the
+    unique values of the column, and missing values encoded as -1.
+
+    Args:
+        data (pd.DataFrame): The discretised data to encode.
+
+    Returns: A tuple of the codes as a 2-d array with one column per column of `data`, and a dictionary mapping each
+        column name to the array of values its codes refer to.
+
+    """
+    states = dict()
+    column_codes = []
+    for column in data.columns:
+        codes, uniques = pd.factorize(data[column], sort=True)
+        states[column] = np.asarray(uniques)
+        column_codes.append(codes)
+    dtype = get_code_dtype(
+        max([len(uniques) for uniques in states.values()], default=0)
+    )
+    encoded = np.empty((data.shape[0], data.shape[1]), dtype=dtype, order="F")
+    for i, codes in enumerate(column_codes):
+        encoded[:, i] = codes
+    return encoded, states
+
+
+def _get_sample_cardinalities(sample: pd.DataFrame) -> Dict[str, int]:
+    """Counts the unique values, ignoring missing values, of every column of a sample at once. The numeric columns are
+    sorted together as one 2-d array and their unique values counted from the changes down each column, and every other
+    column is hashed with `pd.unique`."""
+    numeric_columns = [
+        column
+        for column, dtype in sample.dtypes.items()
+        if is_numeric_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype)
+    ]
+    cardinalities = dict()
+    if numeric_columns and len(sample):
+        values = np.sort(
+            sample[numeric_columns].to_numpy(dtype=np.float64, na_value=np.nan), axis=0
+        )
+        # Missing values sort to the end of each column, so only count changes in to values that aren't missing
+        changes = (np.diff(values, axis=0) != 0) & ~np.isnan(values[1:])
+        counts = changes.sum(axis=0) + ~np.isnan(values[0])
+        cardinalities.update(zip(numeric_columns, counts.tolist()))
+    for column in sample.columns:
+        if column not in cardinalities:
+            cardinalities[column] = sample[column].nunique()
+    return cardinalities
+
+
+@profiled
+def encode_categorical_columns(
+    data: pd.DataFrame,
+    cols_to_exclude: Sequence[str] = (),
+    unique_value_limit: int = 15,
+    sample_size: int = 10_000,
+) -> Tuple[pd.DataFrame, Dict[str, list]]:
+    """Finds the categorical columns of `data`, those with more than one and fewer than `unique_value_limit` unique
+    values, and codes them, in one pass over each column. The first `sample_size` rows of every column are profiled
+    together first, and a column that already has too many unique values in them is dropped without reading the rest.
+    Every other column is hashed once with `pd.factorize`, which gives its number of unique values, its sorted
+    categories and its codes together.
+
+    Args:
+        data (pd.DataFrame): The dataframe to find and code the categorical columns of.
+        cols_to_exclude (Sequence[str]): The columns we do not want returned even if they are within the
+            `unique_value_limit`.
+        unique_value_limit (int): Maximum number of categories in categorical variables.
+        sample_size (int): The number of rows to profile every column on before reading whole columns.
+
+    Returns: A tuple of the categorical columns of `data` as codes, in the smallest integer dtype that fits with -1 for
+        missing values, and the sorted categories of each column, the code of a value being its position, to code new
+        data the same way with encode_categories().
+
+    """
+    columns = [column for column in data.columns if column not in cols_to_exclude]
+    sample_cardinalities = _get_sample_cardinalities(data[columns].iloc[:sample_size])
+    codes, categories = dict(), dict()
+    for column in columns:
+        if sample_cardinalities[column] >= unique_value_limit:
+            continue
+        column_codes, uniques = pd.factorize(data[column], sort=True)
+        if 1 < len(uniques) < unique_value_limit:
+            codes[column] = column_codes.astype(get_code_dtype(len(uniques)))
+            categories[column] = np.asarray(uniques).tolist()
+    return pd.DataFrame(codes, index=data.index), categories
+
+
+def encode_categories(column: pd.Series, categories: list) -> np.ndarray:
+    """Codes a column against fixed categories, as found by encode_categorical_columns(), so new data is coded the same
+    way as the data the categories were found on. The values are looked up in a hash table of the categories, and a
+    categorical column only has its own categories looked up, once each.
+
+    Args:
+        column (pd.Series): The values to code.
+        categories (list): The categories, the code of a value is its position.
+
+    Returns: The codes, in the smallest integer dtype that fits, with -1 for missing values and values that aren't one
+        of the `categories`.
+
+    """
+    index = pd.Index(categories)
+    dtype = get_code_dtype(len(categories))
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        lookup = np.append(index.get_indexer(column.cat.categories), -1)
+        return lookup[column.cat.codes.to_numpy()].astype(dtype)
+    return index.get_indexer(column).astype(dtype)
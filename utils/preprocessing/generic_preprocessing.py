@@ -1,8 +1,17 @@
-from typing import List
+from typing import Dict, List, Optional
 
+import numpy as np
 import pandas as pd
 
+from utils.preprocessing.encoding import (
+    encode_categorical_columns,
+    encode_categories,
+    get_code_dtype,
+)
+from utils.profiling import profiled
 
+
+@profiled
 def reduce_data_frame_to_numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
     """Takes a dataframe and returns the same dataframe with only the columns that are numeric
 
@@ -23,14 +32,68 @@ def reduce_data_frame_to_numeric_columns(df: pd.DataFrame) -> pd.DataFrame:
     return df.select_dtypes(include=numeric_columns)
 
 
-def bin_numeric_data(numeric_data: pd.DataFrame, bins: int) -> pd.DataFrame:
+def get_bin_edges(minimum: float, maximum: float, bins: int) -> np.ndarray:
+    """Gets the edges of `bins` equal width bins over the range `minimum` to `maximum`, exactly as `pd.cut` does when
+    given an integer number of bins, so the edges can be fixed up front and reused across chunks of data.
+
+    Args:
+        minimum (float): The smallest value of the column.
+        maximum (float): The largest value of the column.
+        bins (int): The number of bins to use.
+
+    Returns: The `bins + 1` bin edges.
+
+    """
+    if minimum == maximum:
+        minimum -= 0.001 * abs(minimum) if minimum != 0 else 0.001
+        maximum += 0.001 * abs(maximum) if maximum != 0 else 0.001
+        return np.linspace(minimum, maximum, bins + 1, endpoint=True)
+    bin_edges = np.linspace(minimum, maximum, bins + 1, endpoint=True)
+    bin_edges[0] -= (maximum - minimum) * 0.001
+    return bin_edges
+
+
+def get_bin_codes(values: pd.Series, bin_edges: np.ndarray) -> pd.Categorical:
+    """Bins `values` the same way `pd.cut` does with `labels=False`, every bin closed on the right, but keeps the bins as
+    the codes of a categorical, in the smallest integer dtype that fits, instead of as int64 or float64 labels.
+
+    Args:
+        values (pd.Series): The numeric values to bin.
+        bin_edges (np.ndarray): The edges of the bins, as output by get_bin_edges().
+
+    Returns: The bin of each value as a categorical over the bin numbers, missing for missing values and values outside
+        of the edges.
+
+    """
+    n_bins = len(bin_edges) - 1
+    codes = (
+        np.searchsorted(
+            bin_edges, values.to_numpy(dtype=np.float64, na_value=np.nan), side="left"
+        )
+        - 1
+    )
+    codes[codes >= n_bins] = -1
+    return pd.Categorical.from_codes(
+        codes.astype(get_code_dtype(n_bins)), categories=range(n_bins)
+    )
+
+
+@profiled
+def bin_numeric_data(
+    numeric_data: pd.DataFrame,
+    bins: int,
+    bin_edges: Optional[Dict[str, np.ndarray]] = None,
+) -> pd.DataFrame:
     """Get numeric columns and distribute them in to `bins` bins.
 
     Args:
         numeric_data (pd.DataFrame): The data to bin.
         bins (int): The number of bins to use.
+        bin_edges (Dict[str, np.ndarray], optional): Fixed bin edges for each column, as output by get_bin_edges(), if
+            not given the edges are taken from the range of each column in `numeric_data`.
 
-    Returns: `numeric_data` with all columns binned.
+    Returns: `numeric_data` with all columns binned, each column a categorical over its bin numbers, see
+        get_bin_codes().
 
     """
     numeric_columns = {
@@ -51,19 +114,26 @@ def bin_numeric_data(numeric_data: pd.DataFrame, bins: int) -> pd.DataFrame:
             "All columns in `numeric_data` passed in to bin_numeric_data() must be numeric"
         )
 
-    numeric_data = numeric_data.copy()
-
-    binned_data = pd.DataFrame()
+    binned_data = pd.DataFrame(index=numeric_data.index)
     for column in numeric_data.columns:
-        binned_data[f"{column}_{bins}bin"] = pd.cut(
-            numeric_data[column], bins, labels=False
+        column_bin_edges = (
+            get_bin_edges(numeric_data[column].min(), numeric_data[column].max(), bins)
+            if bin_edges is None
+            else bin_edges[column]
+        )
+        binned_data[f"{column}_{bins}bin"] = get_bin_codes(
+            numeric_data[column], column_bin_edges
         )
 
     return binned_data
 
 
+@profiled
 def reduce_data_frame_to_categorical_columns(
-    data: pd.DataFrame, cols_to_exclude: List[str], unique_value_limit: int = 15
+    data: pd.DataFrame,
+    cols_to_exclude: List[str],
+    unique_value_limit: int = 15,
+    categories: Optional[Dict[str, list]] = None,
 ) -> pd.DataFrame:
     """Takes a dataframe and returns the same dataframe with only the columns that are categorical.
 
@@ -73,15 +143,18 @@ def reduce_data_frame_to_categorical_columns(
         `unique_value_limit` unique_value_limit (int): The maximum number of unique values we let a categorical column
         have for inclusion.
         unique_value_limit: Maximum number of categories in categorical variables.
+        categories (Dict[str, list], optional): Fixed categories for each categorical column, if given these columns are
+            returned coded against these categories instead of the ones found in `data`.
 
     Returns:
         pd.DataFrame: `data` with only categorical columns
     """
-    categorical_columns = []
-    for col in data.columns:
-        if (1 < data[col].nunique() < unique_value_limit) and (
-            col not in cols_to_exclude
-        ):
-            categorical_columns.append(col)
-    categorical_data = data[categorical_columns]
-    return categorical_data.apply(lambda x: x.astype("category").cat.codes)
+    if categories is not None:
+        return pd.DataFrame(
+            {
+                col: encode_categories(data[col], col_categories)
+                for col, col_categories in categories.items()
+            },
+            index=data.index,
+        )
+    return encode_categorical_columns(data, cols_to_exclude, unique_value_limit)[0]
@@ -0,0 +1,191 @@
+"""
+This module is for seeing where time and memory go inside the pipeline. Functions decorated with `profiled` and blocks
+wrapped in `profile_stage` record their wall time, the rows and columns of the data they handle and, optionally, how much
+memory they use. Nothing is recorded until enable_profiling() is called, and until then the decorators cost one check of
+a global per call.
+"""
+import cProfile
+from contextlib import contextmanager
+import functools
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import resource
+except ImportError:  # resource is only available on Unix
+    resource = None
+
+# The records of the current run, None while profiling is disabled.
+_records: Optional[List[dict]] = None
+# The stages currently running, innermost last, each with the highest traced memory peak of its finished children.
+_stack: List[dict] = []
+_trace_memory = False
+
+
+def enable_profiling(trace_memory: bool = False) -> None:
+    """Starts recording stages, throwing away the records of any previous run.
+
+    Args:
+        trace_memory (bool): Also record the peak memory allocated by Python in each stage with `tracemalloc`. This
+            slows everything down, so only use it when looking for memory.
+
+    """
+    global _records, _trace_memory
+    _records = []
+    _stack.clear()
+    _trace_memory = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable_profiling() -> List[dict]:
+    """Stops recording stages.
+
+    Returns: The records of the run, one dictionary per stage in the order the stages finished.
+
+    """
+    global _records, _trace_memory
+    records = _records if _records is not None else []
+    if _trace_memory:
+        tracemalloc.stop()
+    _records = None
+    _trace_memory = False
+    _stack.clear()
+    return records
+
+
+def is_profiling_enabled() -> bool:
+    """Returns: Whether stages are being recorded."""
+    return _records is not None
+
+
+def _get_max_rss() -> Optional[int]:
+    """Returns: The peak resident set size of the process so far in bytes, or None where it is not available."""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _get_shape(data: Any) -> Dict[str, int]:
+    """Returns: The rows and columns of `data` if it is a DataFrame or an array, otherwise nothing."""
+    shape = getattr(data, "shape", None)
+    if not isinstance(shape, tuple) or len(shape) == 0:
+        return dict()
+    return {"rows": int(shape[0]), "columns": int(shape[1]) if len(shape) > 1 else 1}
+
+
+@contextmanager
+def profile_stage(stage: str, data: Any = None):
+    """Records the wall time of the `with` block as a stage of the run, doing nothing while profiling is disabled.
+
+    Args:
+        stage (str): The name to record the stage under.
+        data (optional): The data the stage works on, whose rows and columns are recorded.
+
+    """
+    if _records is None:
+        yield
+        return
+
+    entry = {"child_peak": 0}
+    if _trace_memory:
+        current, peak = tracemalloc.get_traced_memory()
+        if _stack:
+            _stack[-1]["child_peak"] = max(_stack[-1]["child_peak"], peak)
+        tracemalloc.reset_peak()
+        entry["start_memory"] = current
+    _stack.append(entry)
+    max_rss = _get_max_rss()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = {
+            "stage": stage,
+            "depth": len(_stack) - 1,
+            "wall_time": time.perf_counter() - start,
+        }
+        if max_rss is not None:
+            record["max_rss_increase"] = _get_max_rss() - max_rss
+        _stack.pop()
+        if _trace_memory:
+            peak = max(tracemalloc.get_traced_memory()[1], entry["child_peak"])
+            record["traced_peak"] = peak - entry["start_memory"]
+            if _stack:
+                _stack[-1]["child_peak"] = max(_stack[-1]["child_peak"], peak)
+        record.update(_get_shape(data))
+        if _records is not None:
+            _records.append(record)
+
+
+def profiled(func: Callable) -> Callable:
+    """Decorates a function so every call is recorded as a stage named after it, with the rows and columns of its first
+    argument."""
+    stage = f"{func.__module__}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if _records is None:
+            return func(*args, **kwargs)
+        with profile_stage(stage, args[0] if args else None):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def summarise_records(records: List[dict]) -> Dict[str, dict]:
+    """Adds up the records of each stage.
+
+    Args:
+        records (List[dict]): The records of a run, as output by disable_profiling().
+
+    Returns: A dictionary linking each stage's name to its number of calls and total wall time, in the order the stages
+        first finished.
+
+    """
+    summary = dict()
+    for record in records:
+        stage_summary = summary.setdefault(
+            record["stage"], {"calls": 0, "wall_time": 0.0}
+        )
+        stage_summary["calls"] += 1
+        stage_summary["wall_time"] += record["wall_time"]
+    return summary
+
+
+def write_profile_report(records: List[dict], file_location: str) -> None:
+    """Writes the records of a run and their summary to a JSON file.
+
+    Args:
+        records (List[dict]): The records of a run, as output by disable_profiling().
+        file_location (str): Where to write the report.
+
+    """
+    with open(file_location, "w") as file:
+        json.dump(
+            {"summary": summarise_records(records), "stages": records}, file, indent=2
+        )
+
+
+@contextmanager
+def cprofile_run(file_location: Optional[str]):
+    """Runs the `with` block under cProfile and saves the statistics, for `pstats` or snakeviz, to `file_location`. Does
+    nothing if `file_location` is None.
+
+    Args:
+        file_location (str, optional): Where to save the statistics.
+
+    """
+    if file_location is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(file_location)